@@ -0,0 +1,6 @@
+"""
+Benchmarks for Fillmore
+
+Each module in this package can be run on its own, for example
+`python -m benchmarks.dispatch`.
+"""
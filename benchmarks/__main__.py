@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Run the standard benchmark suite
+
+    python -m benchmarks [--quick] [--output results.json]
+                         [--baseline baseline.json] [--tolerance 0.1]
+
+Parse workloads report MB/s of source and execute workloads report
+instructions per second, for each engine. With `--baseline`, every
+result that is slower than the baseline by more than the tolerance is
+listed and the exit status is 1.
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+
+from stack import compile_program, parse_program, run
+from stack.jit import compile_jit
+from stack.native import compile_native
+from benchmarks.workloads import execute_workloads, parse_workloads
+
+
+def best_time(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def count_instructions(code):
+    """How many instructions running `code` takes."""
+    stack, pc, count = [], 0, 0
+    while pc < len(code):
+        pc = code[pc](stack, pc)
+        count += 1
+    return count
+
+
+def run_suite(scale=1.0, repeat=3):
+    results = {}
+    for name, (workload, size) in sorted(parse_workloads.items()):
+        source = workload(max(1, int(size * scale)))
+        megabytes = len(source.encode('utf-8')) / 1e6
+        seconds = best_time(lambda: list(parse_program(source)), repeat)
+        results['parse/' + name] = {
+            'seconds': seconds, 'rate': megabytes / seconds, 'unit': 'MB/s'}
+
+    for name, (workload, size) in sorted(execute_workloads.items()):
+        instructions = list(parse_program(workload(max(1, int(size * scale)))))
+        code = compile_program(instructions)
+        executed = count_instructions(code)
+        engines = {
+            'interpreter': lambda: run(code),
+            'jit': lambda: run(compile_jit(instructions)),
+            'native': compile_native(instructions),
+        }
+        for engine, func in sorted(engines.items()):
+            seconds = best_time(func, repeat)
+            results['execute/{}/{}'.format(name, engine)] = {
+                'seconds': seconds, 'rate': executed / seconds,
+                'unit': 'instr/s'}
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Names of results slower than `baseline` by more than `tolerance`."""
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        ratio = result['rate'] / baseline[name]['rate']
+        result['baseline_ratio'] = ratio
+        if ratio < 1 - tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    parser.add_argument('--quick', action='store_true',
+                        help='run smaller workloads once each')
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--baseline', help='compare against this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='allowed slowdown before failing (default 0.1)')
+    args = parser.parse_args(argv)
+
+    scale, repeat = (0.05, 1) if args.quick else (1.0, 3)
+    results = run_suite(scale, repeat)
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+
+    for name, result in sorted(results.items()):
+        line = '{:<36} {:14,.2f} {:<8}'.format(
+            name, result['rate'], result['unit'])
+        if 'baseline_ratio' in result:
+            line += ' {:6.2f}x baseline'.format(result['baseline_ratio'])
+        print(line)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'quick': args.quick,
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+
+    if regressions:
+        print('Regressions: ' + ', '.join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+Throughput of `stack.batch` against running each lane separately.
+
+    python -m benchmarks.batch
+"""
+import time
+
+import numpy as np
+
+from stack import compile_program, parse_program, run
+from stack.batch import run_batch
+
+# Counts each lane's initial value down to zero
+COUNTDOWN = '''
+nop
+@loop
+push -1
+add
+quiet not
+push 1
+add
+jump
+jump @loop
+'''
+
+
+def main(lanes=1000000, scalar_lanes=20000, longest=20):
+    instructions = list(parse_program(COUNTDOWN))
+    stacks = np.random.RandomState(0).randint(1, longest, (lanes, 1))
+    executed = 7 * stacks.sum() + lanes
+
+    start = time.time()
+    result = run_batch(instructions, stacks)
+    batch = time.time() - start
+
+    code = compile_program(instructions)
+    start = time.time()
+    for lane in range(scalar_lanes):
+        assert run(code, [float(stacks[lane, 0])]) == result.stack(lane)
+    scalar = (time.time() - start) * lanes / scalar_lanes
+
+    for name, elapsed in [('scalar (est.)', scalar), ('batch', batch)]:
+        print('{:<14} {:8.2f}s {:14,.0f} instr/s'.format(
+            name, elapsed, executed / elapsed))
+
+
+if __name__ == '__main__':
+    main()
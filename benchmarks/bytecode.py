@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+Memory use and load time of `Bytecode` against lists of `Instr`.
+
+    python -m benchmarks.bytecode
+"""
+import os
+import tempfile
+import time
+import tracemalloc
+
+from stack import parse_program
+from stack.bytecode import Bytecode
+
+
+def main(n=200000):
+    source = '\n'.join(['push 1', 'quiet add', 'dup 2', 'jump 1'] * (n // 4))
+
+    tracemalloc.start()
+    instructions = list(parse_program(source))
+    instr_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    bytecode = Bytecode.from_instructions(instructions)
+    bytecode_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print('Instr list {:8.1f} bytes/instr'.format(instr_bytes / n))
+    print('Bytecode   {:8.1f} bytes/instr'.format(bytecode_bytes / n))
+
+    fd, path = tempfile.mkstemp(suffix='.fmc')
+    os.close(fd)
+    try:
+        bytecode.save(path)
+        start = time.time()
+        list(parse_program(source))
+        parsed = time.time() - start
+        start = time.time()
+        loaded = Bytecode.load(path)
+        mapped = time.time() - start
+        loaded.close()
+        print('parse {:8.4f}s, load {:8.4f}s'.format(parsed, mapped))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
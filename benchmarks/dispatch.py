@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the handler table interpreter against the string dispatch loop it
+replaced.
+
+    python -m benchmarks.dispatch
+"""
+import timeit
+
+from stack import (binary_ops, unary_ops, compile_program, parse_program,
+                   run)
+from benchmarks.workloads import countdown
+
+
+def reference_eval(instructions):
+    """The `eval_program` loop before instructions were compiled."""
+    stack = []
+    current_instr = 0
+    while current_instr < len(instructions):
+        instr = instructions[current_instr]
+        current_instr += 1
+        if instr.op == 'push':
+            stack.append(instr.args[0])
+        elif instr.op == 'pop':
+            stack.pop()
+        elif instr.op in binary_ops:
+            if 'quiet' in instr.prefix:
+                b = stack[-1]
+                a = stack[-2]
+            else:
+                b = stack.pop()
+                a = stack.pop()
+            c = binary_ops[instr.op](b, a)
+            stack.append(c)
+        elif instr.op == 'swap':
+            swap_gap = int(instr.args[0] if instr.args else 1)
+            from_, to = -1, -(1 + swap_gap)
+            stack[from_], stack[to] = stack[to], stack[from_]
+        elif instr.op == 'dup':
+            dup_depth = int(instr.args[0] if instr.args else 1)
+            if dup_depth == 0:
+                continue
+            if dup_depth > len(stack):
+                raise IndexError("Cannot dup {} elements, stack has {}".format(
+                    dup_depth, len(stack)))
+            stack.extend(stack[-dup_depth:])
+        elif instr.op in unary_ops:
+            if 'quiet' in instr.prefix:
+                operand = stack[-1]
+            else:
+                operand = stack.pop()
+            c = unary_ops[instr.op](operand)
+            stack.append(c)
+        elif instr.op == 'jump':
+            if instr.args:
+                jump_distance = instr.args[0]
+            else:
+                jump_distance = stack[-1]
+                if 'quiet' not in instr.prefix:
+                    stack.pop()
+            current_instr += int(jump_distance) - 1
+            if current_instr > len(instructions) or current_instr < 0:
+                raise IndexError
+        elif instr.op == 'to':
+            if instr.args:
+                jump_to = instr.args[0]
+            else:
+                jump_to = stack[-1]
+                if 'quiet' not in instr.prefix:
+                    stack.pop()
+            if not float.is_integer(jump_to):
+                raise TypeError("Expected an integer, got a: " + jump_to)
+            current_instr = int(jump_to)
+            if current_instr >= len(instructions) or current_instr <= 0:
+                raise IndexError("Jump address {} out of bounds ({})".format(
+                    current_instr, len(instructions)-1))
+        elif instr.op == 'nop':
+            pass
+        else:
+            raise ValueError('Unknown instruction {}'.format(instr))
+    return stack
+
+
+def main(n=100000, repeat=5):
+    instructions = list(parse_program(countdown(n)))
+    code = compile_program(instructions)
+    fused = compile_program(instructions, fuse=True)
+    assert run(code) == run(fused) == reference_eval(instructions)
+    executed = 7 * n + 1
+
+    for name, func in [('string dispatch', lambda: reference_eval(instructions)),
+                       ('handler table', lambda: run(code)),
+                       ('fused', lambda: run(fused))]:
+        best = min(timeit.repeat(func, number=1, repeat=repeat))
+        print('{:<16} {:8.3f}s {:12,.0f} instr/s'.format(
+            name, best, executed / best))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+Cost of single-line edits with `IncrementalParser` against parsing the
+whole program again with `parse_program`.
+
+    python -m benchmarks.incremental
+"""
+import time
+
+from stack import parse_program
+from stack.incremental import IncrementalParser
+from benchmarks.parse import generated_source
+
+
+def main(lines=100000, edits=1000):
+    source = generated_source(lines)
+    start = time.time()
+    list(parse_program(source))
+    full = time.time() - start
+
+    start = time.time()
+    parser = IncrementalParser(source)
+    load = time.time() - start
+
+    count = parser.line_count
+    start = time.time()
+    for edit in range(edits):
+        line = edit * 7919 % count
+        # Insert a line, then take it out again
+        parser.edit(line, line, 'push 2; quiet mul')
+        parser.edit(line, line + 1, [])
+    per_edit = (time.time() - start) / (2 * edits)
+
+    start = time.time()
+    parser.instructions()
+    materialize = time.time() - start
+    print('{:,} lines'.format(count))
+    print('parse_program       {:9.2f} ms'.format(full * 1e3))
+    print('initial load        {:9.2f} ms'.format(load * 1e3))
+    print('edit                {:9.2f} ms'.format(per_edit * 1e3))
+    print('instructions()      {:9.2f} ms'.format(materialize * 1e3))
+
+
+if __name__ == '__main__':
+    main()
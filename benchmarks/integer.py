@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+Integer counter loops run by the float interpreter and by
+`compile_integer`.
+
+    python -m benchmarks.integer
+"""
+import time
+
+from stack import compile_program, parse_program, run
+from stack.integer import compile_integer
+from benchmarks.workloads import countdown, deep_stack
+
+
+def best_time(func, repeat=7):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(iterations=200000):
+    for workload in [countdown, deep_stack]:
+        instructions = list(parse_program(workload(iterations)))
+        code = compile_program(instructions, fuse=True)
+        program = compile_integer(instructions)
+        assert run(list(code)) == program()
+        times = [
+            ('float', best_time(lambda: run(code))),
+            ('integer', best_time(program)),
+        ]
+        base = times[0][1]
+        for name, seconds in times:
+            print('{:<12} {:<8} {:8.3f}s {:6.2f}x'.format(
+                workload.__name__, name, seconds, base / seconds))
+
+
+if __name__ == '__main__':
+    main()
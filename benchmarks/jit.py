@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Counter loops run by the interpreter, with hot loops traced by
+`compile_jit`, and translated whole by `compile_native`.
+
+    python -m benchmarks.jit
+"""
+import time
+
+from stack import compile_program, parse_program, run
+from stack.jit import compile_jit
+from stack.native import compile_native
+from benchmarks.workloads import arithmetic, countdown, deep_stack
+
+
+def best_time(func, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(iterations=200000):
+    for workload in [countdown, arithmetic, deep_stack]:
+        instructions = list(parse_program(workload(iterations)))
+        # Compiling is part of the cost for the JIT, since it happens on
+        # every run, but not for the others.
+        code = compile_program(instructions, fuse=True)
+        native = compile_native(instructions)
+        times = [
+            ('interpreter', best_time(lambda: run(code))),
+            ('jit', best_time(lambda: run(compile_jit(instructions)))),
+            ('native', best_time(native)),
+        ]
+        base = times[0][1]
+        for name, seconds in times:
+            print('{:<12} {:<12} {:8.3f}s {:6.2f}x'.format(
+                workload.__name__, name, seconds, base / seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""
+Counting loops run one trip at a time and skipped through by
+`compile_program(..., summarize=True)`.
+
+    python -m benchmarks.loops
+"""
+import time
+
+from stack import compile_program, parse_program, run
+from stack.loops import loop_summaries
+from benchmarks.workloads import arithmetic, countdown, deep_stack
+
+
+def best_times(funcs, repeat=7):
+    """The best time for each function, taking turns so none runs cold"""
+    best = [float('inf')] * len(funcs)
+    for _ in range(repeat):
+        for index, func in enumerate(funcs):
+            start = time.perf_counter()
+            func()
+            best[index] = min(best[index], time.perf_counter() - start)
+    return best
+
+
+def main(iterations=200000):
+    for workload in [countdown, deep_stack, arithmetic]:
+        instructions = list(parse_program(workload(iterations)))
+        code = compile_program(instructions, fuse=True)
+        summarized = compile_program(instructions, fuse=True, summarize=True)
+        assert run(code) == run(summarized)
+        times = list(zip(['stepped', 'summary'], best_times(
+            [lambda: run(code), lambda: run(summarized)])))
+        base = times[0][1]
+        for name, seconds in times:
+            print('{:<12} {:<8} {:8.4f}s {:9.1f}x'.format(
+                workload.__name__, name, seconds, base / seconds))
+        print('{:<12} {} loop(s) summarized'.format(
+            workload.__name__, len(loop_summaries(instructions))))
+
+
+if __name__ == '__main__':
+    main()
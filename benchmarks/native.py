@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the Python translation backend against the handler table and the
+fused interpreter.
+
+    python -m benchmarks.native
+"""
+import timeit
+
+from stack import compile_program, parse_program, run
+from stack.native import compile_native
+from benchmarks.workloads import countdown, forward_jumps
+
+
+def main(n=100000, repeat=5):
+    # forward_jumps runs 9 instructions per block, so about as many
+    for workload, size in [(countdown, n), (forward_jumps, n // 9)]:
+        instructions = list(parse_program(workload(size)))
+        code = compile_program(instructions)
+        fused = compile_program(instructions, fuse=True)
+        native = compile_native(instructions)
+        assert native() == run(code)
+
+        for name, func in [('handler table', lambda: run(code)),
+                           ('fused', lambda: run(fused)),
+                           ('native', native)]:
+            best = min(timeit.repeat(func, number=1, repeat=repeat))
+            print('{:<14} {:<16} {:8.3f}s'.format(
+                workload.__name__, name, best))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Parse throughput of `parse_program` against the two-pass parser it
+replaced.
+
+    python -m benchmarks.parse
+"""
+import re
+import time
+
+from stack import (Instr, arg_types, is_label, parse_program, prefixes,
+                   sigil_to_op, valid_ops)
+
+
+def reference_label_indexes(split_program):
+    """The label pass of the two-pass parser."""
+    label_indexes = {}
+    current_index = 0
+    for line in split_program:
+        parts = line.strip().split()
+        if not parts:
+            continue
+        # Two labels in a program is an error.
+        if parts[0] in label_indexes:
+            raise ValueError("Found the label {} on lines {} and {}"
+                .format(parts[0], label_indexes[parts[0]], current_index))
+        if is_label(parts[0]):
+            if len(parts) != 1:
+                raise ValueError("{} has a label before an instruction.".format(line))
+            else:
+                label_indexes[parts[0]] = current_index
+                continue
+        current_index += 1
+    return label_indexes
+
+
+def reference_parse(code):
+    """`parse_program` before it was rewritten to read the source once."""
+    split_program = re.split('\n|;', code)
+    label_indexes = reference_label_indexes(split_program)
+    for line in split_program:
+        parts = line.strip().split()
+        if not parts or is_label(parts[0]):
+            continue
+        op = None
+        args = []
+        prefix = []
+        label = None
+        for part in parts:
+            if label and is_label(part):
+                raise ValueError("Two labels on instruction {}".format(line))
+            if part in valid_ops:
+                op = part
+            elif part in sigil_to_op:
+                op = sigil_to_op[part]
+            elif part in prefixes:
+                prefix.append(prefixes[part])
+            elif is_label(part):
+                label = part
+            try:
+                args.append(float(part))
+            except ValueError:
+                pass
+        if label not in label_indexes and label is not None:
+            raise ValueError("The label, {}, was not defined".format(label))
+        if op not in ['jump', 'to', None] and label:
+            raise ValueError("Cannot use label with {}".format(op))
+        if op is None and label is None:
+            raise ValueError("Syntax Error: {}".format(line))
+        if op == 'jump' and label:
+            op = 'to'
+            args.append(float(label_indexes[label]))
+        check_type = {
+            int: lambda x: int(x) == x,
+            float: lambda x: isinstance(x, float),
+        }
+        arg_type_list = arg_types[op]
+        typechecked = False
+        for types in arg_type_list:
+            if len(types) != len(args):
+                continue
+            if all(check_type[t](arg) for t, arg in zip(types, args)):
+                typechecked = True
+                break
+        if not typechecked:
+            raise ValueError(
+                "Arguments for '{}' must be one of {}, were {}".format(
+                    op, ', '.join(str(item) for item in arg_type_list), args))
+        yield Instr(op, args, prefix)
+
+
+def generated_source(lines):
+    """A program of roughly `lines` lines mixing words, sigils and labels."""
+    chunk = [
+        '@block{}',
+        'push 1.5', '← 2', 'quiet add', '♯ ×', 'dup 2', 'swap', 'pop',
+        'push -3; ≤; not', 'jump 1', 'jump @block{}',
+    ]
+    source = []
+    for block in range(lines // len(chunk)):
+        for line in chunk:
+            source.append(line.format(block))
+    return '\n'.join(source)
+
+
+def main(lines=1000000):
+    source = generated_source(lines)
+    megabytes = len(source.encode('utf-8')) / 1e6
+    for name, parse in [('two-pass', reference_parse),
+                        ('single pass', parse_program)]:
+        start = time.time()
+        count = sum(1 for _ in parse(source))
+        elapsed = time.time() - start
+        print('{:<12} {:7.2f}s {:6.2f} MB/s {:10,.0f} instr/s'.format(
+            name, elapsed, megabytes / elapsed, count / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""
+How `stack.pool.evaluate_many` scales with the number of processes.
+
+    python -m benchmarks.pool
+"""
+import multiprocessing
+import time
+
+from benchmarks.workloads import countdown
+from stack.pool import evaluate_many
+
+
+def main(programs=256, n=20000):
+    sources = [countdown(n + i) for i in range(programs)]
+    processes = 1
+    baseline = None
+    while processes <= multiprocessing.cpu_count():
+        start = time.time()
+        for result in evaluate_many(sources, processes=processes, chunksize=4):
+            assert result.error is None
+        elapsed = time.time() - start
+        baseline = baseline or elapsed
+        print('{:3} processes {:8.2f}s {:6.2f}x'.format(
+            processes, elapsed, baseline / elapsed))
+        processes *= 2
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Requests per second through `stack.server`, one at a time and pipelined,
+against starting `python -m stack` for each program.
+
+    python -m benchmarks.server
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.workloads import countdown
+from stack.server import Client, EvalServer
+
+
+def main(requests=2000, n=100):
+    program = countdown(n)
+    directory = tempfile.mkdtemp()
+    with EvalServer(os.path.join(directory, 'bench.sock')) as server:
+        server.start()
+        with Client(server.address) as client:
+            key = client.request(program=program)['hash']
+
+            start = time.time()
+            for _ in range(requests):
+                client.request(hash=key)
+            report('one at a time', requests, time.time() - start)
+
+            start = time.time()
+            client.pipeline([{'hash': key}] * requests)
+            report('pipelined', requests, time.time() - start)
+
+            latency = client.request(stats=True)['latency']
+            print('latency p50 {:.3f} ms, p99 {:.3f} ms'.format(
+                1000 * latency['p50'], 1000 * latency['p99']))
+    os.rmdir(directory)
+
+    runs = 20
+    start = time.time()
+    for _ in range(runs):
+        process = subprocess.Popen([sys.executable, '-m', 'stack'],
+                                   stdin=subprocess.PIPE,
+                                   stdout=subprocess.DEVNULL)
+        process.communicate(program.encode())
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode,
+                                                process.args)
+    report('new process', runs, time.time() - start)
+
+
+def report(name, count, elapsed):
+    print('{:<14} {:10,.0f} requests/s'.format(name, count / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+What leaving a `Trace` on costs, on the default JIT path that
+`eval_program` takes and on the fused interpreter, each against the
+same engine without one.
+
+    python -m benchmarks.trace
+"""
+import time
+
+from stack import Trace, compile_program, parse_program, run
+from stack.jit import compile_jit
+from benchmarks.workloads import arithmetic, countdown, deep_stack
+
+
+def jit(instructions, trace=None):
+    return lambda: run(compile_jit(instructions, trace=trace), trace=trace)
+
+
+def interpreter(instructions, trace=None):
+    code = compile_program(instructions, fuse=True, trace=trace)
+    return lambda: run(code, trace=trace)
+
+
+def main(iterations=200000, repeat=15):
+    for workload in [countdown, arithmetic, deep_stack]:
+        instructions = list(parse_program(workload(iterations)))
+        for engine in [jit, interpreter]:
+            trace = Trace()
+            trace.begin(instructions)
+            plain, traced = engine(instructions), engine(instructions, trace)
+            # Interleaved, so that both see the same background load
+            plain_best = traced_best = float('inf')
+            for _ in range(repeat):
+                start = time.perf_counter()
+                plain()
+                plain_best = min(plain_best, time.perf_counter() - start)
+                start = time.perf_counter()
+                traced()
+                traced_best = min(traced_best, time.perf_counter() - start)
+            print('{:<12} {:<12} {:8.3f}s {:8.3f}s traced {:+6.1%}'.format(
+                workload.__name__, engine.__name__, plain_best, traced_best,
+                traced_best / plain_best - 1))
+
+
+if __name__ == '__main__':
+    main()
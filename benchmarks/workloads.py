@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Representative Fillmore programs for benchmarking
+
+Each workload function takes a size and returns program source. Parse
+workloads are measured in MB/s of source, execute workloads in
+instructions run per second.
+"""
+
+
+def countdown(n):
+    """A loop that counts `n` down to zero through `jump`, leaving [0]."""
+    return '''
+    nop
+    push {}
+    @loop
+    push -1
+    add
+    quiet not
+    push 1
+    add
+    jump
+    jump @loop
+    '''.format(n)
+
+
+def deep_stack(n, depth=200):
+    """Shuffle a deep stack around with `dup` and `swap`, `n` times."""
+    setup = '\n'.join('push {}'.format(i) for i in range(depth))
+    return setup + '''
+    push {}
+    @loop
+    swap {}
+    dup 4
+    swap 3
+    pop; pop; pop; pop
+    swap {}
+    push -1
+    add
+    quiet not
+    push 1
+    add
+    jump
+    jump @loop
+    pop
+    '''.format(n, depth - 1, depth - 1)
+
+
+def arithmetic(n):
+    """A loop doing `pow` and `div` heavy arithmetic, `n` times."""
+    return '''
+    nop
+    push 1.0001
+    push {}
+    @loop
+    swap
+    push 1.5; pow
+    push 3; div
+    push 2; pow
+    push 0.25; pow
+    swap
+    push -1
+    add
+    quiet not
+    push 1
+    add
+    jump
+    jump @loop
+    '''.format(n)
+
+
+def forward_jumps(n):
+    """`n` blocks of arithmetic, each jumping over a dead instruction."""
+    return '\n'.join(
+        'push {}; push 2; mul; push 1; add; jump 2; push 99; push 3; mul; '
+        'pop'.format(i) for i in range(n))
+
+
+def label_table(n):
+    """`n` labels, each jumped to from the end of the program."""
+    body = '\n'.join('@label{0}\npush {0}'.format(i) for i in range(n))
+    jumps = '\n'.join('jump @label{}'.format(i) for i in range(n))
+    return body + '\n' + jumps
+
+
+def sigils(n):
+    """`n` lines written with the Unicode sigils instead of words."""
+    chunk = ['← 1.5', '← 2', '♯ ×', '↔', '→', '÷', '← 3', '≤', '¬', '∅',
+             '↑ 1', '# −', '≥']
+    return '\n'.join(chunk[i % len(chunk)] for i in range(n))
+
+
+# name: (workload, size for a full run)
+parse_workloads = {
+    'label_table': (label_table, 200000),
+    'sigils': (sigils, 1000000),
+}
+
+execute_workloads = {
+    'countdown': (countdown, 200000),
+    'deep_stack': (deep_stack, 50000),
+    'arithmetic': (arithmetic, 50000),
+}
@@ -0,0 +1,23 @@
+import sys
+
+import pytest
+
+# Modules that need optional dependencies can't be imported for doctests
+# without them.
+collect_ignore = []
+try:
+    import numpy
+except ImportError:
+    collect_ignore += ['stack/batch.py', 'benchmarks/batch.py']
+
+if sys.version_info < (3, 7):
+    collect_ignore += ['stack/asynchronous.py', 'test_stack_async.py']
+
+
+@pytest.fixture(autouse=True)
+def stack_namespace(doctest_namespace):
+    # Examples in the submodules parse and run programs without importing
+    # what they need from `stack`.
+    from stack import parse_program, run
+    doctest_namespace['parse_program'] = parse_program
+    doctest_namespace['run'] = run
@@ -0,0 +1,1552 @@
+# -*- coding: utf-8 -*-
+from __future__ import division, print_function
+import gc
+import io
+import os
+import sys
+import time
+from array import array
+from collections import deque
+from itertools import islice
+
+
+class Instr(object):
+    def __init__(self, op, args=None, prefix=None):
+        args = [] if args is None else args
+        prefix = [] if prefix is None else prefix
+        self.op, self.args, self.prefix = op, args, prefix
+
+    def __repr__(self):
+        if self.prefix:
+            return 'Instr({!r}, {!r}, {!r})'.format(
+                self.op, self.args, self.prefix)
+        elif self.args:
+            return 'Instr({!r}, {!r})'.format(self.op, self.args)
+        else:
+            return 'Instr({!r})'.format(self.op)
+
+    def __eq__(self, other):
+        return (self.op == other.op and
+                self.args == other.args and
+                self.prefix == other.prefix)
+
+
+prefixes = {
+    'quiet': 'quiet',
+    '#': 'quiet',
+    '♯': 'quiet'
+}
+
+
+sigil_to_op = {
+    '←': 'push', '→': 'pop',
+    '↔': 'swap',
+    '↑': 'jump',
+    '+': 'add',
+    '-': 'sub', '−': 'sub',  # A minus isn't the same thing as a hyphen!
+    '*': 'mul', '×': 'mul',
+    '/': 'div', '÷': 'div',
+    '^': 'pow',
+    '!': 'not', '¬': 'not',
+    '=': 'eq',
+    '<': 'lt',
+    '>': 'gt',
+    '<=': 'le', '≤': 'le',
+    '>=': 'ge', '≥': 'ge',
+    '∅': 'nop',
+    '⇐': 'read', '⇒': 'emit',
+}
+
+valid_ops = [
+    'push', 'pop', 'dup', 'swap', 'jump',
+    'add', 'sub', 'mul', 'div', 'pow',
+    'eq', 'lt', 'gt', 'le', 'ge',
+    'not',
+    'to', 'jump',
+    'nop',
+    'read', 'emit',
+]
+
+arg_types = {
+    'push': [[float]],
+    'pop': [[]],
+    'dup': [[], [int]], 'swap': [[], [int]], 'jump': [[], [int]], 'to': [[], [int]],
+    'add': [[]], 'sub': [[]], 'mul': [[]], 'div': [[]], 'pow': [[]],
+    'eq': [[]], 'lt': [[]], 'gt': [[]], 'le': [[]], 'ge': [[]],
+    'not': [[]],
+    'nop': [[]],
+    'read': [[]], 'emit': [[]],
+}
+
+
+def parse_program(code):
+    r"""
+    Take a source code string and yield a sequence of instructions
+
+    >> list(parse_program('push 1'))
+    [Instr('push', [1.0])]
+
+    Various sigils from_ Unicode are supported as alternate versions of
+    operations, for example:
+    >> list(parse_program('← 1'))
+    [Instr('push', [1.0])]
+    >> list(parse_program('↔'))
+    [Instr('swap')]
+
+    Prefixes are placed before the instruction
+    Some prefixes also have sigils
+    >>> list(parse_program('♯ +'))
+    [Instr('add', [], ['quiet'])]
+    """
+    # Every jump target has to be known before the first instruction is
+    # yielded, so the whole program is parsed up front.
+    with _gc_paused():
+        instructions = list(parse_lines(code.replace(';', '\n').split('\n')))
+    for instr in instructions:
+        yield instr
+
+
+def parse_file(source):
+    """
+    Lazily parse a program from a path, a file object or an mmap
+
+    The source is read a line at a time, so memory use depends on the
+    number of labels rather than the size of the source. A jump to a label
+    that hasn't been seen yet is yielded straight away and its target is
+    filled in when the label turns up, so `to` targets are only final once
+    the generator is exhausted.
+    """
+    return parse_lines(_read_statements(source))
+
+
+def _read_statements(source):
+    if isinstance(source, (str, bytes)) or hasattr(source, '__fspath__'):
+        with io.open(source, encoding='utf-8') as f:
+            for statement in _read_statements(f):
+                yield statement
+        return
+    if not hasattr(source, '__iter__'):
+        # mmap objects aren't iterable by line
+        source = iter(source.readline, b'')
+    for line in source:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        for statement in line.split(';'):
+            yield statement
+
+
+def _patch_target(index, instr, target):
+    instr.args[-1] = float(target)
+
+
+def parse_lines(lines, patch=_patch_target):
+    """
+    Yield the instructions in an iterable of lines without `;`s
+
+    Jumps to labels that haven't been defined yet are yielded with a
+    target of 0, and `patch(index, instr, target)` is called once the
+    label is found. By default it updates the yielded instruction.
+    """
+    label_indexes = {}
+    # Forward references, by label, as (index, instr) pairs
+    pending = {}
+    index = 0
+    for line in lines:
+        parsed = parse_line(line)
+        if parsed is None:
+            continue
+        instr, label = parsed
+        if instr is None:
+            # Two labels in a program is an error.
+            if label in label_indexes:
+                raise ValueError("Found the label {} on lines {} and {}"
+                    .format(label, label_indexes[label], index))
+            label_indexes[label] = index
+            for reference in pending.pop(label, ()):
+                patch(reference[0], reference[1], index)
+            continue
+        if label is not None:
+            if label in label_indexes:
+                instr.args[-1] = float(label_indexes[label])
+            else:
+                pending.setdefault(label, []).append((index, instr))
+        yield instr
+        index += 1
+    # Undefined label.
+    for label in pending:
+        raise ValueError("The label, {}, was not defined".format(label))
+
+
+class _gc_paused(object):
+    # Parsing allocates millions of small objects and no cycles, so the
+    # cycle collector would only slow it down.
+    def __enter__(self):
+        self.enabled = gc.isenabled()
+        gc.disable()
+
+    def __exit__(self, *exc_info):
+        if self.enabled:
+            gc.enable()
+
+
+def parse_line(line):
+    """
+    Parse a single line of source, which must not contain a `;`
+
+    Returns None for a blank line, `(None, label)` for a label definition,
+    or `(instr, label)` for an instruction, where `label` is the label it
+    jumps to, if any. The jump target is left for `parse_lines` to fill
+    in.
+
+    >>> parse_line('quiet ← 1')
+    (Instr('push', [1.0], ['quiet']), None)
+    >>> parse_line('@end')
+    (None, '@end')
+    """
+    parts = line.split()
+    if not parts:
+        return None
+    first = parts[0]
+    if first[0] == '@':
+        if len(parts) != 1:
+            raise ValueError("{} has a label before an instruction.".format(line))
+        return None, first
+
+    # Process the instruction
+    op = None
+    args = []
+    prefix = []
+    label = None
+    kinds, values = _token_kinds, _token_values
+    for part in parts:
+        kind = kinds.get(part)
+        if kind is _OP:
+            op = values[part]
+        elif kind is _PREFIX:
+            prefix.append(values[part])
+        elif part[0] == '@':
+            # Check for two labels in instruction.
+            if label:
+                raise ValueError("Two labels on instruction {}".format(line))
+            label = part
+        else:
+            try:
+                args.append(float(part))
+            except ValueError:
+                pass
+
+    if label:
+        # Not a naked label or not an op which supports labels
+        if op not in ('jump', 'to'):
+            raise ValueError("Cannot use label with {}".format(op))
+        # Handle jump @label. The target is filled in by parse_lines.
+        op = 'to'
+        args.append(0.0)
+    elif op is None:
+        # Not an instruction or missing label
+        raise ValueError("Syntax Error: {}".format(line))
+
+    # Type check the instruction
+    check = _arg_checks[op].get(len(args), _wrong_arg_count)
+    if check is not None and not check(args):
+        raise ValueError(
+            "Arguments for '{}' must be one of {}, were {}".format(
+                op, ', '.join(str(item) for item in arg_types[op]), args))
+    return Instr(op, args, prefix), label
+
+
+_OP = 'op'
+_PREFIX = 'prefix'
+_token_kinds = {}
+_token_values = {}
+for _op in valid_ops:
+    _token_kinds[_op], _token_values[_op] = _OP, _op
+for _sigil, _op in sigil_to_op.items():
+    _token_kinds[_sigil], _token_values[_sigil] = _OP, _op
+for _token, _prefix in prefixes.items():
+    _token_kinds[_token], _token_values[_token] = _PREFIX, _prefix
+del _op, _sigil, _token, _prefix
+
+_check_type = {
+    int: lambda x: int(x) == x,
+    float: lambda x: isinstance(x, float),
+}
+
+
+def _make_arg_check(types):
+    checks = tuple(_check_type[t] for t in types)
+    if all(t is float for t in types):
+        # Arguments only ever come from float(), so there is nothing to check.
+        return None
+    if len(checks) == 1:
+        check = checks[0]
+        return lambda args: check(args[0])
+    return lambda args: all(check(arg) for check, arg in zip(checks, args))
+
+
+def _wrong_arg_count(args):
+    return False
+
+
+# For each op, a check for its arguments by number of arguments.
+# None means any arguments of that length are valid.
+_arg_checks = {
+    op: {len(types): _make_arg_check(types) for types in type_list}
+    for op, type_list in arg_types.items()
+}
+
+
+def is_label(label):
+    return label[0] == '@'
+
+
+def get_label_indexes(split_program):
+    """The index of the instruction each label in a list of lines marks"""
+    label_indexes = {}
+    index = 0
+    for line in split_program:
+        parsed = parse_line(line)
+        if parsed is None:
+            continue
+        instr, label = parsed
+        if instr is not None:
+            index += 1
+        elif label in label_indexes:
+            raise ValueError("Found the label {} on lines {} and {}"
+                .format(label, label_indexes[label], index))
+        else:
+            label_indexes[label] = index
+    return label_indexes
+
+
+def eval_program(program, optimize=False, budget=None, profile=None,
+                 verify=False, jit=True, source=None, sink=None,
+                 integer=False, trace=None, summarize=False):
+    """
+    Parse, compile and run a program, returning the final stack
+
+    `read` takes numbers from `source` and `emit` sends them to `sink`,
+    which can be anything `Source` and `Sink` accept. The sink is flushed
+    before this returns.
+
+    With `integer`, programs `integer_program` accepts are run on Python
+    ints by `compile_integer`, unless there's a budget, profile, trace or
+    stream, or loops are summarized.
+
+    A `Trace` records the last branches taken, and is dumped if the
+    program raises.
+
+    With `summarize`, simple counting loops are skipped through, and loops
+    that never change anything raise `InfiniteLoopError`, as described for
+    `compile_program`.
+
+    >>> out = []
+    >>> eval_program('read; pop; push 2; mul; emit', source=[21], sink=out)
+    []
+    >>> out
+    [42.0]
+    """
+    if source is not None and not isinstance(source, Source):
+        source = Source(source)
+    if sink is not None and not isinstance(sink, Sink):
+        sink = Sink(sink)
+    try:
+        return _eval_program(program, optimize, budget, profile, verify, jit,
+                             source, sink, integer, trace, summarize)
+    finally:
+        if sink is not None:
+            sink.flush()
+
+
+def _eval_program(program, optimize, budget, profile, verify, jit, source,
+                  sink, integer, trace, summarize):
+    # The engines and the cache are imported as they're needed, to keep
+    # `python -m stack` quick to start.
+    from stack.cache import program_cache
+    instructions = program_cache.get(program)
+    if optimize:
+        from stack.optimize import optimize_program
+        instructions, _ = optimize_program(instructions)
+    interpreted = budget is not None or profile is not None
+    if (integer and not interpreted and trace is None and not summarize and
+            source is None and sink is None):
+        from stack.integer import compile_integer, integer_program
+        if integer_program(instructions):
+            return compile_integer(instructions)()
+    # Programs that are proven not to underflow can skip the stack checks.
+    checked = True
+    if verify:
+        from stack.verify import verify_program
+        checked = not verify_program(instructions)
+    # Optimized instructions no longer line up with the source.
+    source_text = None if optimize else program
+    if profile is not None:
+        profile.begin(instructions, source_text)
+    if trace is not None:
+        trace.begin(instructions, source_text)
+    if jit and not interpreted:
+        # Traces run whole loops in one handler call, which budgets and
+        # profiles can't see into.
+        from stack.jit import compile_jit
+        code = compile_jit(instructions, checked=checked, source=source,
+                           sink=sink, summarize=summarize, trace=trace)
+    else:
+        # Budgets and profiles are per instruction, so fused instructions
+        # would be miscounted or hide detail.
+        fuse = not interpreted
+        code = compile_program(instructions, fuse=fuse, checked=checked,
+                               source=source, sink=sink, summarize=summarize,
+                               trace=trace)
+    if trace is None:
+        return run(code, budget=budget, profile=profile)
+    try:
+        return run(code, budget=budget, profile=profile, trace=trace)
+    except Exception:
+        trace.dump()
+        raise
+
+
+class BudgetExceeded(RuntimeError):
+    """Raised when a program runs more instructions than it was allowed."""
+
+
+class StackUnderflowError(IndexError):
+    """Raised by `verify_program` for programs that always underflow."""
+
+
+class InfiniteLoopError(RuntimeError):
+    """Raised for a loop that would go round forever changing nothing."""
+
+
+def run(code, stack=None, pc=0, budget=None, profile=None, trace=None):
+    """
+    Run a list of handlers from `compile_program` starting at `pc`
+
+    If `budget` is given, at most that many handlers are run before
+    `BudgetExceeded` is raised. A fused handler runs several instructions,
+    so budgets only count instructions for code compiled without `fuse`.
+    If `profile` is given, each instruction is
+    timed and counted in it; without one, no profiling code runs at all.
+    If `trace` is given, and no profile, the instruction that raised is
+    recorded in it (see `Trace.instrument` for the rest of the trace).
+
+    >>> run(compile_program(parse_program('push 2; push 3; mul')))
+    [6.0]
+    """
+    stack = [] if stack is None else stack
+    end = len(code)
+    if profile is not None:
+        return _run_profiled(code, stack, pc, budget, profile)
+    if trace is not None:
+        return _run_traced(code, stack, pc, budget, trace)
+    if budget is None:
+        while pc < end:
+            pc = code[pc](stack, pc)
+        return stack
+    while pc < end:
+        if budget <= 0:
+            raise BudgetExceeded("Stopped at instruction {}".format(pc))
+        budget -= 1
+        pc = code[pc](stack, pc)
+    return stack
+
+
+def _run_traced(code, stack, pc, budget, trace):
+    # The same loops as `run`, but keeping `pc` for when something raises
+    end = len(code)
+    try:
+        if budget is None:
+            while pc < end:
+                pc = code[pc](stack, pc)
+            return stack
+        while pc < end:
+            if budget <= 0:
+                raise BudgetExceeded("Stopped at instruction {}".format(pc))
+            budget -= 1
+            pc = code[pc](stack, pc)
+        return stack
+    except Exception as e:
+        trace.stopped(stack, pc, e)
+        raise
+
+
+def _run_profiled(code, stack, pc, budget, profile):
+    profile.resize(len(code))
+    counts, times, back_edges = profile.counts, profile.times, profile.back_edges
+    clock = time.perf_counter
+    max_depth = profile.max_depth
+    end = len(code)
+    try:
+        while pc < end:
+            if budget is not None:
+                if budget <= 0:
+                    raise BudgetExceeded("Stopped at instruction {}".format(pc))
+                budget -= 1
+            start = clock()
+            next_pc = code[pc](stack, pc)
+            times[pc] += clock() - start
+            counts[pc] += 1
+            if next_pc <= pc:
+                edge = (pc, next_pc)
+                back_edges[edge] = back_edges.get(edge, 0) + 1
+            if len(stack) > max_depth:
+                max_depth = len(stack)
+            pc = next_pc
+    finally:
+        profile.max_depth = max_depth
+    return stack
+
+
+class Profile(object):
+    """
+    Execution counts and times for each instruction of a program
+
+    Pass one to `eval_program` (or `run`) to fill it in, then call
+    `report` for a summary of where the time went. `back_edges` counts the
+    jumps taken backwards, by (from, to) instruction index, and
+    `max_depth` is the deepest the stack got.
+    """
+    def __init__(self):
+        self.instructions = []
+        self.lines = None
+        self.counts = []
+        self.times = []
+        self.back_edges = {}
+        self.max_depth = 0
+
+    def begin(self, instructions, source=None):
+        """Say which program is being profiled, for `report`."""
+        self.instructions = list(instructions)
+        self.lines = None if source is None else source_lines(source)
+        self.resize(len(self.instructions))
+
+    def resize(self, length):
+        if len(self.counts) < length:
+            self.counts.extend([0] * (length - len(self.counts)))
+            self.times.extend([0.0] * (length - len(self.times)))
+
+    def describe(self, index):
+        """How to refer to instruction `index` in a report."""
+        return _describe(self.instructions, self.lines, index)
+
+    def by_op(self):
+        """Total (count, time) for each op."""
+        totals = {}
+        for instr, count, elapsed in zip(self.instructions, self.counts,
+                                         self.times):
+            total_count, total_time = totals.get(instr.op, (0, 0.0))
+            totals[instr.op] = (total_count + count, total_time + elapsed)
+        return totals
+
+    def report(self, limit=10):
+        total = sum(self.times) or 1.0
+        out = ['{:>6} {:>10} {:>10} {:>6}  {}'.format(
+            'instr', 'count', 'time (s)', '%', 'source')]
+        hot = sorted(range(len(self.counts)), key=lambda i: -self.times[i])
+        for index in hot[:limit]:
+            if not self.counts[index]:
+                break
+            out.append('{:6} {:10} {:10.6f} {:6.1f}  {}'.format(
+                index, self.counts[index], self.times[index],
+                100 * self.times[index] / total, self.describe(index)))
+        out.append('')
+        out.append('{:>6} {:>10} {:>10} {:>6}'.format(
+            'op', 'count', 'time (s)', '%'))
+        totals = sorted(self.by_op().items(), key=lambda item: -item[1][1])
+        for op, (count, elapsed) in totals:
+            out.append('{:>6} {:10} {:10.6f} {:6.1f}'.format(
+                op, count, elapsed, 100 * elapsed / total))
+        if self.back_edges:
+            out.append('')
+            out.append('Loops (backward jumps taken):')
+            edges = sorted(self.back_edges.items(), key=lambda item: -item[1])
+            for (start, target), count in edges[:limit]:
+                out.append('{:10} from {} to {}'.format(
+                    count, self.describe(start), self.describe(target)))
+        out.append('')
+        out.append('Maximum stack depth: {}'.format(self.max_depth))
+        return '\n'.join(out)
+
+    def print_report(self, limit=10, file=None):
+        print(self.report(limit), file=sys.stdout if file is None else file)
+
+
+def _describe(instructions, lines, index):
+    if lines is not None and index < len(lines):
+        labels, line_number, text = lines[index]
+        where = 'line {}: {}'.format(line_number, text)
+        return ' '.join(labels + [where])
+    elif index < len(instructions):
+        return repr(instructions[index])
+    return 'end'
+
+
+class Trace(object):
+    """
+    The last branches a program took, for finding out how it failed
+
+    Pass one to `eval_program` to record the index and top of the stack
+    before each of the last `size` dynamic jumps, including fused
+    branches. Only those are recorded: everything between two of them
+    runs straight through, so they pin down the path the program took
+    without an entry for every instruction. The handlers compiled for
+    those jumps record the entries themselves into deques that drop the
+    oldest entry once full, and loops compiled by `compile_jit` record
+    the same entries from the code generated for them.
+
+    Stack depths are not recorded, since appending them was a third of the
+    cost. Over five runs of `benchmarks.trace`, a trace slowed the
+    countdown, with a branch every three instructions, by 9-16% with the
+    JIT and 11-17% in the interpreter, and the other workloads by 5-13%
+    and under 5%, apart from single noisy runs of up to 23%.
+
+    If the program raises, the instruction that raised is recorded last,
+    along with how deep the stack was, and `eval_program` dumps the trace
+    to `file`, or stderr, before the exception goes any further. Inside a
+    compiled loop, running out of stack and bad jumps are recorded where
+    they happen, but other errors, such as dividing by zero, are put down
+    to the first instruction of the loop.
+
+    >>> trace = Trace(size=2)
+    >>> eval_program('push 3; @loop; push -1; add; quiet not; push 1; add; '
+    ...              'jump; jump @loop; pop; pop', trace=trace)
+    Traceback (most recent call last):
+      ...
+    IndexError: pop from empty list
+    >>> trace.entries()
+    [(3, 'not', 0.0), (9, 'pop', None)]
+    >>> trace.error[2]
+    0
+    """
+    size = 1024
+
+    def __init__(self, size=None, file=None):
+        if size is not None:
+            self.size = size
+        self.file = file
+        # Full deques drop their oldest entry on each append.
+        self.pcs = deque(maxlen=self.size)
+        self.tops = deque(maxlen=self.size)
+        self.instructions = []
+        self.lines = None
+        self.error = None
+        self._branches = set()
+
+    def begin(self, instructions, source=None):
+        """Say which program is being traced, and empty the ring."""
+        self.instructions = list(instructions)
+        self.lines = None if source is None else source_lines(source)
+        self.pcs.clear()
+        self.tops.clear()
+        self.error = None
+
+    def record(self, stack, pc):
+        """Add an entry for the handler at `pc` about to run on `stack`."""
+        self.pcs.append(pc)
+        self.tops.append(stack[-1] if stack else None)
+
+    def instrument(self, code, fuse=True):
+        """
+        Return a copy of `code`, for the program given to `begin`, with the
+        handlers for dynamic jumps recording into this trace
+
+        `fuse` says whether `code` was compiled with fusions, and so which
+        handlers end in a branch.
+        """
+        add_pc, add_top = self.pcs.append, self.tops.append
+
+        def traced(handler):
+            # `record` is inlined, since this runs on every branch.
+            def traced(stack, pc):
+                add_pc(pc)
+                add_top(stack[-1] if stack else None)
+                return handler(stack, pc)
+            return traced
+
+        self._branches = {index for index, _ in
+                          _branch_kinds(self.instructions, fuse)}
+        code = list(code)
+        for index in self._branches:
+            code[index] = traced(code[index])
+        return code
+
+    def stopped(self, stack, pc, error):
+        """
+        Record that the instruction at `pc` raised `error`, with the stack
+        as it left it, unless it's a branch that has just been recorded
+        """
+        if self.error is not None and self.error[1] is error:
+            # Already recorded where it really happened
+            return
+        if pc not in self._branches:
+            self.record(stack, pc)
+        self.error = (pc, error, len(stack))
+
+    def entries(self):
+        """
+        (index, op, top of stack) for each entry in the ring, oldest first,
+        where the top is None if the stack was empty
+        """
+        entries = []
+        for pc, top in zip(self.pcs, self.tops):
+            op = self.instructions[pc].op if pc < len(self.instructions) \
+                else 'end'
+            entries.append((pc, op, top))
+        return entries
+
+    def report(self):
+        out = []
+        if self.error is not None:
+            pc, error, depth = self.error
+            out.append('{}: {} at {}, with {} on the stack'.format(
+                type(error).__name__, error,
+                _describe(self.instructions, self.lines, pc), depth))
+        entries = self.entries()
+        out.append('Last {} entries, oldest first:'.format(len(entries)))
+        out.append('{:>6} {:>12}  {}'.format('instr', 'top', 'source'))
+        for pc, op, top in entries:
+            out.append('{:6} {:>12}  {}'.format(
+                pc, '-' if top is None else '{:.6g}'.format(top),
+                _describe(self.instructions, self.lines, pc)))
+        return '\n'.join(out)
+
+    def dump(self, file=None):
+        """Print `report` to `file`, or the trace's file, or stderr."""
+        if file is None:
+            file = sys.stderr if self.file is None else self.file
+        print(self.report(), file=file)
+
+
+def _branch_kinds(instructions, fuse):
+    """
+    The index of each handler that can go more than one way, with its op
+    or the name of its fusion
+    """
+    for index, instr in enumerate(instructions):
+        if instr.op in jump_ops and not instr.args:
+            yield index, instr.op
+        elif fuse:
+            for name, matches, _ in _fusions:
+                if matches(instructions, index):
+                    if name in _branch_fusions:
+                        yield index, name
+                    break
+
+
+def _handler_lengths(instructions, fuse):
+    """How many instructions the handler at each index runs"""
+    lengths = [1] * len(instructions)
+    if fuse:
+        for index in range(len(instructions)):
+            for _, matches, _ in _fusions:
+                if matches(instructions, index):
+                    lengths[index] = matches.length
+                    break
+    return lengths
+
+
+def source_lines(code):
+    r"""
+    For each instruction in `code`, the labels on it, its line number and
+    its source text
+
+    >>> source_lines('@top\npush 1; add')
+    [(['@top'], 2, 'push 1'), ([], 2, 'add')]
+    """
+    lines = []
+    labels = []
+    for line_number, line in enumerate(code.split('\n'), 1):
+        for statement in line.split(';'):
+            statement = statement.strip()
+            if not statement:
+                continue
+            if is_label(statement):
+                labels.append(statement)
+                continue
+            lines.append((labels, line_number, statement))
+            labels = []
+    return lines
+
+
+def compile_program(instructions, fuse=False, fusions=None, checked=True,
+                    source=None, sink=None, summarize=False, trace=None):
+    """
+    Lower a sequence of instructions to a list of handlers
+
+    Each handler takes the stack and its own index and returns the index of
+    the next instruction to run. Prefixes and arguments are resolved here,
+    once, so running the program is a single indexed call per instruction.
+
+    With `fuse`, common sequences of instructions (see `_fusions`) are run
+    by a single handler at the index of their first instruction. The
+    handlers for the rest of the sequence are kept for jumps that land in
+    the middle of it. If a `fusions` dict is given, it counts how many
+    times each fusion was used.
+
+    Without `checked`, handlers assume the stack is always deep enough,
+    which is only safe for programs `verify_program` accepts.
+
+    `read` and `emit` use the `Source` and `Sink` given. Values emitted
+    are buffered, so call `sink.flush()` once the program has run.
+
+    With a `trace`, which must have been given the program with
+    `Trace.begin`, the handlers for dynamic jumps record into it, as they
+    would after `Trace.instrument` but without another call per branch.
+
+    With `summarize`, loops `loop_summaries` understands skip straight to
+    their last trip round, and ones that would go round forever without
+    changing anything raise `InfiniteLoopError`. Skipped instructions
+    don't count towards a budget.
+
+    >>> run(compile_program(parse_program(
+    ...     'push 1e9; @loop; push -1; add; quiet not; push 1; add; jump; '
+    ...     'jump @loop'), summarize=True))
+    [0.0]
+    """
+    instructions = list(instructions)
+    length = len(instructions)
+    code = [compile_instr(instr, index, length)
+            for index, instr in enumerate(instructions)]
+    streams = {'read': source, 'emit': sink}
+    for index, instr in enumerate(instructions):
+        if streams.get(instr.op) is not None:
+            code[index] = _stream_factories[instr.op](
+                streams[instr.op], 'quiet' in instr.prefix)
+    if not checked:
+        for index, instr in enumerate(instructions):
+            if instr.op in _unchecked_factories:
+                code[index] = _unchecked_factories[instr.op](
+                    instr.args, 'quiet' in instr.prefix, index, length)
+    if fuse:
+        for index in range(length):
+            for name, matches, factory in _fusions:
+                if matches(instructions, index):
+                    code[index] = factory(instructions, index, length)
+                    if fusions is not None:
+                        fusions[name] = fusions.get(name, 0) + 1
+                    break
+    if trace is not None:
+        record = (trace.pcs.append, trace.tops.append)
+        trace._branches = set()
+        for index, kind in _branch_kinds(instructions, fuse):
+            code[index] = _traced_factories[kind](instructions, index,
+                                                  length, record)
+            trace._branches.add(index)
+    if summarize:
+        from stack.loops import _summarized, loop_summaries
+        for header, summary in loop_summaries(instructions).items():
+            code[header] = _summarized(code[header], summary)
+    return code
+
+
+def _fusion_pattern(*tests):
+    def matches(instructions, index):
+        if index + len(tests) > len(instructions):
+            return False
+        return all(test(instructions[index + offset])
+                   for offset, test in enumerate(tests))
+    matches.length = len(tests)
+    return matches
+
+
+def _is_push(instr):
+    return instr.op == 'push'
+
+
+def _is_binary(instr):
+    return instr.op in binary_ops and 'quiet' not in instr.prefix
+
+
+def _is_quiet_binary(instr):
+    return instr.op in binary_ops and 'quiet' in instr.prefix
+
+
+def _is_quiet_unary(instr):
+    return instr.op in unary_ops and 'quiet' in instr.prefix
+
+
+def _is_dynamic_jump(instr):
+    return (instr.op == 'jump' and not instr.args and
+            'quiet' not in instr.prefix)
+
+
+def _is_dup(instr):
+    return instr.op == 'dup' and instr.args in ([], [1.0])
+
+
+def _fuse_compare_branch(instructions, index, length):
+    # push k; <binary>; jump
+    value = instructions[index].args[0]
+    func = binary_ops[instructions[index + 1].op]
+    jump_index = index + 2
+
+    def compare_branch(stack, pc):
+        target = jump_index + int(func(value, stack.pop()))
+        if target > length or target < 0:
+            raise IndexError
+        return target
+    return compare_branch
+
+
+def _fuse_test_branch(instructions, index, length):
+    # quiet <unary>; push k; <binary>; jump
+    test = unary_ops[instructions[index].op]
+    value = instructions[index + 1].args[0]
+    func = binary_ops[instructions[index + 2].op]
+    jump_index = index + 3
+
+    def test_branch(stack, pc):
+        target = jump_index + int(func(value, test(stack[-1])))
+        if target > length or target < 0:
+            raise IndexError
+        return target
+    return test_branch
+
+
+def _fuse_quiet_branch(instructions, index, length):
+    # quiet <binary>; jump or quiet <unary>; jump
+    op = instructions[index].op
+    jump_index = index + 1
+    if op in unary_ops:
+        test = unary_ops[op]
+
+        def quiet_branch(stack, pc):
+            target = jump_index + int(test(stack[-1]))
+            if target > length or target < 0:
+                raise IndexError
+            return target
+    else:
+        func = binary_ops[op]
+
+        def quiet_branch(stack, pc):
+            target = jump_index + int(func(stack[-1], stack[-2]))
+            if target > length or target < 0:
+                raise IndexError
+            return target
+    return quiet_branch
+
+
+def _fuse_binary_immediate(instructions, index, length):
+    # push k; <binary>
+    value = instructions[index].args[0]
+    func = binary_ops[instructions[index + 1].op]
+
+    def binary_immediate(stack, pc):
+        stack[-1] = func(value, stack[-1])
+        return pc + 2
+    return binary_immediate
+
+
+def _fuse_binary_self(instructions, index, length):
+    # dup; <binary>, so `dup; mul` squares the top of the stack
+    func = binary_ops[instructions[index + 1].op]
+
+    def binary_self(stack, pc):
+        top = stack[-1]
+        stack[-1] = func(top, top)
+        return pc + 2
+    return binary_self
+
+
+# (name, pattern, handler factory), longest patterns first
+_fusions = [
+    ('test_branch',
+     _fusion_pattern(_is_quiet_unary, _is_push, _is_binary, _is_dynamic_jump),
+     _fuse_test_branch),
+    ('compare_branch',
+     _fusion_pattern(_is_push, _is_binary, _is_dynamic_jump),
+     _fuse_compare_branch),
+    ('quiet_branch',
+     _fusion_pattern(lambda instr: (_is_quiet_binary(instr) or
+                                    _is_quiet_unary(instr)),
+                     _is_dynamic_jump),
+     _fuse_quiet_branch),
+    ('binary_immediate',
+     _fusion_pattern(_is_push, _is_binary),
+     _fuse_binary_immediate),
+    ('binary_self',
+     _fusion_pattern(_is_dup, _is_binary),
+     _fuse_binary_self),
+]
+
+# The most instructions any fusion covers
+_max_fusion = 4
+
+# Fusions that end in a dynamic jump
+_branch_fusions = {'test_branch', 'compare_branch', 'quiet_branch'}
+
+
+# The handlers below are the dynamic jumps and branch fusions again, for
+# `compile_program` with a `Trace`. Each one adds an entry for itself
+# before anything else, like `Trace.record`.
+
+def _traced_jump(instructions, index, length, record):
+    add_pc, add_top = record
+    quiet = 'quiet' in instructions[index].prefix
+
+    def dynamic_jump(stack, pc):
+        add_pc(pc)
+        add_top(stack[-1] if stack else None)
+        jump_distance = stack[-1] if quiet else stack.pop()
+        target = pc + int(jump_distance)
+        if target > length or target < 0:
+            raise IndexError
+        return target
+    return dynamic_jump
+
+
+def _traced_to(instructions, index, length, record):
+    add_pc, add_top = record
+    quiet = 'quiet' in instructions[index].prefix
+
+    def dynamic_to(stack, pc):
+        add_pc(pc)
+        add_top(stack[-1] if stack else None)
+        jump_to = stack[-1] if quiet else stack.pop()
+        if not float.is_integer(jump_to):
+            raise TypeError("Expected an integer, got a: {}".format(jump_to))
+        target = int(jump_to)
+        if target >= length or target <= 0:
+            raise IndexError("Jump address {} out of bounds ({})".format(
+                target, length - 1))
+        return target
+    return dynamic_to
+
+
+def _traced_test_branch(instructions, index, length, record):
+    add_pc, add_top = record
+    test = unary_ops[instructions[index].op]
+    value = instructions[index + 1].args[0]
+    func = binary_ops[instructions[index + 2].op]
+    jump_index = index + 3
+
+    def test_branch(stack, pc):
+        add_pc(pc)
+        add_top(stack[-1] if stack else None)
+        target = jump_index + int(func(value, test(stack[-1])))
+        if target > length or target < 0:
+            raise IndexError
+        return target
+    return test_branch
+
+
+def _traced_compare_branch(instructions, index, length, record):
+    add_pc, add_top = record
+    value = instructions[index].args[0]
+    func = binary_ops[instructions[index + 1].op]
+    jump_index = index + 2
+
+    def compare_branch(stack, pc):
+        add_pc(pc)
+        add_top(stack[-1] if stack else None)
+        target = jump_index + int(func(value, stack.pop()))
+        if target > length or target < 0:
+            raise IndexError
+        return target
+    return compare_branch
+
+
+def _traced_quiet_branch(instructions, index, length, record):
+    add_pc, add_top = record
+    op = instructions[index].op
+    jump_index = index + 1
+    if op in unary_ops:
+        test = unary_ops[op]
+
+        def quiet_branch(stack, pc):
+            add_pc(pc)
+            add_top(stack[-1] if stack else None)
+            target = jump_index + int(test(stack[-1]))
+            if target > length or target < 0:
+                raise IndexError
+            return target
+    else:
+        func = binary_ops[op]
+
+        def quiet_branch(stack, pc):
+            add_pc(pc)
+            add_top(stack[-1] if stack else None)
+            target = jump_index + int(func(stack[-1], stack[-2]))
+            if target > length or target < 0:
+                raise IndexError
+            return target
+    return quiet_branch
+
+
+# By op or fusion name, as `_branch_kinds` gives them
+_traced_factories = {
+    'jump': _traced_jump,
+    'to': _traced_to,
+    'test_branch': _traced_test_branch,
+    'compare_branch': _traced_compare_branch,
+    'quiet_branch': _traced_quiet_branch,
+}
+
+
+def compile_instr(instr, index, length):
+    quiet = 'quiet' in instr.prefix
+    if instr.op in binary_ops:
+        return _compile_binary(binary_ops[instr.op], quiet)
+    elif instr.op in unary_ops:
+        return _compile_unary(unary_ops[instr.op], quiet)
+    elif instr.op in _handler_factories:
+        return _handler_factories[instr.op](instr.args, quiet, index, length)
+
+    def unknown(stack, pc):
+        raise ValueError('Unknown instruction {}'.format(instr))
+    return unknown
+
+
+def _compile_push(args, quiet, index, length):
+    value = args[0]
+
+    def push(stack, pc):
+        stack.append(value)
+        return pc + 1
+    return push
+
+
+def _compile_pop(args, quiet, index, length):
+    def pop(stack, pc):
+        stack.pop()
+        return pc + 1
+    return pop
+
+
+def _compile_nop(args, quiet, index, length):
+    def nop(stack, pc):
+        return pc + 1
+    return nop
+
+
+def _compile_read(source, quiet):
+    if source is None:
+        def read(stack, pc):
+            raise ValueError("There is no source to read from")
+        return read
+
+    def read(stack, pc):
+        # Push the next value and 1, or 0 and 0 at the end of the input.
+        position = source.position
+        if position == len(source.buffer):
+            if not source.refill():
+                stack.append(0.0)
+                stack.append(0.0)
+                return pc + 1
+            position = 0
+        stack.append(source.buffer[position])
+        stack.append(1.0)
+        source.position = position + 1
+        return pc + 1
+    return read
+
+
+def _compile_emit(sink, quiet):
+    if sink is None:
+        def emit(stack, pc):
+            raise ValueError("There is no sink to emit to")
+        return emit
+    pending, limit = sink.pending, sink.chunk_size
+
+    if quiet:
+        def emit(stack, pc):
+            pending.append(stack[-1])
+            if len(pending) >= limit:
+                sink.flush()
+            return pc + 1
+    else:
+        def emit(stack, pc):
+            pending.append(stack.pop())
+            if len(pending) >= limit:
+                sink.flush()
+            return pc + 1
+    return emit
+
+
+def _compile_binary(func, quiet):
+    # b is the top of the stack, and a is the item before it, so
+    # `... ; push 5 ; div` is dividing the result of `...` by 5.
+    # Arguments are evaluated left to right, so the first pop is b.
+    if quiet:
+        def binary(stack, pc):
+            stack.append(func(stack[-1], stack[-2]))
+            return pc + 1
+    else:
+        def binary(stack, pc):
+            stack.append(func(stack.pop(), stack.pop()))
+            return pc + 1
+    return binary
+
+
+def _compile_unary(func, quiet):
+    if quiet:
+        def unary(stack, pc):
+            stack.append(func(stack[-1]))
+            return pc + 1
+    else:
+        def unary(stack, pc):
+            stack.append(func(stack.pop()))
+            return pc + 1
+    return unary
+
+
+def _compile_swap(args, quiet, index, length):
+    # `swap` aliased to `swap 1`
+    to = -(1 + int(args[0] if args else 1))
+
+    def swap(stack, pc):
+        stack[-1], stack[to] = stack[to], stack[-1]
+        return pc + 1
+    return swap
+
+
+def _compile_dup(args, quiet, index, length):
+    # `dup` aliases to `dup 1`
+    dup_depth = int(args[0] if args else 1)
+    if dup_depth == 0:
+        return _compile_nop(args, quiet, index, length)
+    elif dup_depth == 1:
+        def dup(stack, pc):
+            if not stack:
+                raise IndexError("Cannot dup 1 elements, stack has 0")
+            stack.append(stack[-1])
+            return pc + 1
+        return dup
+
+    def dup(stack, pc):
+        if dup_depth > len(stack):
+            raise IndexError("Cannot dup {} elements, stack has {}".format(
+                dup_depth, len(stack)))
+        stack.extend(stack[-dup_depth:])
+        return pc + 1
+    return dup
+
+
+def _compile_unchecked_dup(args, quiet, index, length):
+    dup_depth = int(args[0] if args else 1)
+    if dup_depth <= 0:
+        return _compile_dup(args, quiet, index, length)
+    elif dup_depth == 1:
+        def dup(stack, pc):
+            stack.append(stack[-1])
+            return pc + 1
+        return dup
+
+    def dup(stack, pc):
+        stack.extend(stack[-dup_depth:])
+        return pc + 1
+    return dup
+
+
+def _compile_jump(args, quiet, index, length):
+    if args:
+        target = index + int(args[0])
+        if target > length or target < 0:
+            def jump(stack, pc):
+                raise IndexError
+        else:
+            def jump(stack, pc):
+                return target
+        return jump
+
+    def dynamic_jump(stack, pc):
+        jump_distance = stack[-1] if quiet else stack.pop()
+        target = pc + int(jump_distance)
+        if target > length or target < 0:
+            raise IndexError
+        return target
+    return dynamic_jump
+
+
+def _compile_to(args, quiet, index, length):
+    if args:
+        target = int(args[0])
+        if target >= length or target <= 0:
+            def to(stack, pc):
+                raise IndexError("Jump address {} out of bounds ({})".format(
+                    target, length - 1))
+        else:
+            def to(stack, pc):
+                return target
+        return to
+
+    def dynamic_to(stack, pc):
+        jump_to = stack[-1] if quiet else stack.pop()
+        if not float.is_integer(jump_to):
+            raise TypeError("Expected an integer, got a: {}".format(jump_to))
+        target = int(jump_to)
+        if target >= length or target <= 0:
+            raise IndexError("Jump address {} out of bounds ({})".format(
+                target, length - 1))
+        return target
+    return dynamic_to
+
+
+_handler_factories = {
+    'push': _compile_push,
+    'pop': _compile_pop,
+    'swap': _compile_swap,
+    'dup': _compile_dup,
+    'jump': _compile_jump,
+    'to': _compile_to,
+    'nop': _compile_nop,
+    'read': lambda args, quiet, index, length: _compile_read(None, quiet),
+    'emit': lambda args, quiet, index, length: _compile_emit(None, quiet),
+}
+
+
+_stream_factories = {
+    'read': _compile_read,
+    'emit': _compile_emit,
+}
+
+
+# Handlers without stack checks, for verified programs.
+_unchecked_factories = {
+    'dup': _compile_unchecked_dup,
+}
+
+
+jump_ops = {
+    'jump',
+    'to',
+}
+
+
+binary_ops = {
+    'add': lambda a, b: b + a,
+    'sub': lambda a, b: b - a,
+    'mul': lambda a, b: b * a,
+    'div': lambda a, b: b / a,
+    'pow': lambda a, b: b ** a,
+    'eq': lambda a, b: float(b == a),
+    'gt': lambda a, b: float(b > a),
+    'ge': lambda a, b: float(b >= a),
+    'lt': lambda a, b: float(b < a),
+    'le': lambda a, b: float(b <= a)
+}
+
+
+unary_ops = {
+    'not': lambda a: float(not a)
+}
+
+
+class Source(object):
+    """
+    Numbers for `read` to take, fetched `chunk_size` at a time
+
+    `data` can be a binary file of float64s in the bytecode byte order
+    (little-endian), anything with the buffer protocol holding float64s,
+    such as an `array('d')`, a NumPy array or bytes, or any iterable of
+    numbers.
+
+    >>> source = Source(array('d', [1.5, 2.5]))
+    >>> source.refill(), source.buffer
+    (True, [1.5, 2.5])
+    >>> source.refill()
+    False
+    """
+    chunk_size = 65536
+
+    def __init__(self, data, chunk_size=None):
+        if chunk_size is not None:
+            self.chunk_size = chunk_size
+        self.data = data
+        # The current chunk, and the index of the next value in it
+        self.buffer = []
+        self.position = 0
+        if hasattr(data, 'read'):
+            self._remainder = b''
+            self._fetch = self._fetch_file
+            return
+        try:
+            view = memoryview(data)
+        except TypeError:
+            self._iterator = iter(data)
+            self._fetch = self._fetch_iterator
+        else:
+            self._view = _float64_view(view)
+            self._offset = 0
+            self._fetch = self._fetch_view
+
+    def refill(self):
+        """Fetch the next chunk, and return False if there isn't one."""
+        self.buffer = self._fetch()
+        self.position = 0
+        return len(self.buffer) > 0
+
+    def _fetch_file(self):
+        while True:
+            chunk = self.data.read(8 * self.chunk_size)
+            data = self._remainder + chunk
+            # Pipes can return part of a value.
+            usable = len(data) - len(data) % 8
+            self._remainder = data[usable:]
+            if usable or not chunk:
+                break
+        if not usable and self._remainder:
+            raise ValueError("Source ends partway through a number")
+        values = array('d')
+        values.frombytes(data[:usable])
+        if sys.byteorder != 'little':
+            values.byteswap()
+        return values.tolist()
+
+    def _fetch_view(self):
+        start = self._offset
+        self._offset = min(start + self.chunk_size, len(self._view))
+        return self._view[start:self._offset].tolist()
+
+    def _fetch_iterator(self):
+        return [float(value)
+                for value in islice(self._iterator, self.chunk_size)]
+
+
+class Sink(object):
+    """
+    Where `emit` sends numbers, written `chunk_size` at a time
+
+    `data` can be a binary file, which gets little-endian float64s, a list,
+    `array('d')` or anything else with `extend`, or a writable buffer of
+    float64s, such as a NumPy array, which is filled from the start.
+    Values are only written by `flush`, which happens whenever a chunk is
+    full, and `count` is how many have been written so far.
+    """
+    chunk_size = 65536
+
+    def __init__(self, data, chunk_size=None):
+        if chunk_size is not None:
+            self.chunk_size = chunk_size
+        self.data = data
+        self.pending = []
+        self.count = 0
+        if hasattr(data, 'write'):
+            self._write = self._write_file
+            return
+        try:
+            view = memoryview(data)
+        except TypeError:
+            view = None
+        if view is None or isinstance(data, array):
+            self._write = data.extend
+        else:
+            self._view = _float64_view(view)
+            if self._view.readonly:
+                raise TypeError("Sink buffers must be writable")
+            self._write = self._write_view
+
+    def flush(self):
+        if self.pending:
+            self._write(self.pending)
+            self.count += len(self.pending)
+            del self.pending[:]
+
+    def _write_file(self, values):
+        values = array('d', values)
+        if sys.byteorder != 'little':
+            values.byteswap()
+        self.data.write(values.tobytes())
+
+    def _write_view(self, values):
+        end = self.count + len(values)
+        if end > len(self._view):
+            raise ValueError("Sink is full after {} values".format(
+                len(self._view)))
+        self._view[self.count:end] = array('d', values)
+
+
+def _float64_view(view):
+    """A flat view of float64s, from floats or bytes."""
+    if view.format in ('d', '<d', '=d') or view.itemsize == 1:
+        if view.format != 'd' or view.ndim != 1:
+            view = view.cast('B').cast('d')
+        return view
+    raise TypeError("Buffers must hold float64s, not {!r}".format(
+        view.format))
+
+
+def main(argv=None):
+    """
+    Run Fillmore programs from the command line and print the final stack
+
+    usage: python -m stack [--cache DIR] [--checkpoint FILE] [FILE ...]
+
+    Each FILE is either source or bytecode written by `Bytecode.save`
+    (recognised by its `.fmc` extension). With no files, or `-`, the
+    program is read from stdin. Parsed programs are looked up in and saved
+    to the cache directory given by `--cache` or `$FILLMORE_CACHE`, if
+    there is one.
+
+    With `--checkpoint`, the state of a single program is saved to FILE
+    every million instructions and on SIGTERM, and a run that finds FILE
+    already there picks up from it. FILE is removed once the program
+    finishes.
+    """
+    args = sys.argv[1:] if argv is None else list(argv)
+    directory = os.environ.get('FILLMORE_CACHE')
+    checkpoint = None
+    while args[:1] in (['--cache'], ['--checkpoint']):
+        if len(args) < 2:
+            print('{} needs a {}'.format(
+                args[0], 'directory' if args[0] == '--cache' else 'file'),
+                file=sys.stderr)
+            return 2
+        if args[0] == '--cache':
+            directory = args[1]
+        else:
+            checkpoint = args[1]
+        args = args[2:]
+    if args[:1] in (['-h'], ['--help']):
+        print(main.__doc__.split('\n\n')[1].strip())
+        return 0
+    if checkpoint is not None and len(args) > 1:
+        print('--checkpoint only works with one program', file=sys.stderr)
+        return 2
+    cache = None
+    if directory and os.path.isdir(directory):
+        from stack.cache import ProgramCache
+        cache = ProgramCache(directory=directory)
+    status = 0
+    for path in args or ['-']:
+        try:
+            if path.endswith('.fmc'):
+                from stack.bytecode import Bytecode
+                instructions = Bytecode.load(path)
+            else:
+                if path == '-':
+                    source = sys.stdin.read()
+                else:
+                    with io.open(path, encoding='utf-8') as f:
+                        source = f.read()
+                # A one-off run doesn't need to hash the source.
+                if cache is None:
+                    instructions = list(parse_program(source))
+                else:
+                    instructions = cache.get(source)
+            if checkpoint is None:
+                print(run(compile_program(instructions, fuse=True)))
+            else:
+                print(_run_checkpointed(instructions, checkpoint))
+        except Exception as e:
+            print('{}: {}: {}'.format(path, type(e).__name__, e),
+                  file=sys.stderr)
+            status = 1
+    return status
+
+
+def _run_checkpointed(instructions, path):
+    import signal
+    from stack.vm import VM
+    if os.path.exists(path):
+        vm = VM.restore(instructions, path)
+    else:
+        vm = VM(instructions)
+    stack = vm.run_checkpointed(path, signals=(signal.SIGTERM,))
+    if os.path.exists(path):
+        os.remove(path)
+    return stack
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,7 @@
+# Kept separate from the package so that `python -m stack` can load the
+# interpreter from its cached bytecode instead of compiling it every run.
+import sys
+
+from stack import main
+
+sys.exit(main())
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+Run Fillmore programs on an asyncio event loop
+
+An `AsyncVM` gives control back to the event loop every `slice`
+instructions. The loop runs ready callbacks in order, so many VMs
+running at once take turns, and a short program finishes after a few
+slices whatever else is running.
+"""
+import asyncio
+
+from stack.cache import program_cache
+from stack.vm import VM
+
+
+class AsyncVM(VM):
+    """A `VM` that can also be run as a coroutine with `run_async`"""
+    async def run_async(self, slice=1000):
+        """Run to the end of the program, yielding every `slice` steps."""
+        while not self.step(slice):
+            await asyncio.sleep(0)
+        return self.stack
+
+
+async def eval_async(program, slice=1000):
+    """Evaluate program source without blocking the event loop."""
+    return await AsyncVM(program_cache.get(program)).run_async(slice)
+
+
+async def eval_many(programs, slice=1000, limit=None):
+    """
+    Evaluate many programs at once, interleaving them fairly
+
+    Returns a list of final stacks, or the exception a program raised in
+    its place. `limit` bounds how many programs run at the same time.
+    """
+    semaphore = asyncio.Semaphore(limit) if limit else None
+
+    async def evaluate(program):
+        if semaphore is None:
+            return await eval_async(program, slice)
+        async with semaphore:
+            return await eval_async(program, slice)
+
+    return await asyncio.gather(*[evaluate(program) for program in programs],
+                                return_exceptions=True)
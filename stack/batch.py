@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""
+Run one Fillmore program over many initial stacks at once with NumPy
+
+Lanes that agree on the program counter and stack depth are stepped
+together as one group, with each stack slot stored as a column of a 2-D
+array. A dynamic `jump` or `to` splits a group by target, and groups that
+meet again at the same instruction with the same depth are merged.
+
+Anything NumPy can't reproduce exactly (division by zero, awkward `pow`
+arguments, bad jump targets, stack underflow) is handed back to the
+scalar interpreter for just the lanes involved, so every lane ends up
+with exactly what `eval_program` would give it.
+"""
+import heapq
+
+import numpy as np
+
+from stack import compile_program, run
+from stack.cache import program_cache
+
+
+class BatchResult(object):
+    """
+    The final stacks of a batch
+
+    `values[lane, :depth[lane]]` is the stack of each lane that finished
+    with only floats on it. Lanes that raised are in `errors`.
+    """
+    def __init__(self, values, depth, errors, stacks):
+        self.values, self.depth, self.errors = values, depth, errors
+        # Stacks from the scalar interpreter that may not fit in `values`
+        self._stacks = stacks
+
+    def __len__(self):
+        return len(self.depth)
+
+    def stack(self, lane):
+        """The stack `eval_program` would return for `lane`, or raise."""
+        if lane in self.errors:
+            raise self.errors[lane]
+        if lane in self._stacks:
+            return list(self._stacks[lane])
+        return self.values[lane, :self.depth[lane]].tolist()
+
+
+def eval_batch(program, stacks):
+    """
+    Evaluate program source over the rows of `stacks`
+
+    >>> eval_batch('add', [[1, 2], [3, 4]]).stack(1)
+    [7.0]
+    """
+    return run_batch(program_cache.get(program), stacks)
+
+
+def run_batch(instructions, stacks):
+    """Run parsed instructions once for each row of the 2-D `stacks`."""
+    return _Batch(list(instructions), stacks).run()
+
+
+class _Group(object):
+    def __init__(self, pc, lanes, values, sp):
+        self.pc, self.lanes, self.values, self.sp = pc, lanes, values, sp
+
+    def reserve(self, count):
+        if self.sp + count > self.values.shape[1]:
+            grown = np.zeros((len(self.lanes),
+                              max(2 * self.values.shape[1], self.sp + count)))
+            grown[:, :self.sp] = self.values[:, :self.sp]
+            self.values = grown
+
+    def take(self, mask):
+        """Split off the lanes in `mask` as a new group."""
+        taken = _Group(self.pc, self.lanes[mask], self.values[mask], self.sp)
+        keep = ~mask
+        self.lanes, self.values = self.lanes[keep], self.values[keep]
+        return taken
+
+
+_arithmetic = {
+    'add': np.add,
+    'sub': np.subtract,
+    'mul': np.multiply,
+}
+
+
+_comparisons = {
+    'eq': np.equal,
+    'gt': np.greater,
+    'ge': np.greater_equal,
+    'lt': np.less,
+    'le': np.less_equal,
+}
+
+
+class _Batch(object):
+    def __init__(self, instructions, stacks):
+        stacks = np.array(stacks, dtype=float)
+        if stacks.ndim != 2:
+            raise ValueError("Initial stacks must be a 2-D array")
+        self.instructions = instructions
+        self.length = len(instructions)
+        self.code = compile_program(instructions)
+        self.lanes = len(stacks)
+        self.finished = []
+        self.errors = {}
+        self.stacks = {}
+        # Groups waiting to run, by (pc, sp), and a heap of those keys
+        self.waiting = {}
+        self.heap = []
+        self.push(_Group(0, np.arange(self.lanes), stacks, stacks.shape[1]))
+
+    def push(self, group):
+        if not len(group.lanes):
+            return
+        key = (group.pc, group.sp)
+        if key not in self.waiting:
+            self.waiting[key] = []
+            heapq.heappush(self.heap, key)
+        self.waiting[key].append(group)
+
+    def pop(self):
+        key = heapq.heappop(self.heap)
+        groups = self.waiting.pop(key)
+        if len(groups) == 1:
+            return groups[0]
+        pc, sp = key
+        lanes = np.concatenate([group.lanes for group in groups])
+        values = np.concatenate([group.values[:, :sp] for group in groups])
+        return _Group(pc, lanes, values, sp)
+
+    def run(self):
+        while self.heap:
+            group = self.pop()
+            while group is not None and len(group.lanes):
+                if group.pc >= self.length:
+                    self.finished.append(group)
+                    break
+                group = self.step(group)
+        return self.result()
+
+    def result(self):
+        depth = np.zeros(self.lanes, dtype=int)
+        width = max([group.sp for group in self.finished] + [0])
+        values = np.zeros((self.lanes, width))
+        for group in self.finished:
+            depth[group.lanes] = group.sp
+            values[group.lanes, :group.sp] = group.values[:, :group.sp]
+        for lane, stack in self.stacks.items():
+            depth[lane] = len(stack)
+            if all(isinstance(value, float) for value in stack):
+                values[lane, :len(stack)] = stack
+        return BatchResult(values, depth, self.errors, self.stacks)
+
+    def fallback(self, group, mask=None):
+        """Finish lanes with the scalar interpreter from their current pc."""
+        if mask is not None:
+            if not mask.any():
+                return group
+            taken = group.take(mask)
+        else:
+            taken, group = group, None
+        rows = taken.values[:, :taken.sp].tolist()
+        for lane, stack in zip(taken.lanes.tolist(), rows):
+            try:
+                self.stacks[lane] = run(self.code, stack, taken.pc)
+            except Exception as e:
+                self.errors[lane] = e
+        return group
+
+    def step(self, group):
+        """Run one instruction; return the group to keep stepping, if any."""
+        instr = self.instructions[group.pc]
+        op, args, quiet = instr.op, instr.args, 'quiet' in instr.prefix
+        values, sp = group.values, group.sp
+        if op == 'push':
+            group.reserve(1)
+            group.values[:, sp] = args[0]
+            group.sp += 1
+        elif op == 'pop':
+            if sp < 1:
+                return self.fallback(group)
+            group.sp -= 1
+        elif op == 'nop':
+            pass
+        elif op in _arithmetic or op in _comparisons or op in ('div', 'pow'):
+            if sp < 2:
+                return self.fallback(group)
+            group, c = self.binary(group, op)
+            if group is None or not len(group.lanes):
+                return None
+            if quiet:
+                group.reserve(1)
+                group.values[:, sp] = c
+                group.sp += 1
+            else:
+                group.values[:, sp - 2] = c
+                group.sp -= 1
+        elif op == 'not':
+            if sp < 1:
+                return self.fallback(group)
+            c = (values[:, sp - 1] == 0).astype(float)
+            if quiet:
+                group.reserve(1)
+                group.values[:, sp] = c
+                group.sp += 1
+            else:
+                values[:, sp - 1] = c
+        elif op == 'swap':
+            gap = int(args[0] if args else 1)
+            if gap < 0 or sp < gap + 1:
+                return self.fallback(group)
+            top, other = sp - 1, sp - 1 - gap
+            values[:, [top, other]] = values[:, [other, top]]
+        elif op == 'dup':
+            count = int(args[0] if args else 1)
+            if count < 0 or sp < count:
+                return self.fallback(group)
+            group.reserve(count)
+            group.values[:, sp:sp + count] = group.values[:, sp - count:sp]
+            group.sp += count
+        elif op in ('jump', 'to') and args:
+            if op == 'jump':
+                target = group.pc + int(args[0])
+                valid = 0 <= target <= self.length
+            else:
+                target = int(args[0])
+                valid = 0 < target < self.length
+            if not valid:
+                return self.fallback(group)
+            group.pc = target
+            return group
+        elif op in ('jump', 'to'):
+            return self.dynamic_jump(group, op, quiet)
+        else:
+            return self.fallback(group)
+        group.pc += 1
+        return group
+
+    def binary(self, group, op):
+        """Apply a binary op, returning the remaining group and result."""
+        sp = group.sp
+        a, b = group.values[:, sp - 2], group.values[:, sp - 1]
+        if op in _arithmetic:
+            return group, _arithmetic[op](a, b)
+        if op in _comparisons:
+            return group, _comparisons[op](a, b).astype(float)
+        if op == 'div':
+            # Python raises ZeroDivisionError where NumPy gives inf or nan.
+            bad = b == 0
+        else:
+            # Python raises or returns a complex number for these.
+            finite = np.isfinite(a) & np.isfinite(b)
+            bad = ~finite | ((a == 0) & (b < 0)) | ((a < 0) & (b != np.floor(b)))
+        group = self.fallback(group, bad)
+        if group is None or not len(group.lanes):
+            return None, None
+        a, b = group.values[:, sp - 2], group.values[:, sp - 1]
+        with np.errstate(all='ignore'):
+            if op == 'div':
+                c = a / b
+            else:
+                c = np.power(a, b)
+                # Python raises OverflowError instead of returning inf.
+                overflow = ~np.isfinite(c)
+                if overflow.any():
+                    group = self.fallback(group, overflow)
+                    if group is None or not len(group.lanes):
+                        return None, None
+                    c = c[~overflow]
+        return group, c
+
+    def dynamic_jump(self, group, op, quiet):
+        sp = group.sp
+        if sp < 1:
+            return self.fallback(group)
+        top = group.values[:, sp - 1]
+        if op == 'jump':
+            bad = ~np.isfinite(top)
+            targets = group.pc + np.trunc(np.where(bad, 0, top))
+            bad |= (targets > self.length) | (targets < 0)
+        else:
+            bad = ~np.isfinite(top) | (top != np.floor(top))
+            targets = np.where(bad, 0, top)
+            bad |= (targets >= self.length) | (targets <= 0)
+        if bad.any():
+            group = self.fallback(group, bad)
+            if group is None or not len(group.lanes):
+                return None
+            targets = targets[~bad]
+        if not quiet:
+            group.sp -= 1
+        unique = np.unique(targets)
+        if len(unique) == 1:
+            group.pc = int(unique[0])
+            return group
+        for target in unique:
+            split = group.take(targets == target)
+            targets = targets[targets != target]
+            split.pc = int(target)
+            self.push(split)
+        return None
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+A compact binary format for parsed Fillmore programs
+
+Opcodes, flags and arguments go in separate arrays, so a file can be
+written and loaded without parsing, or used in place from an mmap.
+"""
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from stack import Instr, _read_statements, parse_lines
+
+
+# Opcode numbers are part of the bytecode file format, so new operations
+# must only ever be appended.
+opcodes = [
+    'push', 'pop', 'dup', 'swap', 'jump', 'to',
+    'add', 'sub', 'mul', 'div', 'pow',
+    'eq', 'lt', 'gt', 'le', 'ge',
+    'not',
+    'nop',
+    'read', 'emit',
+]
+opcode_numbers = {op: number for number, op in enumerate(opcodes)}
+
+FLAG_QUIET = 1
+FLAG_ARG = 2
+
+
+class Bytecode(object):
+    r"""
+    A compact program: parallel arrays of opcodes, flags and arguments
+
+    Each instruction takes one opcode byte, one flags byte (`FLAG_QUIET`,
+    `FLAG_ARG`) and one float64 argument, which is 0 when there is none.
+    Iterating over it yields `Instr`s, so it can be passed anywhere a parsed
+    program can.
+
+    The file format is little-endian:
+
+        magic      4 bytes   b'FMBC'
+        version    uint16    1
+        reserved   uint16    0
+        count      uint64    number of instructions
+        opcodes    count bytes
+        flags      count bytes
+        padding    zero bytes up to a multiple of 8
+        args       count float64s
+
+    >>> Bytecode.from_instructions(parse_program('push 2; quiet add'))[1]
+    Instr('add', [], ['quiet'])
+    """
+    magic = b'FMBC'
+    version = 1
+    _header = struct.Struct('<4sHHQ')
+
+    def __init__(self, ops, flags, args, buffer=None):
+        if not len(ops) == len(flags) == len(args):
+            raise ValueError("Bytecode arrays must have the same length")
+        self.ops, self.flags, self.args = ops, flags, args
+        # Keeps a mapped file open for as long as the arrays point into it
+        self._buffer = buffer
+
+    @classmethod
+    def from_instructions(cls, instructions):
+        ops, flags, args = array('B'), array('B'), array('d')
+        cls._extend(ops, flags, args, instructions)
+        return cls(ops, flags, args)
+
+    @classmethod
+    def from_file(cls, source):
+        """
+        Parse a program with `parse_file` straight into bytecode
+
+        Only the arrays and the label table are kept in memory, never the
+        source or a list of `Instr`.
+        """
+        ops, flags, args = array('B'), array('B'), array('d')
+
+        def patch(index, instr, target):
+            args[index] = float(target)
+
+        instructions = parse_lines(_read_statements(source), patch)
+        cls._extend(ops, flags, args, instructions)
+        return cls(ops, flags, args)
+
+    @staticmethod
+    def _extend(ops, flags, args, instructions):
+        for instr in instructions:
+            if instr.op not in opcode_numbers:
+                raise ValueError('Unknown instruction {}'.format(instr))
+            ops.append(opcode_numbers[instr.op])
+            flags.append((FLAG_QUIET if 'quiet' in instr.prefix else 0) |
+                         (FLAG_ARG if instr.args else 0))
+            args.append(instr.args[0] if instr.args else 0.0)
+
+    def __len__(self):
+        return len(self.ops)
+
+    def __getitem__(self, index):
+        flags = self.flags[index]
+        return Instr(opcodes[self.ops[index]],
+                     [self.args[index]] if flags & FLAG_ARG else [],
+                     ['quiet'] if flags & FLAG_QUIET else [])
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __eq__(self, other):
+        return (isinstance(other, Bytecode) and
+                list(self.ops) == list(other.ops) and
+                list(self.flags) == list(other.flags) and
+                list(self.args) == list(other.args))
+
+    def __ne__(self, other):
+        return not self == other
+
+    @property
+    def nbytes(self):
+        return len(self) * 10
+
+    def digest(self):
+        """The sha256 of the program in the file format."""
+        import hashlib
+        return hashlib.sha256(self.tobytes()).digest()
+
+    def _padding(self):
+        return -(self._header.size + 2 * len(self)) % 8
+
+    def tobytes(self):
+        args = array('d', self.args)
+        if sys.byteorder != 'little':
+            args.byteswap()
+        return b''.join([
+            self._header.pack(self.magic, self.version, 0, len(self)),
+            bytes(bytearray(self.ops)),
+            bytes(bytearray(self.flags)),
+            b'\0' * self._padding(),
+            args.tobytes(),
+        ])
+
+    def save(self, file):
+        """Write the program to a path or a binary file object."""
+        if hasattr(file, 'write'):
+            file.write(self.tobytes())
+        else:
+            with open(file, 'wb') as f:
+                f.write(self.tobytes())
+
+    @classmethod
+    def frombuffer(cls, data, _buffer=None):
+        """
+        Load a program from a bytes-like object without copying it
+
+        The returned arrays are views into `data`, except on big-endian
+        machines, where the arguments have to be byte swapped.
+        """
+        view = memoryview(data)
+        header = cls._header
+        if len(view) < header.size:
+            raise ValueError("Not a Fillmore bytecode file")
+        magic, version, _, count = header.unpack_from(view)
+        if magic != cls.magic:
+            raise ValueError("Not a Fillmore bytecode file")
+        if version != cls.version:
+            raise ValueError("Unsupported bytecode version {}".format(version))
+        ops_start = header.size
+        flags_start = ops_start + count
+        args_start = flags_start + count
+        args_start += -args_start % 8
+        if len(view) != args_start + 8 * count:
+            raise ValueError("Bytecode file is truncated or has extra data")
+        ops = view[ops_start:flags_start]
+        flags = view[flags_start:flags_start + count]
+        args = view[args_start:]
+        if sys.byteorder == 'little':
+            args = args.cast('d')
+        else:
+            args = array('d', args.tobytes())
+            args.byteswap()
+        if count and max(ops) >= len(opcodes):
+            raise ValueError("Bytecode contains an unknown opcode")
+        return cls(ops, flags, args, _buffer)
+
+    @classmethod
+    def load(cls, path):
+        """Memory-map a bytecode file written by `save`."""
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls.frombuffer(mapped, mapped)
+
+    def close(self):
+        """Release a mapped file. The program can't be used afterwards."""
+        if self._buffer is not None:
+            for view in (self.ops, self.flags, self.args):
+                if isinstance(view, memoryview):
+                    view.release()
+            self._buffer.close()
+            self._buffer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _write_atomic(path, data):
+    import tempfile
+    # Write to a temporary file first so readers never see half a file.
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except Exception:
+        os.remove(temp_path)
+        raise
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""
+Parsed programs kept by a hash of their source
+
+`eval_program` looks every program up in `program_cache`, so a program
+that is run again isn't parsed again.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from stack import parse_program
+from stack.bytecode import Bytecode, _write_atomic
+
+
+class ProgramCache(object):
+    """
+    Parsed programs keyed by a hash of their source
+
+    Entries are kept in a bounded in-memory LRU. If `directory` is given,
+    programs are also written there as `Bytecode` files named after the
+    hash, so they survive process restarts and can be shared between
+    processes. Programs that fail to parse are never cached. Writes to
+    the directory that fail are counted in `disk_errors`, and the program
+    is still returned.
+
+    The instruction tuples returned by `get` are shared between callers
+    and must not be modified.
+
+    >>> cache = ProgramCache(maxsize=1)
+    >>> cache.get('push 1') == cache.get('push 1')
+    True
+    >>> cache.stats()['hits']
+    1
+    """
+    def __init__(self, maxsize=1024, directory=None):
+        self.maxsize = maxsize
+        self.directory = directory
+        # The first key is the least recently used.
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+        self.disk_hits = self.disk_writes = self.disk_errors = 0
+
+    @staticmethod
+    def key(source):
+        return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.fmc')
+
+    def get(self, source):
+        """Return the instructions for `source`, parsing it on a miss."""
+        key = self.key(source)
+        instructions = self.lookup(key)
+        if instructions is None:
+            instructions = tuple(parse_program(source))
+            self._store(key, instructions)
+            self._remember(key, instructions)
+        return instructions
+
+    def lookup(self, key):
+        """
+        Return the instructions cached under `key`, or None
+
+        Only a `key` from `ProgramCache.key` will be found, so programs can
+        be referred to by their hash once something has parsed them.
+        """
+        if len(key) != 64 or key.strip('0123456789abcdef'):
+            # Not a hash, and not safe to use as a file name
+            return None
+        with self._lock:
+            instructions = self._entries.get(key)
+            if instructions is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return instructions
+            self.misses += 1
+        instructions = self._load(key)
+        if instructions is not None:
+            self._remember(key, instructions)
+        return instructions
+
+    def _remember(self, key, instructions):
+        with self._lock:
+            self._entries[key] = instructions
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _load(self, key):
+        if self.directory is None:
+            return None
+        try:
+            with open(self.path(key), 'rb') as f:
+                instructions = tuple(Bytecode.frombuffer(f.read()))
+        except (IOError, OSError, ValueError):
+            return None
+        self.disk_hits += 1
+        return instructions
+
+    def _store(self, key, instructions):
+        if self.directory is None:
+            return
+        try:
+            _write_atomic(self.path(key),
+                          Bytecode.from_instructions(instructions).tobytes())
+        except (IOError, OSError):
+            # Only the disk tier is lost.
+            self.disk_errors += 1
+            return
+        self.disk_writes += 1
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'disk_hits': self.disk_hits,
+            'disk_writes': self.disk_writes,
+            'disk_errors': self.disk_errors,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+# Used by `eval_program`
+program_cache = ProgramCache()
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+"""
+Re-parse a Fillmore program as it is edited, a few lines at a time
+
+An `IncrementalParser` keeps what each line of the source parsed to and
+where every label is defined and used, so an edit only parses the lines
+it touches. Jumps to labels are kept symbolic, and only resolved to
+instruction indexes when the whole program is asked for, so inserting
+or deleting lines doesn't have to update every jump after them.
+"""
+
+from stack import Instr, _gc_paused, parse_line
+
+
+class _Line(object):
+    """What one line of source parsed to"""
+    __slots__ = ['text', 'items', 'count', 'error', 'block']
+
+    def __init__(self, text):
+        self.text = text
+        # (instr, label) pairs, as from `parse_line`, in order
+        self.items = []
+        # The number of instructions on the line
+        self.count = 0
+        self.error = None
+        self.block = None
+        try:
+            for statement in text.split(';'):
+                parsed = parse_line(statement)
+                if parsed is not None:
+                    self.items.append(parsed)
+        except ValueError as error:
+            self.error = error
+            self.items = []
+        self.count = sum(1 for instr, _ in self.items if instr is not None)
+
+    def labels(self):
+        """The labels defined on this line, and the labels it jumps to"""
+        defined, used = [], []
+        for instr, label in self.items:
+            if label is not None:
+                (used if instr is not None else defined).append(label)
+        return defined, used
+
+
+class _Block(object):
+    """A run of consecutive lines, and how many instructions they hold"""
+    __slots__ = ['lines', 'count']
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.count = 0
+        for line in lines:
+            line.block = self
+            self.count += line.count
+
+
+class IncrementalParser(object):
+    """
+    A parsed program that can be edited a range of lines at a time
+
+    Lines are kept in blocks of about `block_size`, each of which knows how
+    many instructions it holds, so finding the instruction index of a line
+    or label only has to add up the blocks before it. An edit costs time in
+    proportion to its own size and `block_size`, not to the size of the
+    program.
+
+    >>> parser = IncrementalParser('push 1\\njump @end\\npush 2\\n@end')
+    >>> parser.edit(2, 3, 'push 3; push 4')
+    >>> parser.instructions()[1]
+    Instr('to', [4.0])
+    """
+    block_size = 256
+
+    def __init__(self, source=''):
+        self._blocks = [_Block([])]
+        self.line_count = 0
+        # The lines each label is defined on and used on
+        self._definitions = {}
+        self._uses = {}
+        # Label errors by label, and the lines with syntax errors
+        self._label_errors = {}
+        self._line_errors = set()
+        self._instructions = None
+        with _gc_paused():
+            self.edit(0, 0, source)
+
+    def edit(self, start, stop, text):
+        """
+        Replace lines `start` up to `stop` with `text`
+
+        `text` is a string, which is split into lines, or a list of lines,
+        so `edit(n, n + 1, [])` deletes line `n`. The edit is always made,
+        but if it leaves a new line or any of the labels it touches in
+        error, the first of those errors is raised.
+        """
+        if not 0 <= start <= stop <= self.line_count:
+            raise IndexError('Lines {} to {} are out of range ({})'.format(
+                start, stop, self.line_count))
+        if isinstance(text, str):
+            text = text.split('\n')
+        added = [_Line(line) for line in text]
+
+        # Splice the new lines into the blocks that held the old ones
+        first, offset = self._locate(start)
+        last, _ = self._locate(stop)
+        lines = []
+        for block in self._blocks[first:last + 1]:
+            lines.extend(block.lines)
+        removed = lines[offset:offset + stop - start]
+        lines[offset:offset + stop - start] = added
+        size = self.block_size
+        if len(lines) < size // 2 and last + 1 < len(self._blocks):
+            # Don't let deletions leave lots of tiny blocks behind.
+            last += 1
+            lines.extend(self._blocks[last].lines)
+        count = max(1, -(-len(lines) // size))
+        blocks = [_Block(lines[len(lines) * n // count:
+                               len(lines) * (n + 1) // count])
+                  for n in range(count)]
+        self._blocks[first:last + 1] = blocks
+        self.line_count += len(added) - len(removed)
+        self._instructions = None
+
+        affected = set()
+        for line in removed:
+            self._line_errors.discard(line)
+            for labels, table in zip(line.labels(), self._label_tables()):
+                for label in labels:
+                    table[label].remove(line)
+                    if not table[label]:
+                        del table[label]
+                    affected.add(label)
+        for line in added:
+            if line.error is not None:
+                self._line_errors.add(line)
+            for labels, table in zip(line.labels(), self._label_tables()):
+                for label in labels:
+                    table.setdefault(label, []).append(line)
+                    affected.add(label)
+        for label in affected:
+            self._check_label(label)
+
+        errors = [line.error for line in added if line.error is not None]
+        errors.extend(self._label_errors[label] for label in sorted(affected)
+                      if label in self._label_errors)
+        if errors:
+            raise errors[0]
+
+    def errors(self):
+        """Every error in the program, as (line number, error), in order"""
+        errors = [(self._line_number(line), line.error)
+                  for line in self._line_errors]
+        for label, error in self._label_errors.items():
+            # A label defined twice is reported where it's defined again,
+            # and an undefined one where it's first used.
+            definitions = self._definitions.get(label)
+            numbers = sorted(self._line_number(line)
+                             for line in definitions or self._uses[label])
+            errors.append((numbers[1] if definitions else numbers[0], error))
+        errors.sort(key=lambda error: error[0])
+        return errors
+
+    def label_index(self, label):
+        """The index of the instruction after `label`"""
+        if label not in self._definitions:
+            raise KeyError(label)
+        return self._label_index_on(self._definitions[label][0], label)
+
+    def instructions(self):
+        """
+        The parsed program, with every jump to a label resolved
+
+        Raises the first error in the program, if there is one. The list is
+        built again only after an edit.
+        """
+        errors = self.errors()
+        if errors:
+            raise errors[0][1]
+        if self._instructions is None:
+            self._instructions = self._materialize()
+        return list(self._instructions)
+
+    def _materialize(self):
+        label_indexes = {}
+        index = 0
+        for block in self._blocks:
+            for line in block.lines:
+                for instr, label in line.items:
+                    if instr is not None:
+                        index += 1
+                    else:
+                        label_indexes[label] = index
+        instructions = []
+        for block in self._blocks:
+            for line in block.lines:
+                for instr, label in line.items:
+                    if instr is None:
+                        continue
+                    if label is not None:
+                        instr = Instr(instr.op, list(instr.args),
+                                      list(instr.prefix))
+                        instr.args[-1] = float(label_indexes[label])
+                    instructions.append(instr)
+        return instructions
+
+    def _label_tables(self):
+        return self._definitions, self._uses
+
+    def _check_label(self, label):
+        definitions = self._definitions.get(label, [])
+        if len(definitions) > 1:
+            first, second = sorted(self._label_index_on(line, label)
+                                   for line in definitions)[:2]
+            self._label_errors[label] = ValueError(
+                "Found the label {} on lines {} and {}".format(
+                    label, first, second))
+        elif not definitions and label in self._uses:
+            self._label_errors[label] = ValueError(
+                "The label, {}, was not defined".format(label))
+        else:
+            self._label_errors.pop(label, None)
+
+    def _label_index_on(self, line, label):
+        index = self._line_index(line)
+        for instr, defined in line.items:
+            if instr is not None:
+                index += 1
+            elif defined == label:
+                return index
+
+    def _line_number(self, line):
+        """The number of `line` in the source, from 0"""
+        number = 0
+        for block in self._blocks:
+            if block is line.block:
+                return number + block.lines.index(line)
+            number += len(block.lines)
+
+    def _line_index(self, line):
+        """The index of the first instruction on `line`"""
+        index = 0
+        for block in self._blocks:
+            if block is line.block:
+                break
+            index += block.count
+        for other in line.block.lines:
+            if other is line:
+                return index
+            index += other.count
+
+    def _locate(self, number):
+        """The block holding line `number`, and its offset in that block"""
+        for index, block in enumerate(self._blocks):
+            if number < len(block.lines):
+                return index, number
+            number -= len(block.lines)
+        return len(self._blocks) - 1, len(self._blocks[-1].lines) + number
@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+"""
+Run Fillmore programs that only ever hold integers on Python ints
+
+Handlers check that every result is still exactly what a float would
+give, and fall back to the float handlers for the rest of the run once
+one isn't.
+"""
+import math
+
+from stack import (Instr, _compile_binary, _compile_jump, _compile_to,
+                   _compile_unary, _fusions, compile_program, run)
+
+
+def integer_program(instructions):
+    """
+    Whether every value `instructions` can put on the stack is an integer
+
+    This is type inference with only two types: comparisons and `not` make
+    0 or 1, and `add`, `sub`, `mul` and `pow` make integers from integers,
+    except for negative powers, which `compile_integer` checks for as they
+    happen. So only `div`, `read` and pushing a number that isn't an
+    integer can bring in anything else.
+
+    >>> integer_program(parse_program('push 3; dup; mul'))
+    True
+    >>> integer_program(parse_program('push 3; push 2; div'))
+    False
+    """
+    for instr in instructions:
+        if instr.op in ('div', 'read'):
+            return False
+        if instr.op == 'push' and not _exact_integer(instr.args[0]):
+            return False
+    return True
+
+
+# Every integer up to this size is exactly a float, and none past it are.
+_integer_limit = 2 ** 53
+
+
+def _exact_integer(value):
+    """Whether an int can stand in for `value` without changing anything"""
+    value = float(value)
+    return (value.is_integer() and abs(value) <= _integer_limit and
+            not (value == 0 and math.copysign(1.0, value) < 0))
+
+
+def compile_integer(instructions, fuse=True):
+    """
+    Compile a program `integer_program` accepts to run on Python ints
+
+    Comparisons push bools, which jumps add to `pc` as they are, so
+    branches make none of the float to int conversions the float handlers
+    do. A result that a float would get differently, because it's past
+    2 ** 53, is a zero that would be -0.0, or is a negative power, stops
+    the integer handlers before the stack changes, and the program carries
+    on from the same instruction with the stack converted to floats. Either
+    way the result is the same floats `compile_program` would give.
+
+    Returns a function of an optional initial stack, like `compile_native`.
+    A stack that isn't all integers is run on the float handlers.
+
+    >>> program = compile_integer(parse_program('push 2; push 60; pow; '
+    ...                                         'push 1; add'))
+    >>> program()
+    [1.152921504606847e+18]
+    """
+    instructions = list(instructions)
+    if not integer_program(instructions):
+        raise ValueError("The program can't be shown to use only integers")
+    code = _compile_integer_handlers(instructions, fuse)
+    fallback = compile_program(instructions, fuse=fuse)
+    end = len(code)
+
+    def program(stack=None):
+        stack = [] if stack is None else stack
+        if not all(_exact_integer(value) for value in stack):
+            return run(fallback, stack)
+        stack[:] = [int(value) for value in stack]
+        pc = 0
+        try:
+            while pc < end:
+                pc = code[pc](stack, pc)
+        except _Deoptimize:
+            stack[:] = [float(value) for value in stack]
+            return run(fallback, stack, pc)
+        stack[:] = [float(value) for value in stack]
+        return stack
+    return program
+
+
+def _compile_integer_handlers(instructions, fuse):
+    length = len(instructions)
+    instructions = [
+        Instr('push', [int(instr.args[0])], instr.prefix)
+        if instr.op == 'push' else instr for instr in instructions]
+    code = compile_program(instructions)
+    for index, instr in enumerate(instructions):
+        quiet = 'quiet' in instr.prefix
+        if instr.op in _integer_binary_ops:
+            code[index] = _compile_integer_binary(
+                _integer_binary_ops[instr.op], quiet)
+        elif instr.op in _integer_unary_ops:
+            code[index] = _compile_unary(_integer_unary_ops[instr.op], quiet)
+        elif instr.op in _integer_factories:
+            code[index] = _integer_factories[instr.op](
+                instr.args, quiet, index, length)
+    if fuse:
+        for index in range(length):
+            for name, matches, factory in _integer_fusions:
+                if matches(instructions, index):
+                    code[index] = factory(instructions, index, length)
+                    break
+    return code
+
+
+class _Deoptimize(Exception):
+    """
+    Raised by integer handlers for a result floats would get differently,
+    with the operands, in stack order, as its arguments
+    """
+
+
+# `limit` is an argument so that it's a fast local lookup.
+def _integer_add(a, b, limit=_integer_limit):
+    result = b + a
+    if -limit <= result <= limit:
+        return result
+    raise _Deoptimize(b, a)
+
+
+def _integer_sub(a, b, limit=_integer_limit):
+    result = b - a
+    if -limit <= result <= limit:
+        return result
+    raise _Deoptimize(b, a)
+
+
+def _integer_mul(a, b, limit=_integer_limit):
+    result = b * a
+    if result:
+        if -limit <= result <= limit:
+            return result
+    elif a >= 0 and b >= 0:
+        # A float zero product keeps the sign of the operands.
+        return result
+    raise _Deoptimize(b, a)
+
+
+def _integer_pow(a, b, limit=_integer_limit):
+    # Negative powers aren't integers, and big ones would take a long time
+    # to work out only to be too big anyway.
+    if a < 0 or (a > 53 and not -1 <= b <= 1):
+        raise _Deoptimize(b, a)
+    result = b ** a
+    if -limit <= result <= limit:
+        return result
+    raise _Deoptimize(b, a)
+
+
+# Like `binary_ops` and `unary_ops`, but comparisons give bools
+_integer_binary_ops = {
+    'add': _integer_add,
+    'sub': _integer_sub,
+    'mul': _integer_mul,
+    'pow': _integer_pow,
+    'eq': lambda a, b: b == a,
+    'gt': lambda a, b: b > a,
+    'ge': lambda a, b: b >= a,
+    'lt': lambda a, b: b < a,
+    'le': lambda a, b: b <= a,
+}
+
+
+_integer_unary_ops = {
+    'not': lambda a: not a,
+}
+
+
+# For results that only go into a jump target, where anything a float
+# would get differently is out of range anyway. Powers are still checked,
+# since a negative one isn't an int.
+_integer_branch_ops = dict(
+    _integer_binary_ops,
+    add=lambda a, b: b + a,
+    sub=lambda a, b: b - a,
+    mul=lambda a, b: b * a,
+)
+
+
+def _compile_integer_binary(func, quiet):
+    if quiet:
+        # Nothing has been popped if `func` gives up.
+        return _compile_binary(func, quiet)
+
+    def binary(stack, pc):
+        try:
+            stack.append(func(stack.pop(), stack.pop()))
+        except _Deoptimize as e:
+            stack.extend(e.args)
+            raise
+        return pc + 1
+    return binary
+
+
+def _compile_integer_jump(args, quiet, index, length):
+    if args:
+        return _compile_jump(args, quiet, index, length)
+
+    def dynamic_jump(stack, pc):
+        distance = stack[-1] if quiet else stack.pop()
+        target = pc + distance
+        if target > length or target < 0:
+            # The float handler raises the same error as it would have.
+            if not quiet:
+                stack.append(distance)
+            raise _Deoptimize
+        return target
+    return dynamic_jump
+
+
+def _compile_integer_to(args, quiet, index, length):
+    if args:
+        return _compile_to(args, quiet, index, length)
+
+    def dynamic_to(stack, pc):
+        target = stack[-1] if quiet else stack.pop()
+        if target >= length or target <= 0:
+            if not quiet:
+                stack.append(target)
+            raise _Deoptimize
+        return target
+    return dynamic_to
+
+
+_integer_factories = {
+    'jump': _compile_integer_jump,
+    'to': _compile_integer_to,
+}
+
+
+def _fuse_integer_compare_branch(instructions, index, length):
+    # push k; <binary>; jump
+    value = instructions[index].args[0]
+    func = _integer_branch_ops[instructions[index + 1].op]
+    jump_index = index + 2
+
+    def compare_branch(stack, pc):
+        top = stack.pop()
+        try:
+            target = jump_index + func(value, top)
+        except _Deoptimize:
+            stack.append(top)
+            raise
+        if target > length or target < 0:
+            stack.append(top)
+            raise _Deoptimize
+        return target
+    return compare_branch
+
+
+def _fuse_integer_test_branch(instructions, index, length):
+    # quiet <unary>; push k; <binary>; jump
+    test = _integer_unary_ops[instructions[index].op]
+    value = instructions[index + 1].args[0]
+    func = _integer_branch_ops[instructions[index + 2].op]
+    jump_index = index + 3
+
+    def test_branch(stack, pc):
+        target = jump_index + func(value, test(stack[-1]))
+        if target > length or target < 0:
+            raise _Deoptimize
+        return target
+    return test_branch
+
+
+def _fuse_integer_quiet_branch(instructions, index, length):
+    # quiet <binary>; jump or quiet <unary>; jump
+    op = instructions[index].op
+    jump_index = index + 1
+    if op in _integer_unary_ops:
+        test = _integer_unary_ops[op]
+
+        def quiet_branch(stack, pc):
+            target = jump_index + test(stack[-1])
+            if target > length or target < 0:
+                raise _Deoptimize
+            return target
+    else:
+        func = _integer_branch_ops[op]
+
+        def quiet_branch(stack, pc):
+            target = jump_index + func(stack[-1], stack[-2])
+            if target > length or target < 0:
+                raise _Deoptimize
+            return target
+    return quiet_branch
+
+
+def _fuse_integer_binary_immediate(instructions, index, length):
+    # push k; <binary>
+    value = instructions[index].args[0]
+    op = instructions[index + 1].op
+    if op not in ('add', 'sub'):
+        func = _integer_binary_ops[op]
+
+        def binary_immediate(stack, pc):
+            stack[-1] = func(value, stack[-1])
+            return pc + 2
+        return binary_immediate
+
+    # Counting up or down can only go out of range in one direction.
+    step = value if op == 'add' else -value
+    if step >= 0:
+        highest = _integer_limit - step
+
+        def binary_immediate(stack, pc):
+            top = stack[-1]
+            if top > highest:
+                raise _Deoptimize
+            stack[-1] = top + step
+            return pc + 2
+    else:
+        lowest = -_integer_limit - step
+
+        def binary_immediate(stack, pc):
+            top = stack[-1]
+            if top < lowest:
+                raise _Deoptimize
+            stack[-1] = top + step
+            return pc + 2
+    return binary_immediate
+
+
+def _fuse_integer_binary_self(instructions, index, length):
+    # dup; <binary>
+    func = _integer_binary_ops[instructions[index + 1].op]
+
+    def binary_self(stack, pc):
+        top = stack[-1]
+        stack[-1] = func(top, top)
+        return pc + 2
+    return binary_self
+
+
+_integer_fusion_factories = {
+    'test_branch': _fuse_integer_test_branch,
+    'compare_branch': _fuse_integer_compare_branch,
+    'quiet_branch': _fuse_integer_quiet_branch,
+    'binary_immediate': _fuse_integer_binary_immediate,
+    'binary_self': _fuse_integer_binary_self,
+}
+
+# The same patterns as `_fusions`, with integer handlers
+_integer_fusions = [(name, matches, _integer_fusion_factories[name])
+                    for name, matches, _ in _fusions]
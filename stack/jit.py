@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+Compile the hot loops of a Fillmore program to Python as it runs
+
+Handlers count how often each loop goes round, and a loop that gets hot
+is traced and replaced by generated code like that from `stack.native`.
+"""
+from stack import (_handler_lengths, _max_fusion, binary_ops,
+                   compile_program, jump_ops, unary_ops)
+from stack.native import _BlockWriter, _native_padding
+
+
+def compile_jit(instructions, fuse=True, threshold=None, checked=True,
+                source=None, sink=None, summarize=False, trace=None):
+    """
+    Like `compile_program`, but loops that get hot are compiled to Python
+
+    Every handler that can jump backwards counts how often it does so for
+    each loop header. When a header reaches `threshold`, one pass through
+    the loop is run and recorded as a trace, which is translated like
+    `translate_program` into a function that runs the loop until a dynamic
+    jump goes somewhere other than where it went while recording. That
+    function replaces the handler for the header, so the `run` loop enters
+    it like any other handler. Code outside hot loops stays interpreted.
+
+    Traced loops run many instructions per handler call, so don't pass the
+    result to `run` with a budget or profile. A `Trace` is passed on to
+    `compile_program`, and traced loops record into it too.
+
+    >>> code = compile_jit(parse_program('push 100; push -1; add; quiet not; '
+    ...                                  'push 1; add; jump; jump -6'))
+    >>> run(code)
+    [0.0]
+    """
+    instructions = list(instructions)
+    code = compile_program(instructions, fuse=fuse, checked=checked,
+                           source=source, sink=sink, summarize=summarize,
+                           trace=trace)
+    tracer = _Tracer(instructions, code, threshold, source, sink, trace, fuse)
+    for index in range(len(instructions)):
+        # A fused handler can end in a jump a few instructions later.
+        window = instructions[index:index + (_max_fusion if fuse else 1)]
+        if any(instr.op in jump_ops for instr in window):
+            code[index] = tracer.counted(code[index])
+    return code
+
+
+class _Tracer(object):
+    """Counts back edges and records and compiles traces for `compile_jit`"""
+    threshold = 50
+    # Longer loops, including ones with inner loops that weren't traced
+    # first, are left to the interpreter.
+    max_length = 1000
+
+    def __init__(self, instructions, code, threshold=None, source=None,
+                 sink=None, ring=None, fuse=True):
+        self.instructions = instructions
+        self.code = code
+        # Handlers that don't record into `ring`
+        self.untraced = code if ring is None else compile_program(
+            instructions, fuse=fuse, source=source, sink=sink)
+        if threshold is not None:
+            self.threshold = threshold
+        # Handlers for single instructions, to record traces with
+        self.plain = compile_program(instructions, source=source, sink=sink)
+        self.counts = {}
+        # The `Trace` branches are recorded in, if there is one
+        self.ring = ring
+        self.branches = set() if ring is None else ring._branches
+        # Where the handlers in `code` start and end along a trace
+        self.lengths = _handler_lengths(instructions, fuse)
+
+    def counted(self, handler):
+        counts = self.counts
+        threshold = self.threshold
+
+        def counted(stack, pc):
+            target = handler(stack, pc)
+            if target <= pc:
+                count = counts.get(target, 0) + 1
+                counts[target] = count
+                if count == threshold:
+                    return self.record(stack, target)
+            return target
+        return counted
+
+    def record(self, stack, header):
+        """Run the loop at `header` once, and trace it if it comes back."""
+        plain, end = self.plain, len(self.plain)
+        trace = []
+        pc = header
+        # Instructions left in the handler `code` would be running
+        inside = 0
+        while True:
+            trace.append(pc)
+            if inside:
+                inside -= 1
+            else:
+                start = pc
+                if pc in self.branches:
+                    self.ring.record(stack, pc)
+                inside = self.lengths[pc] - 1
+            try:
+                pc = plain[pc](stack, pc)
+            except Exception as e:
+                if self.ring is not None:
+                    # `run` only knows the handler that started recording.
+                    self.ring.stopped(stack, start, e)
+                raise
+            if pc == header:
+                break
+            if pc >= end or len(trace) >= self.max_length:
+                return pc
+        self.code[header] = self.compile(trace)
+        return pc
+
+    def compile(self, trace):
+        length = len(self.instructions)
+        writer = _BlockWriter(length)
+        header = trace[0]
+        inside = 0
+        for index, next_index in zip(trace, trace[1:] + trace[:1]):
+            instr = self.instructions[index]
+            if inside:
+                inside -= 1
+            else:
+                # A handler in `code` starts here, and anything that goes
+                # wrong in it goes back to its start.
+                start = (index, list(writer.values), writer.loaded,
+                         writer.flushed)
+                writer.leave = lambda start=start: self.leave(
+                    writer, start, header)
+                if index in self.branches:
+                    self.write_entry(writer, index)
+                inside = self.lengths[index] - 1
+            if instr.op not in jump_ops:
+                writer.write(instr, index)
+            elif not instr.args:
+                self.write_guard(writer, instr, index, next_index)
+        writer.flush()
+        lines = [
+            'def fillmore_trace(stack, pc):',
+            '    buf = stack + _padding',
+            '    sp = len(stack)',
+            '    capacity = len(buf)',
+        ]
+        if self.ring is None:
+            lines.append('    while True:')
+            lines.extend('        ' + line for line in writer.lines)
+        else:
+            lines.extend([
+                '    add_pc, add_top = _add_pc, _add_top',
+                '    while True:',
+            ])
+            lines.extend('        ' + line for line in writer.lines)
+        lines.append('    return _header(stack, {})'.format(trace[0]))
+        namespace = {
+            '_handlers': self.plain,
+            '_binary_ops': binary_ops,
+            '_unary_ops': unary_ops,
+            '_padding': [0.0] * _native_padding,
+            # What ran the header before this trace replaced it
+            '_header': self.code[trace[0]],
+        }
+        if self.ring is not None:
+            namespace.update({
+                '_add_pc': self.ring.pcs.append,
+                '_add_top': self.ring.tops.append,
+                '_untraced': self.untraced,
+                '_stopped': self.ring.stopped,
+            })
+        source = '\n'.join(lines + [''])
+        exec(compile(source, '<fillmore trace>', 'exec'), namespace)
+        function = namespace['fillmore_trace']
+        function.source = source
+        return function
+
+    def write_entry(self, writer, index):
+        """Record the branch at `index` in the ring, like `Trace.record`."""
+        if writer.values:
+            top = writer.values[-1]
+        else:
+            top = '(buf[sp - 1] if sp else None)'
+        writer.emit('add_pc({})'.format(index))
+        writer.emit('add_top({})'.format(top))
+
+    def write_guard(self, writer, instr, index, expected):
+        """Leave the trace if a dynamic jump won't go to `expected`."""
+        writer.need(1)
+        value = writer.values[-1]
+        if instr.op == 'jump':
+            # Where `int` truncating the distance gives `expected`
+            distance = expected - index
+            if distance > 0:
+                test = '{} <= {} < {}'.format(distance, value, distance + 1)
+            elif distance < 0:
+                test = '{} < {} <= {}'.format(distance - 1, value, distance)
+            else:
+                test = '-1 < {} < 1'.format(value)
+        else:
+            test = '{} == {!r}'.format(value, float(expected))
+        writer.check('not {}'.format(test), None)
+        if 'quiet' not in instr.prefix:
+            writer.values.pop()
+
+    def leave(self, writer, start, header):
+        """
+        Lines that put the stack back as it was at the `start` of a
+        handler and leave the trace there, so that the interpreter runs
+        the handler and goes wherever it goes, or raises what it raises
+        """
+        index, values, loaded, flushed = start
+        lines = []
+        # Values taken from the buffer since the start are still there, and
+        # values written to it are in `values` too.
+        moved = (writer.loaded - loaded) - (writer.flushed - flushed)
+        if moved:
+            lines.append('sp += {}'.format(moved))
+        if values:
+            lines.append('buf[sp:sp + {}] = {},'.format(
+                len(values), ', '.join(values)))
+            lines.append('sp += {}'.format(len(values)))
+        lines.append('del buf[sp:]')
+        lines.append('stack[:] = buf')
+        if index in self.branches:
+            # This branch is already recorded, so it's run here by the
+            # handler that doesn't record it again.
+            lines.extend([
+                'try:',
+                '    return _untraced[{0}](stack, {0})'.format(index),
+                'except Exception as e:',
+                '    _stopped(stack, {}, e)'.format(index),
+                '    raise',
+            ])
+        elif index == header:
+            # The handler for the header is this trace now, so the old one
+            # is run after the loop.
+            lines.append('break')
+        else:
+            lines.append('return {}'.format(index))
+        return lines
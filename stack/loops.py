@@ -0,0 +1,398 @@
+# -*- coding: utf-8 -*-
+"""
+Work out what simple loops do, so they can be skipped through
+
+A counting loop's trips are summarized as a change to the stack per
+trip, and loops that could never change anything are reported instead
+of being run forever.
+"""
+from stack import InfiniteLoopError, binary_ops, jump_ops, unary_ops
+from stack.integer import _integer_limit
+from stack.verify import _BAD_TARGET, _fold, _static_target
+
+
+def loop_summaries(instructions):
+    """
+    Work out what one trip round each simple loop does to the stack
+
+    Returns a `LoopSummary` for each loop that has one, by the index of
+    its first instruction. Loops start at the target of a backward static
+    jump, and have to come back there through at most one dynamic jump
+    that depends on the stack, by comparing a value with a constant. Each
+    time round, they must leave the values they use where they found
+    them, except for one counter that moves by a fixed integer step, or
+    not change anything at all.
+
+    >>> summaries = loop_summaries(parse_program(
+    ...     'nop; push 5; @loop; push -1; add; quiet not; push 1; add; '
+    ...     'jump; jump @loop'))
+    >>> summaries[2].counter, summaries[2].step
+    (0, -1)
+    """
+    instructions = list(instructions)
+    length = len(instructions)
+    summaries = {}
+    for index, instr in enumerate(instructions):
+        if instr.op not in jump_ops or not instr.args:
+            continue
+        header = _static_target(instr, index, length)
+        if header == _BAD_TARGET or header > index or header in summaries:
+            continue
+        found = _follow_loop(instructions, header, header, _LoopState(), None,
+                             0)
+        if found is not None:
+            summary = LoopSummary.from_trip(header, *found)
+            if summary is not None:
+                summaries[header] = summary
+    return summaries
+
+
+class LoopSummary(object):
+    """
+    What one trip round a loop does, from `loop_summaries`
+
+    The loop uses the top `depth` values on the stack, and leaves them as
+    they were, except for the one `counter` places from the top, which
+    goes up by `step` each time. If `counter` is None, nothing changes.
+    It goes round again while the value `test` places from the top, plus
+    `offset`, compared with `operand` by the comparison `op`, comes out as
+    `keep_going`. The value tested is the counter, if there is one. If
+    `op` is None, it goes round forever.
+    """
+    def __init__(self, header, depth, counter=None, step=0, reach=0,
+                 test=None, offset=0, op=None, operand=None,
+                 keep_going=True):
+        self.header = header
+        self.depth = depth
+        self.counter = counter
+        self.step = step
+        # The furthest the counter, or the value tested, is ever moved
+        # from where it was at the top of the loop
+        self.reach = reach
+        self.test = test
+        self.offset = offset
+        self.op = op
+        self.operand = operand
+        self.keep_going = keep_going
+
+    @classmethod
+    def from_trip(cls, header, state, branch):
+        """The summary for a trip that ended in `state`, or None"""
+        values = state.values
+        if len(values) != state.depth:
+            return None
+        counter, step = None, 0
+        for place in range(state.depth):
+            value = values[-1 - place]
+            if value[0] != 'slot' or value[1] != place:
+                return None
+            if value[3]:
+                # Even adding 0 changes -0.0, so anything worked out from
+                # the value counts as changing it.
+                if counter is not None or value[2] == 0:
+                    return None
+                counter, step = place, value[2]
+        if branch is None:
+            if counter is not None:
+                # Counts forever, but that's not the same as not changing.
+                return None
+            return cls(header, state.depth)
+        (test, offset, op, operand), keep_going = branch
+        if counter is not None and counter != test:
+            # The test never changes, so the loop goes round forever or
+            # not at all, and there's nothing to skip.
+            return None
+        return cls(header, state.depth, counter, step, state.reach, test,
+                   offset, op, operand, keep_going)
+
+    def going(self, value):
+        """Whether the loop goes round again with `value` to test"""
+        result = binary_ops[self.op](self.operand, value + self.offset)
+        return bool(result) == self.keep_going
+
+    def skip(self, stack):
+        """
+        Move `stack` on by as many whole trips round the loop as can be
+        worked out exactly, and return how many
+
+        The stack is left at the start of the trip that leaves the loop.
+        Raises `InfiniteLoopError` if the loop would never leave and never
+        change the stack.
+        """
+        if len(stack) < self.depth:
+            # It underflows, which the handlers will report.
+            return 0
+        if self.op is None:
+            raise self.infinite()
+        limit = _integer_limit - self.reach
+        value = stack[-1 - self.test]
+        if not (isinstance(value, float) and value.is_integer() and
+                abs(value) <= limit):
+            return 0
+        if not self.going(value):
+            return 0
+        if self.counter is None:
+            raise self.infinite()
+
+        start, step, limit = int(value), self.step, int(limit)
+        # The most trips that keep the counter where it's exact
+        most = (limit - start) // step if step > 0 else (start + limit) // -step
+        if most < 1:
+            return 0
+        if self.op == 'eq':
+            if self.keep_going:
+                # Going round while equal stops after one trip.
+                return 0
+            distance = self.operand - self.offset - start
+            if not float(distance).is_integer() or distance % step:
+                # Never lands on the operand
+                return 0
+            trips = int(distance) // step
+            if not 1 <= trips <= most or \
+                    self.going(float(start + trips * step)):
+                return 0
+        else:
+            if self.going(float(start + most * step)):
+                return 0
+            # The counter only moves one way, so the test changes once.
+            low, trips = 0, most
+            while trips - low > 1:
+                middle = (low + trips) // 2
+                if self.going(float(start + middle * step)):
+                    low = middle
+                else:
+                    trips = middle
+        stack[-1 - self.counter] = float(start + trips * step)
+        return trips
+
+    def infinite(self):
+        return InfiniteLoopError(
+            "The loop at {} would never stop or change anything".format(
+                self.header))
+
+
+class _LoopState(object):
+    """
+    The stack partway round a loop, as symbols for the values it started
+    with
+
+    `values` are ('const', value), ('slot', place, offset, changed) for the
+    value `place` from the top at the start of the loop plus an integer
+    `offset`, and ('select', test, if_true, if_false) for a comparison
+    `test` of a slot, as (place, offset, op, operand), that gives one of
+    two constants. `depth` is how many of the starting values have been
+    used.
+    """
+    def __init__(self):
+        self.values = []
+        self.depth = 0
+        self.reach = 0
+
+    def copy(self):
+        state = _LoopState()
+        state.values = list(self.values)
+        state.depth = self.depth
+        state.reach = self.reach
+        return state
+
+    def need(self, count):
+        """Make sure the top `count` values are known."""
+        while len(self.values) < count:
+            self.values.insert(0, ('slot', self.depth, 0, False))
+            self.depth += 1
+
+    def top(self, count, quiet):
+        """The top `count` values, top first, popped unless `quiet`"""
+        self.need(count)
+        values = self.values[-count:][::-1]
+        if not quiet:
+            del self.values[-count:]
+        return values
+
+    def resolve(self, test, outcome):
+        """Replace selects on `test` with what they give for `outcome`."""
+        self.values = [
+            ('const', value[2] if outcome else value[3])
+            if value[0] == 'select' and value[1] == test else value
+            for value in self.values]
+
+
+# Comparisons with the operands the other way round
+_flipped = {'eq': 'eq', 'lt': 'gt', 'gt': 'lt', 'le': 'ge', 'ge': 'le'}
+
+# Integers past this can't be used as offsets and still be exact.
+_loop_offset_limit = 2 ** 52
+
+# How far round a loop `_follow_loop` will look
+_max_loop_length = 256
+
+
+def _follow_loop(instructions, header, pc, state, branch, steps):
+    """
+    Run the loop at `header` on symbols from `pc` until it comes back, and
+    return the state it comes back in and the branch it took, or None
+    """
+    length = len(instructions)
+    while True:
+        if pc == header and steps:
+            return state, branch
+        if not 0 <= pc < length or steps >= _max_loop_length:
+            return None
+        steps += 1
+        instr = instructions[pc]
+        quiet = 'quiet' in instr.prefix
+        if instr.op not in jump_ops:
+            if not _loop_step(state, instr, quiet):
+                return None
+            pc += 1
+            continue
+        if instr.args:
+            pc = _static_target(instr, pc, length)
+            if pc == _BAD_TARGET:
+                return None
+            continue
+
+        (value,) = state.top(1, quiet)
+        if value[0] == 'slot':
+            return None
+        if value[0] == 'const' or value[2] == value[3]:
+            pc = _loop_target(instr.op, pc, value[-1], length)
+            if pc is None:
+                return None
+            continue
+        test = value[1]
+        if branch is not None:
+            # The same test again has to come out the same way.
+            if branch[0] != test:
+                return None
+            pc = _loop_target(instr.op, pc,
+                              value[2] if branch[1] else value[3], length)
+            if pc is None:
+                return None
+            continue
+        found = []
+        for outcome, distance in [(True, value[2]), (False, value[3])]:
+            target = _loop_target(instr.op, pc, distance, length)
+            if target is None:
+                continue
+            taken = state.copy()
+            taken.resolve(test, outcome)
+            result = _follow_loop(instructions, header, target, taken,
+                                  (test, outcome), steps)
+            if result is not None:
+                found.append(result)
+        # Exactly one way has to go round again and the other leave.
+        return found[0] if len(found) == 1 else None
+
+
+def _loop_target(op, pc, value, length):
+    """Where a dynamic jump goes for `value`, or None if it raises"""
+    if op == 'jump':
+        if value - value != 0:
+            return None
+        target = pc + int(value)
+        return target if 0 <= target <= length else None
+    if not float.is_integer(value):
+        return None
+    target = int(value)
+    return target if 0 < target < length else None
+
+
+def _loop_step(state, instr, quiet):
+    """Apply a non-jump instruction to `state`, or return False"""
+    op, args = instr.op, instr.args
+    if op == 'nop':
+        pass
+    elif op == 'push':
+        state.values.append(('const', args[0]))
+    elif op == 'pop':
+        state.top(1, False)
+    elif op == 'dup':
+        count = int(args[0] if args else 1)
+        if count < 0:
+            return False
+        state.need(count)
+        if count:
+            state.values.extend(state.values[-count:])
+    elif op == 'swap':
+        to = 1 + int(args[0] if args else 1)
+        if to < 1:
+            return False
+        state.need(to)
+        values = state.values
+        values[-1], values[-to] = values[-to], values[-1]
+    elif op in unary_ops:
+        (a,) = state.top(1, quiet)
+        result = _loop_unary(op, a)
+        if result is None:
+            return False
+        state.values.append(result)
+    elif op in binary_ops:
+        a, b = state.top(2, quiet)
+        result = _loop_binary(op, a, b)
+        if result is None:
+            return False
+        if result[0] == 'slot':
+            state.reach = max(state.reach, abs(result[2]))
+        state.values.append(result)
+    else:
+        # `read` and `emit` do something outside the stack.
+        return False
+    return True
+
+
+def _loop_unary(op, a):
+    func = unary_ops[op]
+    if a[0] == 'const':
+        result = _fold(func, a[1])
+        return None if result is None else ('const', result)
+    if a[0] == 'select':
+        return _loop_select(a, func)
+    # `not x` is whether x == 0.
+    return ('select', (a[1], a[2], 'eq', 0.0), 1.0, 0.0)
+
+
+def _loop_binary(op, a, b):
+    # As in `binary_ops`, `a` was on top of `b`.
+    func = binary_ops[op]
+    if a[0] == b[0] == 'const':
+        result = _fold(func, a[1], b[1])
+        return None if result is None else ('const', result)
+    if a[0] == 'const' and b[0] == 'select':
+        return _loop_select(b, lambda value: func(a[1], value))
+    if b[0] == 'const' and a[0] == 'select':
+        return _loop_select(a, lambda value: func(value, b[1]))
+    if a[0] == 'const' and b[0] == 'slot':
+        slot, constant, flipped = b, a[1], False
+    elif b[0] == 'const' and a[0] == 'slot':
+        slot, constant, flipped = a, b[1], True
+    else:
+        return None
+    _, place, offset, _ = slot
+    if op in _flipped:
+        op = _flipped[op] if flipped else op
+        return ('select', (place, offset, op, constant), 1.0, 0.0)
+    if op not in ('add', 'sub') or (op == 'sub' and flipped):
+        return None
+    if not (float.is_integer(constant) and
+            abs(constant) <= _loop_offset_limit):
+        return None
+    offset += int(constant) if op == 'add' else -int(constant)
+    if abs(offset) > _loop_offset_limit:
+        return None
+    return ('slot', place, offset, True)
+
+
+def _loop_select(select, func):
+    if_true = _fold(func, select[2])
+    if_false = _fold(func, select[3])
+    if if_true is None or if_false is None:
+        return None
+    return ('select', select[1], if_true, if_false)
+
+
+def _summarized(handler, summary):
+    def summarized(stack, pc):
+        summary.skip(stack)
+        return handler(stack, pc)
+    return summarized
@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+"""
+Translate Fillmore programs to Python source
+
+The generated function keeps the stack in a preallocated buffer and
+values in locals, and `compile` turns it into bytecode that runs without
+a handler call per instruction.
+"""
+from stack import (binary_ops, compile_program, jump_ops, parse_program,
+                   unary_ops)
+from stack.verify import (_BAD_TARGET, _stack_states, _static_target,
+                          _underflow_free, stack_growth)
+
+
+def eval_native(program):
+    """
+    Evaluate a program by translating it to Python
+
+    >>> eval_native('push 1; push 2; add')
+    [3.0]
+    """
+    return compile_native(parse_program(program))()
+
+
+def compile_native(instructions, source=None, sink=None):
+    """
+    Translate instructions with `translate_program` and return a function
+    that runs them on an optional initial stack.
+
+    `read` and `emit` go through the handlers from `compile_program`,
+    with `source` and `sink`.
+    """
+    instructions = list(instructions)
+    states = _stack_states(instructions, 0)
+    checked = states is None or not _underflow_free(instructions, states)
+    if checked:
+        growth = stack_growth(instructions)
+    else:
+        # Nothing underflows, so the depths from an empty stack are exactly
+        # how far the stack can grow.
+        growth = max(state[1] for state in states if state is not None)
+    text = translate_program(instructions, growth, checked)
+    namespace = {
+        '_handlers': compile_program(instructions, checked=checked,
+                                     source=source, sink=sink),
+        '_binary_ops': binary_ops,
+        '_unary_ops': unary_ops,
+        '_padding': [0.0] * (_native_padding if growth is None else growth),
+    }
+    exec(compile(text, '<fillmore>', 'exec'), namespace)
+    native = namespace['fillmore_program']
+
+    def program(stack=None):
+        return native([] if stack is None else stack)
+    program.source = text
+    return program
+
+
+def translate_program(instructions, growth=None, checked=True):
+    """
+    Generate the source of a Python function equivalent to `instructions`
+
+    The stack is copied into a list `buf` padded with `_padding`, and `sp`
+    counts how much of it is in use, so pushes and pops don't resize it.
+    With `growth`, the bound from `stack_growth`, the padding is known to
+    be big enough; without it, writes past the end grow the list. Without
+    `checked`, the program must have passed `verify_program`, and reads
+    from the buffer aren't checked for underflow.
+
+    Values are kept in local variables until they have to be written back
+    to the buffer, at a block boundary. Programs without dynamic jumps
+    that never come back to an instruction take a single path, which
+    becomes straight-line code with the static jumps left out; otherwise
+    each basic block becomes a branch of a `pc` switch. Dynamic jumps that
+    land anywhere but the start of a block fall back to the compiled
+    handler for that instruction.
+    """
+    instructions = list(instructions)
+    length = len(instructions)
+    header = [
+        'def fillmore_program(stack):',
+        '    buf = stack + _padding',
+        '    sp = len(stack)',
+        '    capacity = len(buf)',
+    ]
+    footer = [
+        '    del buf[sp:]',
+        '    stack[:] = buf',
+        '    return stack',
+        '',
+    ]
+    bounded = growth is not None
+    path = _straight_path(instructions)
+    if path is not None:
+        writer = _BlockWriter(length, bounded, checked)
+        for index in path:
+            instr = instructions[index]
+            if _static_target(instr, index, length) in (None, _BAD_TARGET):
+                writer.write(instr, index)
+        if not writer.ended:
+            writer.flush()
+        body = ['    ' + line for line in writer.lines]
+        return '\n'.join(header + body + footer)
+
+    leaders = sorted(_block_leaders(instructions))
+    blocks = {}
+    for start, stop in zip(leaders, leaders[1:] + [length]):
+        writer = _BlockWriter(length, bounded, checked)
+        for index in range(start, stop):
+            writer.write(instructions[index], index)
+        if not writer.ended:
+            writer.flush()
+            writer.emit('pc = {}'.format(stop))
+        blocks[start] = writer.lines
+    lines = header + ['    pc = 0', '    while pc < {}:'.format(length)]
+    _write_dispatch(lines, leaders, blocks, 2)
+    return '\n'.join(lines + footer)
+
+
+def _straight_path(instructions):
+    """
+    The indexes a program runs through, if it can only go one way
+
+    Returns None if the program has a dynamic jump or comes back to an
+    instruction it has already run. The path ends at the end of the
+    program or at a static jump that is out of bounds.
+    """
+    length = len(instructions)
+    path = []
+    seen = set()
+    index = 0
+    while index < length and index not in seen:
+        seen.add(index)
+        path.append(index)
+        instr = instructions[index]
+        if instr.op not in jump_ops:
+            index += 1
+        elif not instr.args:
+            return None
+        else:
+            index = _static_target(instr, index, length)
+            if index == _BAD_TARGET:
+                return path
+    return path if index >= length else None
+
+
+def _block_leaders(instructions):
+    length = len(instructions)
+    leaders = {0}
+    for index, instr in enumerate(instructions):
+        if instr.op not in jump_ops:
+            continue
+        leaders.add(index + 1)
+        if instr.args and instr.op == 'jump':
+            leaders.add(index + int(instr.args[0]))
+        elif instr.args:
+            leaders.add(int(instr.args[0]))
+        elif instr.op == 'jump':
+            # Conditional jumps are almost always `jump 1` or `jump 2`.
+            leaders.add(index + 2)
+    return {leader for leader in leaders if 0 <= leader < length}
+
+
+def _write_dispatch(lines, leaders, blocks, depth):
+    indent = '    ' * depth
+    if len(leaders) > 4:
+        middle = len(leaders) // 2
+        lines.append('{}if pc < {}:'.format(indent, leaders[middle]))
+        _write_dispatch(lines, leaders[:middle], blocks, depth + 1)
+        lines.append('{}else:'.format(indent))
+        _write_dispatch(lines, leaders[middle:], blocks, depth + 1)
+        return
+    for number, leader in enumerate(leaders):
+        keyword = 'if' if number == 0 else 'elif'
+        lines.append('{}{} pc == {}:'.format(indent, keyword, leader))
+        lines.extend(indent + '    ' + line for line in blocks[leader])
+    lines.append('{}else:'.format(indent))
+    lines.extend(indent + '    ' + line
+                 for line in _call_handler('pc = _handlers[pc]', 'pc'))
+
+
+# Without a bound on the stack, start with room for this many values.
+_native_padding = 64
+
+
+def _call_handler(call, index):
+    """Lines that run a compiled handler on the part of `buf` in use."""
+    return [
+        'del buf[sp:]',
+        '{}(buf, {})'.format(call, index),
+        'sp = len(buf)',
+        'buf += [0.0] * (capacity - sp)',
+    ]
+
+
+_native_binary = {
+    'add': '{a} + {b}',
+    'sub': '{a} - {b}',
+    'mul': '{a} * {b}',
+    'div': '{a} / {b}',
+    'pow': '{a} ** {b}',
+    'eq': '1.0 if {a} == {b} else 0.0',
+    'gt': '1.0 if {a} > {b} else 0.0',
+    'ge': '1.0 if {a} >= {b} else 0.0',
+    'lt': '1.0 if {a} < {b} else 0.0',
+    'le': '1.0 if {a} <= {b} else 0.0',
+}
+
+
+_native_unary = {
+    'not': '0.0 if {a} else 1.0',
+}
+
+
+class _BlockWriter(object):
+    """
+    Generates Python for a run of instructions with no jumps into it
+
+    `values` holds the expressions for the items above `buf[sp]`, top
+    last. They are only written back to the buffer by `flush`. If the
+    program is `bounded` the buffer never needs to grow, and if it isn't
+    `checked` the buffer never underflows. If `leave` is set, it gives
+    the lines to run instead of raising when the stack is too short.
+    """
+    # Deeper swaps and dups are done in the buffer instead of locals.
+    max_window = 8
+
+    def __init__(self, length, bounded=False, checked=True):
+        self.length = length
+        self.bounded = bounded
+        self.checked = checked
+        self.lines = []
+        self.values = []
+        self.ended = False
+        self.temps = 0
+        # How many values `need` has taken from the buffer, and `flush` has
+        # put there
+        self.loaded = self.flushed = 0
+        self.leave = None
+
+    def emit(self, line):
+        self.lines.append(line)
+
+    def temp(self, expression):
+        name = 'v{}'.format(self.temps)
+        self.temps += 1
+        self.emit('{} = {}'.format(name, expression))
+        return name
+
+    def need(self, count):
+        """Move values from the buffer into locals until there are `count`."""
+        missing = count - len(self.values)
+        if missing <= 0:
+            return
+        self.emit('sp -= {}'.format(missing))
+        self.loaded += missing
+        if self.checked:
+            self.check('sp < 0', "raise IndexError('pop from empty list')")
+        self.values[:0] = [
+            self.temp('buf[sp + {}]'.format(offset) if offset else 'buf[sp]')
+            for offset in range(missing)]
+
+    def flush(self):
+        count = len(self.values)
+        if count == 1 and self.bounded:
+            self.emit('buf[sp] = {}'.format(self.values[0]))
+        elif count:
+            self.emit('buf[sp:sp + {}] = {},'.format(
+                count, ', '.join(self.values)))
+        if count:
+            self.emit('sp += {}'.format(count))
+        self.flushed += count
+        self.values = []
+
+    def check(self, condition, error):
+        self.emit('if {}:'.format(condition))
+        lines = [error] if self.leave is None else self.leave()
+        for line in lines:
+            self.emit('    ' + line)
+
+    def fallback(self, index):
+        self.flush()
+        for line in _call_handler('_handlers[{}]'.format(index), index):
+            self.emit(line)
+
+    def write(self, instr, index):
+        quiet = 'quiet' in instr.prefix
+        op = instr.op
+        if op == 'push':
+            value = instr.args[0]
+            if value != value or value in (float('inf'), float('-inf')):
+                self.values.append("float('{}')".format(value))
+            else:
+                self.values.append('({!r})'.format(value))
+        elif op == 'pop':
+            self.need(1)
+            self.values.pop()
+        elif op == 'nop':
+            pass
+        elif op in binary_ops:
+            self.need(2)
+            b, a = self.values[-1], self.values[-2]
+            if not quiet:
+                del self.values[-2:]
+            if op in _native_binary:
+                expression = _native_binary[op].format(a=a, b=b)
+            else:
+                expression = '_binary_ops[{!r}]({}, {})'.format(op, b, a)
+            self.values.append(self.temp(expression))
+        elif op in unary_ops:
+            self.need(1)
+            a = self.values[-1] if quiet else self.values.pop()
+            if op in _native_unary:
+                expression = _native_unary[op].format(a=a)
+            else:
+                expression = '_unary_ops[{!r}]({})'.format(op, a)
+            self.values.append(self.temp(expression))
+        elif op == 'swap':
+            gap = int(instr.args[0] if instr.args else 1)
+            if 0 <= gap < self.max_window:
+                self.need(gap + 1)
+                to = -(gap + 1)
+                self.values[-1], self.values[to] = (
+                    self.values[to], self.values[-1])
+            elif gap >= 0:
+                self.flush()
+                if self.checked:
+                    self.check('sp <= {}'.format(gap),
+                               "raise IndexError('list index out of range')")
+                self.emit('buf[sp - 1], buf[sp - {0}] = buf[sp - {0}], '
+                          'buf[sp - 1]'.format(gap + 1))
+            else:
+                self.fallback(index)
+        elif op == 'dup':
+            dup_depth = int(instr.args[0] if instr.args else 1)
+            if 0 <= dup_depth <= self.max_window:
+                if dup_depth:
+                    self.need(dup_depth)
+                    self.values.extend(self.values[-dup_depth:])
+            elif dup_depth > 0:
+                self.flush()
+                if self.checked:
+                    self.check('sp < {}'.format(dup_depth),
+                               'raise IndexError("Cannot dup {} elements, '
+                               'stack has {{}}".format(sp))'.format(dup_depth))
+                self.emit('buf[sp:sp + {0}] = buf[sp - {0}:sp]'.format(
+                    dup_depth))
+                self.emit('sp += {}'.format(dup_depth))
+            else:
+                self.fallback(index)
+        elif op == 'jump':
+            self.write_jump(instr, index, quiet)
+        elif op == 'to':
+            self.write_to(instr, index, quiet)
+        else:
+            self.fallback(index)
+
+    def write_jump(self, instr, index, quiet):
+        self.ended = True
+        if instr.args:
+            self.flush()
+            target = index + int(instr.args[0])
+            if target > self.length or target < 0:
+                self.emit('raise IndexError')
+            else:
+                self.emit('pc = {}'.format(target))
+            return
+        self.need(1)
+        distance = self.values[-1] if quiet else self.values.pop()
+        self.emit('pc = {} + int({})'.format(index, distance))
+        self.flush()
+        self.emit('if pc > {} or pc < 0:'.format(self.length))
+        self.emit('    raise IndexError')
+
+    def write_to(self, instr, index, quiet):
+        self.ended = True
+        if instr.args:
+            self.flush()
+            target = int(instr.args[0])
+            if target >= self.length or target <= 0:
+                self.emit('raise IndexError("Jump address {} out of bounds '
+                          '({})")'.format(target, self.length - 1))
+            else:
+                self.emit('pc = {}'.format(target))
+            return
+        self.need(1)
+        jump_to = self.values[-1] if quiet else self.values.pop()
+        self.emit('if not float.is_integer({}):'.format(jump_to))
+        self.emit('    raise TypeError("Expected an integer, got a: {{}}"'
+                  '.format({}))'.format(jump_to))
+        self.emit('pc = int({})'.format(jump_to))
+        self.flush()
+        self.emit('if pc >= {} or pc <= 0:'.format(self.length))
+        self.emit('    raise IndexError("Jump address {{}} out of bounds '
+                  '({})".format(pc))'.format(self.length - 1))
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Peephole optimizations for parsed Fillmore programs
+"""
+from stack import Instr, binary_ops, jump_ops, unary_ops
+from stack.verify import (_BAD_TARGET, _dynamic_targets, _fold,
+                          _stack_states, _static_target)
+
+
+def optimize_program(instructions):
+    """
+    Run peephole optimizations over a parsed program
+
+    Returns the new instructions and the number of instructions each rule
+    removed (or, for `jump_thread`, rewrote). Static `jump` and `to`
+    targets are remapped as instructions move. Dynamic jumps can only go
+    where the values they might pop take them, and the instructions
+    between each one and those targets are left where they are. If a
+    dynamic jump could pop anything, the program is returned unchanged.
+
+    >>> optimize_program(parse_program('push 2; push 3; mul; nop'))[0]
+    [Instr('push', [6.0])]
+    """
+    program = [Instr(instr.op, list(instr.args), list(instr.prefix))
+               for instr in instructions]
+    stats = {
+        'constant_fold': 0,
+        'nop': 0,
+        'push_pop': 0,
+        'jump_next': 0,
+        'jump_thread': 0,
+    }
+    pinned = _pinned_indexes(program)
+    if pinned is None:
+        return program, stats
+    length = len(program)
+    targets = [_static_target(instr, index, length)
+               for index, instr in enumerate(program)]
+    pinned = [index in pinned for index in range(length)]
+    changed = True
+    while changed:
+        changed = _thread_jumps(program, targets, stats)
+        changed = _peephole(program, targets, pinned, stats) or changed
+    length = len(program)
+    for index, (instr, target) in enumerate(zip(program, targets)):
+        if target is None:
+            continue
+        elif target == _BAD_TARGET:
+            # Keep jumps that are out of bounds out of bounds.
+            if instr.op == 'jump':
+                instr.args = [float(-1 - index)]
+            else:
+                instr.args = [0.0]
+        elif instr.op == 'to' and 0 < target < length:
+            instr.args = [float(target)]
+        else:
+            # `to` can't reach the first instruction or the end of the
+            # program, but a relative jump can.
+            instr.op, instr.args = 'jump', [float(target - index)]
+    return program, stats
+
+
+def _pinned_indexes(program):
+    """
+    The indexes that have to stay where they are for dynamic jumps, or None
+
+    A relative `jump` only lands in the right place while nothing between
+    it and its target moves, and a `to` while nothing before its target
+    does. The targets are kept too, so that nothing is folded into them.
+    """
+    length = len(program)
+    dynamic = [index for index, instr in enumerate(program)
+               if instr.op in jump_ops and not instr.args]
+    if not dynamic:
+        return set()
+    states = _stack_states(program)
+    if states is None:
+        return None
+    pinned = set()
+    for index in dynamic:
+        state = states[index]
+        if state is None:
+            # Never runs
+            continue
+        op = program[index].op
+        distances = state[2][-1] if state[2] else None
+        if distances is None:
+            return None
+        for target in _dynamic_targets(op, distances, index, length):
+            if op == 'jump':
+                pinned.update(range(min(index, target),
+                                    max(index, target) + 1))
+            else:
+                pinned.update(range(target + 1))
+    return pinned
+
+
+def _thread_jumps(program, targets, stats):
+    """Point jumps to other jumps at their final destination."""
+    changed = False
+    for index, target in enumerate(targets):
+        if target is None or target == _BAD_TARGET:
+            continue
+        seen = {index}
+        while (target < len(program) and targets[target] is not None and
+               targets[target] != _BAD_TARGET and target not in seen):
+            seen.add(target)
+            target = targets[target]
+        if target != targets[index]:
+            targets[index] = target
+            stats['jump_thread'] += 1
+            changed = True
+    return changed
+
+
+def _peephole(program, targets, pinned, stats):
+    length = len(program)
+    jumped_to = set(targets)
+    jumped_to.update(index for index in range(length) if pinned[index])
+    new_program, new_targets, new_pinned = [], [], []
+    # Removed instructions map to the next instruction that is kept.
+    index_map = [0] * (length + 1)
+    index = 0
+    while index < length:
+        instr = program[index]
+        index_map[index] = len(new_program)
+        after = index + 1
+        if pinned[index]:
+            new_program.append(instr)
+            new_targets.append(targets[index])
+            new_pinned.append(True)
+            index += 1
+            continue
+        if instr.op == 'nop':
+            stats['nop'] += 1
+            index += 1
+            continue
+        if targets[index] == after:
+            stats['jump_next'] += 1
+            index += 1
+            continue
+        if instr.op == 'push' and after < length and after not in jumped_to:
+            next_instr = program[after]
+            if next_instr.op == 'pop':
+                stats['push_pop'] += 2
+                index += 2
+                continue
+            folded = None
+            if next_instr.op in unary_ops and 'quiet' not in next_instr.prefix:
+                folded = _fold(unary_ops[next_instr.op], instr.args[0])
+                removed = 1
+            elif (next_instr.op == 'push' and after + 1 < length and
+                    after + 1 not in jumped_to and
+                    program[after + 1].op in binary_ops and
+                    'quiet' not in program[after + 1].prefix):
+                folded = _fold(binary_ops[program[after + 1].op],
+                               next_instr.args[0], instr.args[0])
+                removed = 2
+            if folded is not None:
+                new_program.append(Instr('push', [folded]))
+                new_targets.append(None)
+                new_pinned.append(False)
+                stats['constant_fold'] += removed
+                index += removed + 1
+                continue
+        new_program.append(instr)
+        new_targets.append(targets[index])
+        new_pinned.append(False)
+        index += 1
+    index_map[length] = len(new_program)
+    if len(new_program) == length:
+        return False
+    program[:] = new_program
+    pinned[:] = new_pinned
+    targets[:] = [target if target is None or target == _BAD_TARGET
+                  else index_map[target] for target in new_targets]
+    return True
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Evaluate many independent Fillmore programs on a pool of processes
+
+Programs are sent to the workers in chunks, each exactly once, and every
+program gets its own `Result`, so one failing program doesn't stop the
+rest of the batch.
+"""
+import multiprocessing
+import pickle
+from collections import namedtuple
+from itertools import islice
+
+from stack import compile_program, run
+from stack.bytecode import Bytecode
+from stack.cache import program_cache
+
+# `stack` is the final stack, or None if the program raised `error`.
+Result = namedtuple('Result', ['index', 'stack', 'error'])
+
+
+def evaluate_many(programs, processes=None, chunksize=32, budget=None,
+                  ordered=True):
+    """
+    Evaluate `programs` in parallel and yield a `Result` for each
+
+    Programs can be source strings, `Bytecode` or parsed instructions.
+    Results come back in the same order as `programs`, or as soon as each
+    chunk is done if `ordered` is False. With a `budget`, a program that
+    runs more than that many instructions fails with `BudgetExceeded`
+    instead of holding on to its worker.
+    """
+    jobs = ((chunk, budget) for chunk in _chunks(programs, chunksize))
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.imap if ordered else pool.imap_unordered
+        for chunk in results(_run_chunk, jobs):
+            for result in chunk:
+                yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _chunks(programs, size):
+    programs = enumerate(programs)
+    while True:
+        chunk = [(index, _portable(program))
+                 for index, program in islice(programs, size)]
+        if not chunk:
+            return
+        yield chunk
+
+
+def _portable(program):
+    """Source stays as it is; anything else is shipped as bytecode."""
+    if isinstance(program, str):
+        return program
+    if not isinstance(program, Bytecode):
+        program = Bytecode.from_instructions(program)
+    return program.tobytes()
+
+
+def _run_chunk(job):
+    chunk, budget = job
+    return [_run_one(index, program, budget) for index, program in chunk]
+
+
+def _run_one(index, program, budget):
+    try:
+        if isinstance(program, bytes):
+            instructions = Bytecode.frombuffer(program)
+        else:
+            instructions = program_cache.get(program)
+        # Fused handlers would count as one instruction against the budget
+        code = compile_program(instructions, fuse=budget is None)
+        return Result(index, run(code, budget=budget), None)
+    except Exception as e:
+        try:
+            pickle.dumps(e)
+        except Exception:
+            e = RuntimeError(repr(e))
+        return Result(index, None, e)
@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+"""
+Serve Fillmore evaluation to other local processes
+
+    python -m stack.server (--socket PATH | --port PORT) [--processes N]
+                           [--budget N] [--cache DIR]
+
+Clients connect to a Unix socket or a localhost TCP port and send one
+JSON request per line:
+
+    {"id": 1, "program": "push 2; dup; mul", "stack": [1], "budget": 1000}
+
+and get one JSON response per line, in the same order:
+
+    {"id": 1, "stack": [1.0, 4.0], "hash": "9f1c..."}
+
+Once a program has been sent, `"hash"` can be given instead of
+`"program"`. Any number of requests can be sent before reading the
+responses. A request that fails gets `"error"`, with the exception's
+`type` and `message`, in place of `"stack"`. `{"stats": true}` gets the
+server's counters and latency percentiles instead.
+
+Programs run on a pool of worker processes that stay up between
+requests. The workers share one `ProgramCache` directory, so a program
+parsed by one is loaded as bytecode by the others, and each keeps the
+compiled handlers for the programs it has run recently.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from queue import Queue
+
+from stack import compile_program, parse_program, run
+from stack.cache import program_cache
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class EvalServer(object):
+    """
+    Evaluate programs sent over a socket on a pool of warm processes
+
+    `address` is the path of a Unix socket, or a (host, port) pair to
+    listen on over TCP. Every request is limited to `budget` instructions,
+    if that is given, and may ask for a smaller limit of its own. Parsed
+    programs are shared through `cache_dir`, or a temporary directory
+    that is removed by `close`.
+    """
+    # The most requests a connection can have waiting for their responses
+    # before the server stops reading from it
+    pipeline_depth = 1024
+    # How many of the latest requests the latency percentiles cover
+    latency_window = 10000
+
+    def __init__(self, address, processes=None, budget=None, cache_dir=None,
+                 cache_size=1024):
+        if cache_dir is not None and not (
+                os.path.isdir(cache_dir) and os.access(cache_dir, os.W_OK)):
+            raise ValueError('The cache directory {} is not a writable '
+                             'directory'.format(cache_dir))
+        self.budget = budget
+        self._temporary = cache_dir is None
+        self.cache_dir = tempfile.mkdtemp() if cache_dir is None else cache_dir
+        self.pool = multiprocessing.Pool(
+            processes, initializer=_start_worker,
+            initargs=(self.cache_dir, cache_size))
+        if isinstance(address, str):
+            self._server = _UnixServer(address, _Connection)
+        else:
+            self._server = _TCPServer(address, _Connection)
+        self._server.evaluator = self
+        self._thread = None
+
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self._latencies = deque(maxlen=self.latency_window)
+        self.requests = self.errors = self.connections = 0
+
+    @property
+    def address(self):
+        """Where the server is listening, with the real port for port 0"""
+        return self._server.server_address
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def start(self):
+        """Serve from a background thread, and return the server."""
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def close(self):
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+        self._server.server_close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+        self.pool.terminate()
+        self.pool.join()
+        if self._temporary:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def submit(self, request):
+        """
+        Start handling a decoded request, and return a function that waits
+        for its response
+        """
+        if not isinstance(request, dict):
+            return _ready(_error('ValueError', 'Requests must be objects'))
+        if request.get('stats'):
+            return lambda: self.stats()
+        try:
+            budget = _budget(request.get('budget'), self.budget)
+        except ValueError as e:
+            return _ready(_error('ValueError', str(e)))
+        job = (request.get('program'), request.get('hash'),
+               request.get('stack'), budget)
+        return self.pool.apply_async(_evaluate, (job,)).get
+
+    def record(self, response, started):
+        with self._lock:
+            self.requests += 1
+            if 'error' in response:
+                self.errors += 1
+            self._latencies.append(time.perf_counter() - started)
+
+    def stats(self):
+        """Counters since the server started and the latest latencies"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            uptime = time.perf_counter() - self._started
+            return {
+                'requests': self.requests,
+                'errors': self.errors,
+                'connections': self.connections,
+                'uptime': uptime,
+                'throughput': self.requests / uptime if uptime else 0.0,
+                'latency': {
+                    'p50': _percentile(latencies, 50),
+                    'p90': _percentile(latencies, 90),
+                    'p99': _percentile(latencies, 99),
+                    'max': latencies[-1] if latencies else None,
+                },
+            }
+
+
+class _Connection(socketserver.StreamRequestHandler):
+    """
+    Reads requests from one client while a second thread writes their
+    responses, so a client can keep sending without waiting
+    """
+    def handle(self):
+        evaluator = self.server.evaluator
+        with evaluator._lock:
+            evaluator.connections += 1
+        pending = Queue(evaluator.pipeline_depth)
+        writer = threading.Thread(target=self.respond,
+                                  args=(evaluator, pending))
+        writer.daemon = True
+        writer.start()
+        try:
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                started = time.perf_counter()
+                try:
+                    request = json.loads(line.decode('utf-8'))
+                except ValueError as e:
+                    request, wait = None, _ready(_error('ValueError', str(e)))
+                else:
+                    wait = evaluator.submit(request)
+                pending.put((request, wait, started))
+        finally:
+            pending.put(None)
+            writer.join()
+            with evaluator._lock:
+                evaluator.connections -= 1
+
+    def respond(self, evaluator, pending):
+        out = self.connection.makefile('wb')
+        try:
+            while True:
+                item = pending.get()
+                if item is None:
+                    break
+                request, wait, started = item
+                response = wait()
+                if isinstance(request, dict) and 'id' in request:
+                    response['id'] = request['id']
+                if not (isinstance(request, dict) and request.get('stats')):
+                    evaluator.record(response, started)
+                out.write(json.dumps(response).encode('utf-8') + b'\n')
+                # Responses that are ready together go out together.
+                if pending.empty():
+                    out.flush()
+            out.flush()
+        except (IOError, OSError):
+            # The client went away; keep draining so the reader can finish.
+            while pending.get() is not None:
+                pass
+        finally:
+            out.close()
+
+
+class Client(object):
+    """
+    A connection to an `EvalServer`
+
+    `request` sends one request and waits for its response, and `pipeline`
+    sends a list of them before reading any responses.
+    """
+    def __init__(self, address, timeout=None):
+        family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+        self.socket = socket.socket(family, socket.SOCK_STREAM)
+        self.socket.settimeout(timeout)
+        self.socket.connect(address)
+        self._file = self.socket.makefile('rwb')
+
+    def request(self, **fields):
+        return self.pipeline([fields])[0]
+
+    def pipeline(self, requests):
+        for request in requests:
+            self._file.write(json.dumps(request).encode('utf-8') + b'\n')
+        self._file.flush()
+        return [json.loads(self._file.readline().decode('utf-8'))
+                for _ in requests]
+
+    def close(self):
+        self._file.close()
+        self.socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _ready(response):
+    return lambda: response
+
+
+def _error(kind, message):
+    return {'error': {'type': kind, 'message': message}}
+
+
+def _budget(requested, limit):
+    if requested is None:
+        return limit
+    if isinstance(requested, bool) or not isinstance(requested, int) \
+            or requested < 0:
+        raise ValueError('budget must be a non-negative integer, was {!r}'
+                         .format(requested))
+    return requested if limit is None else min(requested, limit)
+
+
+def _percentile(ordered, percent):
+    """The nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return None
+    rank = -(-len(ordered) * percent // 100)
+    return ordered[max(0, int(rank) - 1)]
+
+
+# Compiled handlers by program hash and whether they're fused, in each
+# worker, least recently used first
+_compiled = OrderedDict()
+_compiled_size = 1024
+
+
+def _start_worker(cache_dir, cache_size):
+    global _compiled_size
+    program_cache.directory = cache_dir
+    program_cache.maxsize = _compiled_size = cache_size
+    # Anything compiled on first use is ready before the first request.
+    run(compile_program(parse_program('push 1; dup; add'), fuse=True))
+
+
+def _evaluate(job):
+    program, key, initial, budget = job
+    try:
+        if program is not None:
+            if not isinstance(program, str):
+                return _error('ValueError', 'program must be a string')
+            key = program_cache.key(program)
+        elif not isinstance(key, str):
+            return _error('ValueError', 'Requests need a program or a hash')
+        # Fused handlers would count as one instruction against the budget
+        fuse = budget is None
+        code = _compiled.pop((key, fuse), None)
+        if code is None:
+            if program is not None:
+                instructions = program_cache.get(program)
+            else:
+                instructions = program_cache.lookup(key)
+                if instructions is None:
+                    return _error('KeyError',
+                                  'No program with the hash {}'.format(key))
+            code = compile_program(instructions, fuse=fuse)
+            while len(_compiled) >= _compiled_size:
+                _compiled.popitem(last=False)
+        # Reinserted, so it moves to the end
+        _compiled[key, fuse] = code
+        values = [float(value) for value in initial or []]
+        return {'stack': run(code, values, budget=budget), 'hash': key}
+    except Exception as e:
+        return _error(type(e).__name__, str(e))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m stack.server')
+    where = parser.add_mutually_exclusive_group(required=True)
+    where.add_argument('--socket', help='listen on this Unix socket')
+    where.add_argument('--port', type=int,
+                       help='listen on this TCP port on localhost')
+    parser.add_argument('--processes', type=int,
+                        help='worker processes (default: one per CPU)')
+    parser.add_argument('--budget', type=int,
+                        help='the most instructions a request can run')
+    parser.add_argument('--cache', help='share parsed programs in this '
+                        'directory (default: a temporary one)')
+    args = parser.parse_args(argv)
+
+    address = args.socket or ('127.0.0.1', args.port)
+    try:
+        server = EvalServer(address, processes=args.processes,
+                            budget=args.budget, cache_dir=args.cache)
+    except ValueError as e:
+        parser.error(str(e))
+    print('Listening on {}'.format(server.address), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,314 @@
+# -*- coding: utf-8 -*-
+"""
+Static analysis of how Fillmore programs use the stack
+
+`verify_program` proves that a program never underflows, so it can be
+compiled without stack checks, and `stack_growth` bounds how far it can
+grow.
+"""
+from stack import StackUnderflowError, binary_ops, jump_ops, unary_ops
+
+
+_BAD_TARGET = -1
+
+
+def _static_target(instr, index, length):
+    """The index `instr` always jumps to, `_BAD_TARGET` or None."""
+    if not instr.args:
+        return None
+    elif instr.op == 'jump':
+        target = index + int(instr.args[0])
+        return target if 0 <= target <= length else _BAD_TARGET
+    elif instr.op == 'to':
+        target = int(instr.args[0])
+        return target if 0 < target < length else _BAD_TARGET
+    return None
+
+
+def _fold(func, *args):
+    """The result of `func(*args)`, or None if it can't be a constant."""
+    try:
+        result = func(*args)
+    except Exception:
+        # Leave the error for when the program runs.
+        return None
+    return result if isinstance(result, float) else None
+
+
+def stack_growth(instructions):
+    """
+    An upper bound on how much `instructions` can grow the stack, or None
+
+    The bound holds whatever the initial stack is. It is None when some
+    loop can push without limit, or the program uses an operation whose
+    effect on the stack can't be known ahead of time.
+
+    >>> stack_growth(parse_program('push 1; dup; dup; add'))
+    3
+    >>> stack_growth(parse_program('push 1; jump -1'))
+    """
+    states = _stack_states(list(instructions))
+    if states is None:
+        return None
+    return max(state[1] for state in states if state is not None)
+
+
+def stack_depths(instructions):
+    """
+    The lowest and highest stack depth each instruction can start with
+
+    Depths are counted from an empty stack. Instructions that can't be
+    reached are None, and the result is None if the depth is unbounded.
+
+    >>> stack_depths(parse_program('push 1; dup; add; jump 2; pop'))
+    [(0, 0), (1, 1), (2, 2), (1, 1), None]
+    """
+    states = _stack_states(list(instructions), 0)
+    if states is None:
+        return None
+    return [None if state is None else state[:2] for state in states[:-1]]
+
+
+def verify_program(instructions):
+    """
+    Check, without running them, that `instructions` can't underflow
+
+    Raises `StackUnderflowError` if the program underflows every time it
+    runs from an empty stack. Otherwise returns True if no instruction can
+    underflow, and False if that depends on something the analysis can't
+    follow, such as a jump to a computed address.
+
+    >>> verify_program(parse_program('push 1; dup; add'))
+    True
+    >>> verify_program(parse_program('push 1; add'))
+    Traceback (most recent call last):
+      ...
+    stack.StackUnderflowError: add at 1 needs 2 values, the stack has 1
+    """
+    instructions = list(instructions)
+    length = len(instructions)
+    index, depth, values, seen = 0, 0, (), set()
+    # Follow the program for as long as there is only one way it can go.
+    while index < length and index not in seen:
+        seen.add(index)
+        instr = instructions[index]
+        effect = _stack_effect(instr, index, length, values)
+        if effect is None:
+            break
+        need, change, targets, values = effect
+        if depth < need:
+            raise StackUnderflowError(
+                '{} at {} needs {} values, the stack has {}'.format(
+                    instr.op, index, need, depth))
+        if len(targets) != 1 or instr.op in ('div', 'pow'):
+            # These can fail before anything underflows.
+            break
+        depth += change
+        index = targets[0]
+    states = _stack_states(instructions, 0)
+    return states is not None and _underflow_free(instructions, states)
+
+
+def _underflow_free(instructions, states):
+    length = len(instructions)
+    for index, (instr, state) in enumerate(zip(instructions, states)):
+        if state is None:
+            continue
+        effect = _stack_effect(instr, index, length, state[2])
+        if effect is None or state[0] < effect[0]:
+            return False
+    return True
+
+
+# How many values from the top of the stack the analysis keeps track of,
+# and how many possible values each of them can have.
+_tracked_depth = 8
+_tracked_values = 8
+# Operations that always give 0 or 1, whatever their operands.
+_boolean_ops = {'eq', 'gt', 'ge', 'lt', 'le', 'not'}
+
+
+def _stack_states(instructions, initial=None):
+    """
+    The stack at the start of each instruction, and at the end
+
+    Each state is (lower bound, upper bound, values), where values holds
+    the set of possible values (or None) for the top few items, top last.
+    With no initial depth, depths are relative to the start and the lower
+    bound isn't tracked. Instructions that can't be reached are None.
+    Returns None if the depth is unbounded or can't be worked out.
+    """
+    length = len(instructions)
+    limit = initial or 0
+    for instr in instructions:
+        if instr.op == 'dup' and instr.args:
+            limit += max(int(instr.args[0]), 0)
+        elif instr.op in ('push', 'dup') or 'quiet' in instr.prefix:
+            limit += 1
+    states = [None] * (length + 1)
+    states[0] = (initial, initial or 0, ())
+    pending = [0]
+    while pending:
+        index = pending.pop()
+        if index == length:
+            continue
+        successors = _stack_step(instructions[index], index, length,
+                                 states[index])
+        if successors is None:
+            return None
+        for target, state in successors:
+            if state[1] > limit:
+                return None
+            old = states[target]
+            if old is not None:
+                state = _join_states(old, state)
+                if state == old:
+                    continue
+            states[target] = state
+            pending.append(target)
+    return states
+
+
+def _join_states(a, b):
+    lower = None if a[0] is None else min(a[0], b[0])
+    count = min(len(a[2]), len(b[2]))
+    values = []
+    for x, y in zip(a[2][len(a[2]) - count:], b[2][len(b[2]) - count:]):
+        if x is None or y is None or len(x | y) > _tracked_values:
+            values.append(None)
+        else:
+            values.append(x | y)
+    return lower, max(a[1], b[1]), tuple(values)
+
+
+def _apply_values(func, *operands):
+    """Every value of `func` over the possible operands, or None."""
+    if None in operands:
+        return None
+    results = set()
+    for args in _product(operands):
+        result = _fold(func, *args)
+        if result is None:
+            return None
+        results.add(result)
+        if len(results) > _tracked_values:
+            return None
+    return frozenset(results)
+
+
+def _product(sets):
+    if not sets:
+        yield ()
+        return
+    for rest in _product(sets[1:]):
+        for value in sets[0]:
+            yield (value,) + rest
+
+
+def _stack_step(instr, index, length, state):
+    """
+    The states `instr` can leave the stack in, as (next index, state)
+
+    Returns None if the effect of `instr` isn't known.
+    """
+    lower, upper, values = state
+    effect = _stack_effect(instr, index, length, values)
+    if effect is None:
+        return None
+    need, change, targets, values = effect
+    if lower is not None:
+        if upper < need:
+            # This instruction always underflows.
+            return []
+        lower = max(lower, need) + change
+    state = (lower, upper + change, values[-_tracked_depth:])
+    return [(target, state) for target in targets]
+
+
+def _stack_effect(instr, index, length, values):
+    """
+    What `instr` does to the stack, or None if it can't be known
+
+    Returns how many values it needs, how much it changes the depth by,
+    the indexes it can go to next and the possible values of the top of
+    the stack afterwards.
+    """
+    quiet = 'quiet' in instr.prefix
+    op = instr.op
+    args = instr.args
+
+    def top(count):
+        return values[-count] if len(values) >= count else None
+
+    targets = [index + 1]
+    need, change = 0, 0
+    if op == 'push':
+        values += (frozenset(args),)
+        change = 1
+    elif op == 'pop':
+        need, change = 1, -1
+        values = values[:-1]
+    elif op == 'nop':
+        pass
+    elif op in binary_ops:
+        need, change = 2, (1 if quiet else -1)
+        result = _apply_values(binary_ops[op], top(1), top(2))
+        if result is None and op in _boolean_ops:
+            result = frozenset([0.0, 1.0])
+        values = (values if quiet else values[:-2]) + (result,)
+    elif op in unary_ops:
+        need, change = 1, (1 if quiet else 0)
+        result = _apply_values(unary_ops[op], top(1))
+        if result is None and op in _boolean_ops:
+            result = frozenset([0.0, 1.0])
+        values = (values if quiet else values[:-1]) + (result,)
+    elif op == 'swap':
+        gap = int(args[0] if args else 1)
+        if gap < 0:
+            # A negative swap counts from the bottom of the stack.
+            need, values = -gap, ()
+        else:
+            need = gap + 1
+            values = list(values)
+            if gap < len(values):
+                values[-1], values[-1 - gap] = values[-1 - gap], values[-1]
+            elif values:
+                values[-1] = None
+            values = tuple(values)
+    elif op == 'dup':
+        dup_depth = int(args[0] if args else 1)
+        if dup_depth < 0:
+            return None
+        need = change = dup_depth
+        values += tuple(top(count) for count in range(dup_depth, 0, -1))
+    elif op == 'read':
+        change = 2
+        values += (None, frozenset([0.0, 1.0]))
+    elif op == 'emit':
+        need, change = 1, (0 if quiet else -1)
+        values = values if quiet else values[:-1]
+    elif op in jump_ops:
+        if args:
+            targets = [_static_target(instr, index, length)]
+        else:
+            need, change = 1, (0 if quiet else -1)
+            targets = _dynamic_targets(op, top(1), index, length)
+            values = values if quiet else values[:-1]
+        targets = [target for target in targets if target != _BAD_TARGET]
+    else:
+        return None
+    return need, change, targets, values
+
+
+def _dynamic_targets(op, distances, index, length):
+    """Where a dynamic jump can go given the values it might pop."""
+    if op == 'jump':
+        if distances is None:
+            return range(length + 1)
+        targets = {index + int(value) for value in distances
+                   if value - value == 0}
+        return [target for target in targets if 0 <= target <= length]
+    if distances is None:
+        return range(1, length)
+    targets = {int(value) for value in distances if float.is_integer(value)}
+    return [target for target in targets if 0 < target < length]
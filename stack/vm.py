@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+A Fillmore program that can be run a few instructions at a time
+
+A `VM` keeps the stack and program counter between calls, and can save
+its state to a snapshot and be restored from one, so a long run can be
+checkpointed and picked up again after a restart.
+"""
+import os
+import struct
+import sys
+from array import array
+
+from stack import compile_program
+from stack.bytecode import Bytecode, _write_atomic
+from stack.cache import program_cache
+
+
+class VM(object):
+    """
+    A program that can be run a few instructions at a time
+
+    The stack and `pc` that `run` keeps in locals are attributes here, so
+    a VM can be stopped with `step` and picked up again later.
+
+    >>> vm = VM.from_source('push 1; push 2; add')
+    >>> vm.step(2)
+    False
+    >>> vm.stack, vm.pc
+    ([1.0, 2.0], 2)
+    >>> vm.run()
+    [3.0]
+    """
+    def __init__(self, instructions, stack=None, pc=0):
+        self.instructions = instructions
+        # Not fused, so that `pc` and `step` are exact to the instruction
+        self.code = compile_program(instructions)
+        self.stack = [] if stack is None else stack
+        self.pc = pc
+        self._digest = None
+
+    @classmethod
+    def from_source(cls, program):
+        return cls(program_cache.get(program))
+
+    @property
+    def finished(self):
+        return self.pc >= len(self.code)
+
+    def step(self, count):
+        """Run at most `count` instructions and return `finished`."""
+        code, stack, pc = self.code, self.stack, self.pc
+        end = len(code)
+        try:
+            while count > 0 and pc < end:
+                pc = code[pc](stack, pc)
+                count -= 1
+        finally:
+            self.pc = pc
+        return pc >= end
+
+    def run(self):
+        """Run to the end of the program and return the stack."""
+        code, stack, pc = self.code, self.stack, self.pc
+        end = len(code)
+        try:
+            while pc < end:
+                pc = code[pc](stack, pc)
+        finally:
+            self.pc = pc
+        return stack
+
+    # Snapshots are little-endian: magic, version, reserved, the sha256 of
+    # the program's bytecode, `pc` and the stack depth, then the stack as
+    # float64s.
+    snapshot_magic = b'FMSS'
+    snapshot_version = 1
+    _snapshot_header = struct.Struct('<4sHH32sQQ')
+
+    def digest(self):
+        """The sha256 of the program, which snapshots are tied to."""
+        if self._digest is None:
+            self._digest = Bytecode.from_instructions(
+                self.instructions).digest()
+        return self._digest
+
+    def snapshot(self):
+        """
+        The state of the VM as bytes, for `from_snapshot`
+
+        >>> vm = VM.from_source('push 1; push 2; add')
+        >>> vm.step(2)
+        False
+        >>> len(vm.snapshot())
+        72
+        >>> VM.from_snapshot(vm.instructions, vm.snapshot()).run()
+        [3.0]
+        """
+        try:
+            stack = array('d', self.stack)
+        except TypeError:
+            raise ValueError("Only a stack of floats can be saved")
+        if sys.byteorder != 'little':
+            stack.byteswap()
+        header = self._snapshot_header.pack(
+            self.snapshot_magic, self.snapshot_version, 0, self.digest(),
+            self.pc, len(stack))
+        return header + stack.tobytes()
+
+    @classmethod
+    def from_snapshot(cls, instructions, data):
+        """
+        Make a VM for `instructions` in the state saved by `snapshot`
+
+        Raises ValueError if the snapshot is damaged or was taken of a
+        different program.
+        """
+        header = cls._snapshot_header
+        view = memoryview(data)
+        if len(view) < header.size:
+            raise ValueError("Not a Fillmore snapshot")
+        magic, version, _, digest, pc, depth = header.unpack_from(view)
+        if magic != cls.snapshot_magic:
+            raise ValueError("Not a Fillmore snapshot")
+        if version != cls.snapshot_version:
+            raise ValueError("Unsupported snapshot version {}".format(version))
+        if len(view) != header.size + 8 * depth:
+            raise ValueError("Snapshot is truncated or has extra data")
+        stack = array('d', view[header.size:].tobytes())
+        if sys.byteorder != 'little':
+            stack.byteswap()
+        vm = cls(instructions, stack.tolist(), pc)
+        if vm.digest() != digest:
+            raise ValueError("Snapshot is of a different program")
+        return vm
+
+    def save(self, path):
+        """Write a snapshot to `path`, replacing any earlier one whole."""
+        _write_atomic(path, self.snapshot())
+
+    @classmethod
+    def restore(cls, instructions, path):
+        """Make a VM from the snapshot `save` wrote to `path`."""
+        with open(path, 'rb') as f:
+            return cls.from_snapshot(instructions, f.read())
+
+    def run_checkpointed(self, path, every=1000000, signals=()):
+        """
+        Run to the end, saving a snapshot to `path` as it goes
+
+        A snapshot is saved every `every` instructions. If one of `signals`
+        arrives, a snapshot is saved as soon as the instruction running
+        finishes, and then the signal is sent again to be handled as it was
+        before, which for SIGTERM means exiting. Handling signals only works
+        in the main thread.
+        """
+        import signal
+        received = []
+
+        def handler(signum, frame):
+            received.append(signum)
+        previous = {signum: signal.signal(signum, handler)
+                    for signum in signals}
+        # Signals are only noticed between slices.
+        slice = 10000 if signals else every
+        since = 0
+        try:
+            while True:
+                count = min(slice, every - since)
+                if self.step(count):
+                    break
+                since += count
+                if since == every:
+                    self.save(path)
+                    since = 0
+                if received:
+                    self.save(path)
+                    break
+        finally:
+            for signum, old in previous.items():
+                signal.signal(signum, old)
+        if received:
+            os.kill(os.getpid(), received[0])
+        return self.stack
@@ -1,11 +1,50 @@
 # -*- coding: utf-8 -*-
 from __future__ import division
 
+import io
+import mmap
+import random
+import signal
+import struct
+
 import stack
-from stack import eval_program, parse_program, Instr
+import stack.bytecode
+import stack.cache
+import stack.integer
+import stack.jit
+import stack.loops
+import stack.native
+import stack.optimize
+import stack.verify
+import stack.vm
+from stack import parse_program, Instr
 
 import pytest
 
+COUNTDOWN = ('nop; push {}; @loop; push -1; add; quiet not; push 1; add; '
+             'jump; jump @loop')
+
+
+engines = {
+    'interpreter': stack.eval_program,
+    'unfused': lambda program: stack.run(
+        stack.compile_program(parse_program(program))),
+    'native': stack.native.eval_native,
+    'optimized': lambda program: stack.eval_program(program, optimize=True),
+    'verified': lambda program: stack.eval_program(program, verify=True),
+    # Falls back to the interpreter for programs that aren't all integers
+    'integer': lambda program: stack.eval_program(program, integer=True),
+    # Trace every loop the first time round
+    'traced': lambda program: stack.run(
+        stack.jit.compile_jit(parse_program(program), threshold=1)),
+    'summarized': lambda program: stack.eval_program(program, summarize=True),
+}
+
+
+@pytest.fixture(params=sorted(engines))
+def eval_program(request):
+    return engines[request.param]
+
 
 def test_parse():
     expected = [Instr('push', [1]), Instr('pop'), Instr('swap')]
@@ -62,14 +101,14 @@ def test_argument_errors():
             list(stack.parse_program(op + ' 1 1'))
 
 
-def test_push_and_pop():
+def test_push_and_pop(eval_program):
     assert eval_program('push 1; push 2; push 3;') == [1, 2, 3]
     assert eval_program('push 2; pop') == []
     with pytest.raises(IndexError):
         eval_program('pop')
 
 
-def test_simple_operators():
+def test_simple_operators(eval_program):
     assert eval_program('push 10; push 20; add;') == [30]
     assert eval_program('push 10; push 5; sub;') == [5]
     assert eval_program('push 10; push 20; sub;') == [-10]
@@ -90,13 +129,13 @@ def test_simple_operators():
         eval_program('push 1; push 0; div')
 
 
-def test_float_division():
+def test_float_division(eval_program):
     assert eval_program('push 5; push 2; div') == [2.5]
     assert eval_program('push 4; push 5; div') == [0.8]
     assert eval_program('push 1; push 100; div') == [0.01]
 
 
-def test_complex_operators():
+def test_complex_operators(eval_program):
     program = 'push 2; push 3; push 5; add; mul'
     assert eval_program(program) == [2 * (3 + 5)]
     program = 'push 36; push 24; push 6; div; div;'
@@ -105,7 +144,7 @@ def test_complex_operators():
     assert eval_program(program) == [(10 - 4) * (6 - 2)]
 
 
-def test_swap():
+def test_swap(eval_program):
     assert eval_program('push 1; swap 0') == [1]
     assert eval_program('push 1; push 2; swap') == [2, 1]
     assert eval_program('push 1; push 2; swap 1') == [2, 1]
@@ -123,7 +162,7 @@ def test_swap():
         eval_program('push 1; push 2; push 3; swap 3')
 
 
-def test_dup():
+def test_dup(eval_program):
     assert eval_program('push 1; dup 0') == [1]
     assert eval_program('push 1; dup') == [1, 1]
     assert eval_program('push 1; dup 1') == [1, 1]
@@ -136,7 +175,7 @@ def test_dup():
         eval_program('push 1; dup 2')
 
 
-def test_quiet():
+def test_quiet(eval_program):
     assert eval_program('push 3; push 5; quiet add') == [3, 5, 8]
     assert eval_program('push 3; push 5; quiet mul') == [3, 5, 15]
     assert eval_program('push 3; push 5; quiet sub') == [3, 5, -2]
@@ -144,7 +183,7 @@ def test_quiet():
     assert eval_program('push 3; push 5; quiet pow') == [3, 5, 3**5]
 
 
-def test_negation():
+def test_negation(eval_program):
     assert eval_program('push 1; not;') == [0]
     assert eval_program('push -1; not;') == [0]
     assert eval_program('push 0; not;') == [1]
@@ -156,7 +195,7 @@ def test_negation():
         eval_program('not')
 
 
-def test_equality():
+def test_equality(eval_program):
     assert eval_program('push 0; push 0; eq') == [1]
     assert eval_program('push 1.0; push 1.0; =') == [1]
     assert eval_program('push 2.0; push 2; =') == [1]
@@ -170,7 +209,7 @@ def test_equality():
         eval_program('push 1; eq')
 
 
-def test_inequality():
+def test_inequality(eval_program):
     assert eval_program('push 5; push 7; lt') == [1]
     assert eval_program('push 5; push 7; le') == [1]
     assert eval_program('push 3; push 3; le') == [1]
@@ -185,14 +224,14 @@ def test_inequality():
     with pytest.raises(IndexError):
         eval_program('push 1; ≤')
 
-def test_float_comparision():
+def test_float_comparision(eval_program):
     assert eval_program('push 3; push 3; eq;') == [1.0]
     assert eval_program('push 3; push 2; ge; push 2.5; mul;') == [2.5]
     assert eval_program('push 1; push 1; eq; dup; quiet +; ÷') == [1.0, 0.5]
 
 
 @pytest.mark.timeout(1)
-def test_jump():
+def test_jump(eval_program):
     # It should be possible to jump one past the end of the code, but no more
     assert eval_program('jump 1;') == []
     with pytest.raises(IndexError):
@@ -207,7 +246,7 @@ def test_jump():
         eval_program('jump -1; jump 0')
 
 @pytest.mark.timeout(1)
-def test_dynamic_jump():
+def test_dynamic_jump(eval_program):
     # A jump with no argument should jump based on the top of the stack
     assert eval_program('push 2; jump; push 1') == []
     assert eval_program('jump 3; push 9; jump 3; push -3; jump') == [9]
@@ -229,7 +268,7 @@ def test_jump_labels():
     # Multiple jump labels should work.
 
 @pytest.mark.timeout(1)
-def test_fibonacci():
+def test_fibonacci(eval_program):
     # Has the nth fibonacci term at the top of the stack
     # TODO: test against different fibonacci inputs.
     # (0 = 0th term)
@@ -262,7 +301,7 @@ def test_fibonacci():
     assert eval_program(program) == [8]
 
 @pytest.mark.timeout(1)
-def test_absolute_jump():
+def test_absolute_jump(eval_program):
     # An absolute jump will jump to the instruction number
     # reguardless of where the jump is placed. Instructions start at 0.
     assert eval_program('to 2; push 2; push 3; push 4') == [3, 4]
@@ -272,7 +311,7 @@ def test_absolute_jump():
     assert eval_program('push 2; quiet to; push 5; push 6') == [2, 5, 6]
 
 @pytest.mark.timeout(1)
-def test_illegal_jump():
+def test_illegal_jump(eval_program):
     # Attempting to jump before the start
     # or after the end of a program is an error.
     with pytest.raises(IndexError):
@@ -299,6 +338,14 @@ def test_bad_labels():
     code = '@label; push 2; jump @label; jump @label'
     list(parse_program(code))
 
+
+def test_get_label_indexes():
+    lines = ['@start', 'push 2', '', '@middle', '@end', 'jump @start']
+    assert stack.get_label_indexes(lines) == {
+        '@start': 0, '@middle': 1, '@end': 1}
+    with pytest.raises(ValueError):
+        stack.get_label_indexes(['@label', 'push 2', '@label'])
+
 def test_label_with_instruction():
     # Labels before an instruction are an error.
     with pytest.raises(ValueError):
@@ -315,7 +362,607 @@ def test_label_with_instruction():
     list(parse_program('@label; to @label'))
 
 
-def test_nop():
+def test_nop(eval_program):
     assert eval_program('nop') == []
     assert eval_program('∅') == []
 
+
+def test_compile_program():
+    code = stack.compile_program(parse_program('push 1; push 2; add'))
+    assert len(code) == 3
+    assert stack.run(code) == [3]
+    # Bad jump targets are only an error once they are executed
+    code = stack.compile_program(parse_program('jump 2; jump 5; push 1'))
+    assert stack.run(code) == [1]
+    # Handlers can be run again against a fresh stack
+    assert stack.run(code, [4.0]) == [4, 1]
+
+
+def test_translate_program():
+    # Programs without jumps become straight-line code
+    source = stack.native.translate_program(parse_program('push 1; push 2; add'))
+    assert 'while' not in source
+    # So do programs whose static jumps only ever go one way
+    program = 'push 1; jump 3; push 9; @back; to @end; jump @back; @end; dup'
+    native = stack.native.compile_native(parse_program(program))
+    assert 'while' not in native.source
+    assert native() == [1, 1]
+    with pytest.raises(IndexError):
+        stack.native.eval_native('push 1; jump 5; push 2')
+    # A dynamic jump into the middle of a block falls back to the handlers
+    program = 'push 3; jump; push 1; push 2; push 3; push 4'
+    assert stack.native.eval_native(program) == [3, 4]
+    # Deep swaps and dups use the real stack
+    program = ';'.join(['push {}'.format(n) for n in range(12)])
+    assert (stack.native.eval_native(program + '; swap 11; dup 10') ==
+            stack.eval_program(program + '; swap 11; dup 10'))
+    assert stack.native.compile_native(parse_program('push 2; add'))([1.0]) == [3]
+    # The buffer grows past its padding when the depth has no bound
+    program = ('push 100; @loop; dup; push -1; add; quiet not; push 1; add; '
+               'jump; jump @loop')
+    assert stack.verify.stack_growth(parse_program(program)) is None
+    assert stack.native.eval_native(program) == list(range(100, -1, -1))
+    native = stack.native.compile_native(parse_program('push 1; dup; dup; dup'))
+    assert native([0.0] * 100) == [0.0] * 100 + [1.0] * 4
+
+
+def test_stack_growth():
+    growth = stack.verify.stack_growth
+    assert growth(parse_program('')) == 0
+    assert growth(parse_program('pop; pop; push 1')) == 0
+    assert growth(parse_program('push 1; quiet add; dup 3; pop')) == 5
+    # Conditional jumps only go one of two ways
+    program = 'push 1; push 0; quiet not; push 1; add; jump; push 2; push 3'
+    assert growth(parse_program(program)) == 4
+    # Loops that keep pushing have no bound
+    assert growth(parse_program('nop; push 1; to 1')) is None
+    assert growth(parse_program('push 1; dup -1')) is None
+
+
+def test_verify_program():
+    verify = stack.verify.verify_program
+    assert verify(parse_program('push 1; dup; push 2; dup 3; swap 3; add'))
+    # Both ways out of a loop are checked
+    program = ('push 20; push -1; add; quiet not; push 1; add; jump; '
+               'jump -6; pop; pop')
+    assert stack.verify.stack_depths(parse_program(program))[-3:] == [
+        (1, 1), (1, 1), (0, 0)]
+    assert not verify(parse_program(program))
+    # Underflows that happen on every run are errors
+    for program in ['pop', 'push 1; swap', 'push 1; jump 2; nop; dup 2',
+                    'push 2; jump; push 3; add']:
+        with pytest.raises(stack.StackUnderflowError):
+            verify(parse_program(program))
+    # Anything that could fail first isn't
+    assert not verify(parse_program('push 1; push 0; div; pop; pop'))
+    # Jumps to unknown addresses could go anywhere
+    assert not verify(parse_program('push 1; push 1; add; to; push 2; pop'))
+    assert verify(parse_program('push 3; push 1; add; jump; push 2; pop'))
+
+    # Verified programs are translated without underflow checks
+    program = 'push 1; dup; dup 2; dup 4; dup 8; dup 9; swap 12; pop'
+    native = stack.native.compile_native(parse_program(program))
+    assert 'raise' not in native.source
+    assert native() == [1] * 24
+    assert native([2.0]) == [2.0] + [1] * 24
+
+
+def test_bytecode(tmpdir):
+    program = '@top; push 1.5; quiet ÷; dup 2; jump; to @top; nop'
+    instructions = list(parse_program(program))
+    bytecode = stack.bytecode.Bytecode.from_instructions(instructions)
+    assert list(bytecode) == instructions
+    assert bytecode.nbytes == 10 * len(instructions)
+
+    path = str(tmpdir.join('program.fmc'))
+    bytecode.save(path)
+    with stack.bytecode.Bytecode.load(path) as loaded:
+        assert loaded == bytecode
+        assert list(loaded) == instructions
+    assert stack.bytecode.Bytecode.frombuffer(bytecode.tobytes()) == bytecode
+
+    with pytest.raises(ValueError):
+        stack.bytecode.Bytecode.frombuffer(b'not bytecode at all')
+    with pytest.raises(ValueError):
+        stack.bytecode.Bytecode.frombuffer(bytecode.tobytes()[:-1])
+
+
+def test_run_bytecode():
+    bytecode = stack.bytecode.Bytecode.from_instructions(
+        parse_program('push 3; push 4; mul'))
+    assert stack.run(stack.compile_program(bytecode)) == [12]
+    assert stack.native.compile_native(bytecode)() == [12]
+
+
+def test_program_cache(tmpdir):
+    cache = stack.cache.ProgramCache(maxsize=2)
+    first = cache.get('push 1; push 2')
+    assert cache.get('push 1; push 2') is first
+    cache.get('push 3')
+    cache.get('push 4')
+    assert cache.stats() == {
+        'size': 2, 'maxsize': 2, 'hits': 1, 'misses': 3, 'evictions': 1,
+        'disk_hits': 0, 'disk_writes': 0, 'disk_errors': 0}
+    # Errors are raised on every lookup
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            cache.get('horp')
+
+    directory = str(tmpdir)
+    cache = stack.cache.ProgramCache(directory=directory)
+    expected = cache.get('@top; push 1; jump @top')
+    assert cache.stats()['disk_writes'] == 1
+    # A new cache (or process) finds the program on disk
+    cache = stack.cache.ProgramCache(directory=directory)
+    assert cache.get('@top; push 1; jump @top') == expected
+    assert cache.stats()['disk_hits'] == 1
+    # Corrupt files are treated as a miss and replaced
+    key = cache.key('push 5')
+    tmpdir.join(key + '.fmc').write('garbage')
+    assert list(cache.get('push 5')) == [Instr('push', [5])]
+    assert cache.stats()['disk_writes'] == 1
+    # A directory that can't be written to only loses the disk tier
+    cache = stack.cache.ProgramCache(directory=str(tmpdir.join('missing')))
+    assert list(cache.get('push 6')) == [Instr('push', [6])]
+    assert cache.get('push 6') is cache.get('push 6')
+    assert cache.stats()['disk_errors'] == 1
+
+
+def test_forward_labels():
+    expected = [Instr('to', [2]), Instr('push', [1]), Instr('push', [2])]
+    assert list(parse_program('jump @end; push 1; @end; push 2')) == expected
+    assert list(parse_program('to @end; push 1; @end; push 2')) == expected
+    assert stack.parse_line('   ') is None
+    with pytest.raises(ValueError):
+        list(parse_program('quiet @label; @label'))
+
+
+def test_parse_file(tmpdir):
+    program = '@top\npush 1; jump @end\n← 2\n@end\n♯ +; to @top\n'
+    expected = list(parse_program(program))
+    path = tmpdir.join('program.fm')
+    path.write_text(program, encoding='utf-8')
+
+    assert list(stack.parse_file(str(path))) == expected
+    with path.open('rb') as f:
+        assert list(stack.parse_file(f)) == expected
+    with path.open('r', encoding='utf-8') as f:
+        assert list(stack.parse_file(f)) == expected
+    with path.open('rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        assert list(stack.parse_file(mapped)) == expected
+        mapped.close()
+    assert list(stack.bytecode.Bytecode.from_file(str(path))) == expected
+
+    # Forward references are patched after they have been yielded
+    instructions = stack.parse_file(io.StringIO(u'jump @end; @end'))
+    jump = next(instructions)
+    assert jump == Instr('to', [0])
+    assert list(instructions) == []
+    assert jump == Instr('to', [1])
+    with pytest.raises(ValueError):
+        list(stack.parse_file(io.StringIO(u'jump @nowhere')))
+
+
+def test_optimize_program():
+    def optimize(program):
+        return stack.optimize.optimize_program(parse_program(program))
+
+    program, stats = optimize('push 1; push 2; add; push 3; mul; not')
+    assert program == [Instr('push', [0])]
+    assert stats['constant_fold'] == 5
+    program, stats = optimize('nop; push 1; push 2; pop; jump 1; push 3')
+    assert program == [Instr('push', [1]), Instr('push', [3])]
+    assert (stats['nop'], stats['push_pop'], stats['jump_next']) == (1, 2, 1)
+    # Errors are left for run time
+    assert optimize('push 1; push 0; div')[0] == list(
+        parse_program('push 1; push 0; div'))
+    # Jumps are remapped and chains of jumps are threaded
+    program, stats = optimize('@top; nop; jump @a; push 1; @a; to @b; '
+                              '∅; @b; push 5; pop; push 2; jump @top')
+    # (`to 0` is always out of bounds, so `jump @top` stays that way)
+    assert program == [Instr('to', [2]), Instr('push', [1]),
+                       Instr('push', [2]), Instr('to', [0])]
+    assert stats['jump_thread'] == 1
+    # Instructions that are jumped to are kept
+    program = 'jump 2; push 1; pop; push 4'
+    assert optimize(program)[0] == list(parse_program(program))
+    # Out of bounds jumps stay out of bounds
+    program, _ = optimize('nop; jump 10; to 7; push 1')
+    assert len(program) == 3
+    for start in range(2):
+        with pytest.raises(IndexError):
+            stack.run(stack.compile_program(program[start:]))
+    # Dynamic jumps keep the instructions they can land on where they are,
+    # and everything else is optimized.
+    program = ('nop; push 3; @loop; push -2; push 1; add; add; quiet not; '
+               'push 1; add; jump; jump @loop; nop; push 2; push 3')
+    optimized, stats = optimize(program)
+    assert optimized == list(parse_program(
+        'push 3; @loop; push -1; add; quiet not; push 1; add; jump; '
+        'jump @loop; nop; push 2; push 3'))
+    assert (stats['nop'], stats['constant_fold']) == (1, 2)
+    assert stack.run(stack.compile_program(optimized)) == [0, 2, 3]
+    # Unless they could pop anything
+    program = 'jump; nop'
+    assert optimize(program)[0] == list(parse_program(program))
+
+
+def test_vm_keeps_pc_on_error():
+    vm = stack.vm.VM.from_source('push 1; push 0; div')
+    assert not vm.step(1)
+    with pytest.raises(ZeroDivisionError):
+        vm.run()
+    assert vm.pc == 2
+
+
+def test_budget():
+    assert stack.eval_program('push 1; push 2', budget=2) == [1, 2]
+    with pytest.raises(stack.BudgetExceeded):
+        stack.eval_program('push 1; push 2', budget=1)
+    # `push 2; add` is fused, but the budget runs out between the two.
+    with pytest.raises(stack.BudgetExceeded):
+        stack.eval_program('push 1; push 2; add', budget=2)
+    assert stack.eval_program('push 1; push 2; add', budget=3) == [3]
+    program = COUNTDOWN.format(3)
+    # 2 to start, then 7 for each trip round the loop but the last
+    assert stack.eval_program(program, budget=22) == [0]
+    with pytest.raises(stack.BudgetExceeded):
+        stack.eval_program(program, budget=21)
+
+
+def test_profile():
+    profile = stack.Profile()
+    program = 'push 3\n@loop\npush -1; add\nquiet not; push 1; add; jump\nto @loop'
+    assert stack.eval_program(program, profile=profile) == [0]
+    assert profile.counts == [1, 3, 3, 3, 3, 3, 3, 2]
+    assert profile.back_edges == {(7, 1): 2}
+    assert profile.max_depth == 3
+    assert profile.by_op()['add'][0] == 6
+    report = profile.report()
+    assert '@loop line 3: push -1' in report
+    assert 'Maximum stack depth: 3' in report
+
+
+def test_trace():
+    # A countdown from 10 whose exit jumps to a computed, bad address
+    program = ('nop; push 10; @loop; push -1; add; quiet not; push 1; add; '
+               'jump; jump @loop; push 1; push 99; add; to')
+    out = io.StringIO()
+    trace = stack.Trace(size=4, file=out)
+    pcs = trace.pcs
+    with pytest.raises(IndexError):
+        stack.eval_program(program, trace=trace)
+    # The ring is reused, not grown.
+    assert trace.pcs is pcs and len(pcs) == 4
+    assert trace.error[0] == 12
+    assert trace.entries() == [
+        (4, 'not', 2.0), (4, 'not', 1.0), (4, 'not', 0.0), (12, 'to', 100.0)]
+    assert trace.error[2] == 1
+    dump = out.getvalue()
+    assert dump.startswith('IndexError: Jump address 100 out of bounds')
+    assert 'line 1: to, with 1 on the stack' in dump
+
+    # Programs that finish keep their trace, without a dump.
+    trace = stack.Trace(file=out)
+    assert stack.eval_program(COUNTDOWN.format(3), trace=trace) == [0]
+    assert trace.error is None
+    assert [top for _, _, top in trace.entries()] == [2, 1, 0]
+
+    # Unfused handlers can be traced too.
+    instructions = list(parse_program('push 1; push 2; quiet lt; jump; '
+                                      'pop; pop; pop'))
+    trace = stack.Trace()
+    trace.begin(instructions)
+    code = trace.instrument(stack.compile_program(instructions), fuse=False)
+    with pytest.raises(IndexError):
+        stack.run(code, trace=trace)
+    assert trace.entries() == [(3, 'jump', 1.0), (6, 'pop', None)]
+
+    # A compiled loop that runs out of stack records what the
+    # interpreter would, down to the instruction that failed.
+    instructions = list(parse_program('push 1; push 1; push 1; @loop; '
+                                      'pop; push 1; quiet not; jump; '
+                                      'pop; jump @loop'))
+    results = []
+    for code in [stack.compile_program(instructions, fuse=True), None]:
+        trace = stack.Trace()
+        trace.begin(instructions)
+        if code is None:
+            code = stack.jit.compile_jit(instructions, threshold=1, trace=trace)
+        else:
+            code = trace.instrument(code)
+        with pytest.raises(IndexError):
+            stack.run(code, trace=trace)
+        results.append((trace.error[0], trace.entries()))
+    assert results[0] == results[1]
+    assert results[0][0] == 7
+
+
+def test_main(tmpdir, capsys, monkeypatch):
+    source = tmpdir.join('program.fm')
+    source.write('push 3; dup; mul')
+    bytecode = str(tmpdir.join('program.fmc'))
+    stack.bytecode.Bytecode.from_instructions(parse_program('push 4')).save(bytecode)
+    assert stack.main([str(source), bytecode]) == 0
+    assert capsys.readouterr().out == '[9.0]\n[4.0]\n'
+
+    cache = tmpdir.mkdir('cache')
+    monkeypatch.setattr('sys.stdin', io.StringIO(u'push 1; pop; pop'))
+    assert stack.main(['--cache', str(cache)]) == 1
+    assert 'IndexError' in capsys.readouterr().err
+    assert len(cache.listdir()) == 1
+
+
+def test_snapshot(tmpdir):
+    program = stack.cache.program_cache.get(COUNTDOWN.format(1000))
+    vm = stack.vm.VM(program)
+    vm.step(500)
+    data = vm.snapshot()
+    resumed = stack.vm.VM.from_snapshot(program, data)
+    assert (resumed.pc, resumed.stack) == (vm.pc, vm.stack)
+    assert resumed.run() == vm.run() == [0]
+
+    with pytest.raises(ValueError):
+        stack.vm.VM.from_snapshot(stack.cache.program_cache.get('push 1'), data)
+    with pytest.raises(ValueError):
+        stack.vm.VM.from_snapshot(program, data[:-1])
+    with pytest.raises(ValueError):
+        stack.vm.VM(program, [1j]).snapshot()
+
+    # Snapshots are saved as the program runs
+    path = str(tmpdir.join('countdown.fms'))
+    vm = stack.vm.VM(program)
+    vm.step(3000)
+    vm.run_checkpointed(path, every=1000)
+    saved = stack.vm.VM.restore(program, path)
+    assert saved.pc < len(program) and saved.stack != vm.stack
+    assert saved.run() == [0]
+
+
+@pytest.mark.skipif(not hasattr(signal, 'setitimer'), reason='no timers')
+def test_snapshot_on_signal(tmpdir):
+    path = str(tmpdir.join('countdown.fms'))
+    program = stack.cache.program_cache.get(COUNTDOWN.format(10 ** 6))
+    signals = []
+    previous = signal.signal(signal.SIGALRM,
+                             lambda signum, frame: signals.append(signum))
+    try:
+        signal.setitimer(signal.ITIMER_REAL, 0.01)
+        vm = stack.vm.VM(program)
+        vm.run_checkpointed(path, every=10 ** 9, signals=[signal.SIGALRM])
+    finally:
+        signal.signal(signal.SIGALRM, previous)
+    # The old handler still got the signal, after the snapshot was saved
+    assert signals == [signal.SIGALRM]
+    saved = stack.vm.VM.restore(program, path)
+    assert (saved.pc, saved.stack) == (vm.pc, vm.stack)
+    assert not saved.finished
+
+
+def test_main_checkpoint(tmpdir, capsys):
+    source = tmpdir.join('program.fm')
+    source.write(COUNTDOWN.format(10))
+    checkpoint = str(tmpdir.join('program.fms'))
+    vm = stack.vm.VM(list(parse_program(COUNTDOWN.format(10))))
+    vm.step(20)
+    vm.save(checkpoint)
+    assert stack.main(['--checkpoint', checkpoint, str(source)]) == 0
+    assert capsys.readouterr().out == '[0.0]\n'
+    assert not tmpdir.join('program.fms').exists()
+
+
+def test_jit():
+    program = list(parse_program(COUNTDOWN.format(100)))
+    code = stack.jit.compile_jit(program, threshold=10)
+    assert stack.run(code) == [0]
+    # The loop header now runs the whole loop
+    assert hasattr(code[2], 'source')
+    assert stack.run(code, [7.0]) == [7.0, 0.0]
+
+    # Guards exit the trace when a jump goes a new way
+    program = ('push 0; @loop; push 1; add; dup; push 3; lt; push 1; add; '
+               'jump; nop; dup; push 6; lt; not; push 1; add; jump; '
+               'jump @loop')
+    for threshold in range(1, 6):
+        code = stack.jit.compile_jit(parse_program(program), threshold=threshold)
+        assert stack.run(code) == [6]
+    with pytest.raises(TypeError):
+        # Goes back to 1 until the top reaches 1.5, then to 1.5
+        stack.run(stack.jit.compile_jit(parse_program(
+            'push 0; push 0.5; add; dup; push 1.5; ge; push 0.5; mul; '
+            'push 1; add; to'), threshold=1))
+
+
+DOUBLE = ('nop; @loop; ⇐; push 1; add; jump; jump @end; push 2; mul; ⇒; '
+          'jump @loop; @end; pop')
+
+
+def test_integer_program():
+    assert stack.integer.integer_program(parse_program(COUNTDOWN.format(10)))
+    for program in ['push 1; push 2; div', 'read', 'push 0.5',
+                    'push -0', 'push 1e300']:
+        assert not stack.integer.integer_program(parse_program(program))
+    with pytest.raises(ValueError):
+        stack.integer.compile_integer(parse_program('push 0.5'))
+
+
+def test_integer_matches_floats():
+    def results(program):
+        """Final stacks, or errors, as exact bits"""
+        outcomes = []
+        for evaluate in [stack.eval_program,
+                         lambda source: stack.integer.compile_integer(
+                             parse_program(source))()]:
+            try:
+                outcomes.append([struct.pack('<d', value)
+                                 for value in evaluate(program)])
+            except Exception as e:
+                outcomes.append(type(e))
+        return outcomes
+
+    limit = 2 ** 53
+    programs = [
+        # Past the last exact integer, one step at a time and at once
+        'push {}; push 1; add; push 1; add'.format(limit),
+        'push {}; push -1; add; push -1; add'.format(-limit),
+        'push {}; dup; mul; push 1; add'.format(2 ** 30),
+        'push 3; push 40; pow; push 1; sub',
+        'push 10; push 400; pow',
+        # Zeros that floats make negative
+        'push 0; push -3; mul',
+        'push -3; push 0; mul; push 2; mul',
+        'push 0; push -1; quiet mul',
+        # Powers that aren't integers, or are errors
+        'push 2; push -1; pow',
+        'push 0; push -1; pow',
+        # Jumps out of range, by integers or by values that were floats
+        'push 5; jump', 'push 0; quiet to', 'push 1; push 2; lt; to',
+        'push 2; push 60; pow; jump',
+        'push 10; push 400; pow; push 10; push 400; pow; mul; jump',
+        # Stops being integers halfway round a loop
+        'nop; push 1; push 40; @loop; swap; push 3; mul; swap; push -1; add; '
+        'quiet not; push 1; add; jump; jump @loop',
+    ]
+    for program in programs:
+        floats, integers = results(program)
+        assert integers == floats, program
+
+    rng = random.Random(0)
+    ops = ['add', 'sub', 'mul', 'pow', 'eq', 'lt', 'ge', 'not', 'dup',
+           'swap', 'quiet mul', 'quiet add']
+    for _ in range(300):
+        program = ['push {}'.format(rng.choice([-3, -1, 0, 1, 2, 7, 40]))
+                   for _ in range(8)]
+        for _ in range(12):
+            program.append(rng.choice(ops + ['push {}'.format(
+                rng.choice([-(2 ** 52), -2, 0, 3, 2 ** 40]))]))
+        program = '; '.join(program)
+        floats, integers = results(program)
+        assert integers == floats, program
+
+    assert stack.integer.compile_integer(parse_program('dup; mul'))([3.0]) == [9.0]
+    # Stacks that don't start as integers run on floats
+    assert stack.integer.compile_integer(parse_program('add'))([0.5, 1]) == [1.5]
+
+
+def test_loop_summaries():
+    summaries = stack.loops.loop_summaries(parse_program(COUNTDOWN.format(10)))
+    assert list(summaries) == [2]
+    assert (summaries[2].counter, summaries[2].step) == (0, -1)
+    code = stack.compile_program(parse_program(COUNTDOWN.format(10 ** 15)),
+                                 fuse=True, summarize=True)
+    assert stack.run(code, budget=100) == [0]
+
+    for program in ['jump 0', 'nop; jump -1', 'push 7; dup; pop; to 1',
+                    # Goes round while the top isn't 0, and it never changes
+                    'push 2; @loop; quiet not; push 1; add; jump; jump @loop']:
+        with pytest.raises(stack.InfiniteLoopError):
+            stack.eval_program(program, summarize=True)
+    for program in [
+            # Steps that aren't integers, or move more than one value
+            'push 0; @loop; push 0.5; add; quiet not; push 1; add; jump; '
+            'jump @loop',
+            'push 0; push 0; @loop; push 1; add; swap; push 1; add; swap; '
+            'quiet not; push 1; add; jump; jump @loop',
+            # Grows the stack, or streams
+            'push 1; @loop; dup; quiet not; push 1; add; jump; jump @loop',
+            'nop; @loop; read; not; push 1; add; jump; jump @loop']:
+        assert not stack.loops.loop_summaries(parse_program(program)), program
+
+    def results(program, **options):
+        try:
+            return stack.eval_program(program, budget=10000, **options)
+        except Exception as e:
+            return type(e)
+
+    rng = random.Random(0)
+    extra = ['nop', 'dup; pop', 'swap; swap', 'push 2; pop', 'push 3; add',
+             'push -3; add', 'dup; push 4; lt; pop', 'push 1; push 2; mul; pop']
+    for _ in range(300):
+        step = rng.choice([-3, -1, 1, 2, 5, 0.5, 0])
+        body = ['push {}; add'.format(step)] + rng.sample(extra, 3)
+        rng.shuffle(body)
+        test = rng.choice(['lt', 'le', 'gt', 'ge', 'eq'])
+        if rng.random() < 0.5:
+            test += '; not'
+        program = '; '.join(
+            ['push {}'.format(rng.choice([-2, 0, 7])),
+             'push {}'.format(rng.choice([-40, -1, 0, 3, 40, 2 ** 53])),
+             '@loop'] + body +
+            ['dup', 'push {}'.format(rng.choice([-30, 0, 4, 39, 2 ** 53])),
+             test, 'push 1; add; jump; jump @loop'])
+        summarized = results(program, summarize=True, jit=False)
+        expected = results(program, jit=False)
+        if expected is stack.BudgetExceeded and \
+                summarized is not stack.BudgetExceeded:
+            # Skipping or spotting an infinite loop gets past the budget.
+            assert summarized is stack.InfiniteLoopError or \
+                stack.loops.loop_summaries(parse_program(program)), program
+            continue
+        assert summarized == expected, program
+
+
+def test_streams():
+    values = [float(n) for n in range(10)]
+    doubled = [2 * value for value in values]
+    for data in [values, iter(values), stack.array('d', values),
+                 io.BytesIO(stack.array('d', values).tobytes())]:
+        out = []
+        source = stack.Source(data, chunk_size=3)
+        assert stack.eval_program(DOUBLE, source=source, sink=out) == []
+        assert out == doubled
+
+    # Every engine can read and write
+    instructions = list(parse_program(DOUBLE))
+    for compile_code in [stack.compile_program, stack.jit.compile_jit]:
+        sink = stack.Sink(stack.array('d'), chunk_size=4)
+        code = compile_code(instructions, source=stack.Source(values),
+                            sink=sink)
+        assert stack.run(code) == []
+        sink.flush()
+        assert list(sink.data) == doubled
+    sink = stack.Sink([])
+    native = stack.native.compile_native(instructions, source=stack.Source(values),
+                                  sink=sink)
+    assert native() == []
+    sink.flush()
+    assert sink.data == doubled
+
+    out = io.BytesIO()
+    stack.eval_program('read; pop; quiet emit', source=[1.5], sink=out)
+    assert out.getvalue() == stack.array('d', [1.5]).tobytes()
+    full = bytearray(8)
+    with pytest.raises(ValueError):
+        stack.eval_program('push 1; emit; push 2; emit', sink=full)
+    with pytest.raises(ValueError):
+        stack.eval_program('read')
+    with pytest.raises(ValueError):
+        stack.eval_program('read; read', source=io.BytesIO(b'\0' * 9))
+
+
+def test_numpy_streams():
+    numpy = pytest.importorskip('numpy')
+    out = numpy.zeros(5)
+    stack.eval_program(DOUBLE, source=numpy.arange(5.0), sink=out)
+    assert list(out) == [0, 2, 4, 6, 8]
+
+
+def test_fusion():
+    fusions = {}
+    program = parse_program('push 5; @loop; push -1; add; quiet not; push 1; '
+                            'add; jump; jump @loop; dup; mul; push 1; quiet lt; '
+                            'jump')
+    code = stack.compile_program(program, fuse=True, fusions=fusions)
+    assert fusions == {'binary_immediate': 1, 'test_branch': 1,
+                       'compare_branch': 1, 'binary_self': 1,
+                       'quiet_branch': 1}
+    # The loop runs to 0, then 0 * 0 < 1, so the last jump goes to the end
+    assert stack.run(code) == [0, 1]
+    # Jumping into the middle of a fused sequence still works
+    code = stack.compile_program(parse_program('push 2; jump 2; push 2; add'),
+                                 fuse=True)
+    assert stack.run(code, [1.0]) == [3]
+    with pytest.raises(IndexError):
+        stack.run(stack.compile_program(parse_program('push 9; add; jump'),
+                                        fuse=True), [1.0])
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+import stack.cache
+from stack.asynchronous import AsyncVM, eval_async, eval_many
+
+COUNTDOWN = 'nop; push {}; @loop; push -1; add; quiet not; push 1; add; jump; jump @loop'
+
+
+def test_async_vm():
+    vm = AsyncVM(stack.cache.program_cache.get('push 1; push 2; add'))
+    assert asyncio.run(vm.run_async(slice=1)) == [3]
+    assert vm.finished
+    assert asyncio.run(eval_async('push 2; dup; mul')) == [4]
+    # The synchronous run is still there
+    vm = AsyncVM(stack.cache.program_cache.get('push 3; dup; add'))
+    assert vm.run() == [6]
+
+
+def test_short_programs_are_not_blocked():
+    finished = []
+
+    async def evaluate(name, program):
+        await eval_async(program, slice=100)
+        finished.append(name)
+
+    async def main():
+        await asyncio.gather(evaluate('long', COUNTDOWN.format(10000)),
+                             evaluate('short', COUNTDOWN.format(10)))
+
+    asyncio.run(main())
+    assert finished == ['short', 'long']
+
+
+def test_eval_many():
+    programs = [COUNTDOWN.format(n) for n in range(1, 20)] + ['pop']
+    results = asyncio.run(eval_many(programs, slice=10, limit=5))
+    assert results[:-1] == [[0]] * 19
+    assert isinstance(results[-1], IndexError)
+
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import stack
+from stack.batch import eval_batch
+
+
+def check_lanes(program, stacks):
+    result = eval_batch(program, stacks)
+    assert len(result) == len(stacks)
+    for lane, initial in enumerate(stacks):
+        code = stack.compile_program(stack.parse_program(program))
+        try:
+            expected = stack.run(code, [float(x) for x in initial])
+        except Exception as e:
+            with pytest.raises(type(e)):
+                result.stack(lane)
+        else:
+            assert result.stack(lane) == expected
+    return result
+
+
+def test_arithmetic():
+    stacks = [[1, 2], [3, 4], [-5, 0.5], [0, 0]]
+    for op in ['add', 'sub', 'mul', 'div', 'pow', 'eq', 'lt', 'gt', 'le',
+               'ge', 'quiet add', 'not', 'quiet not', 'swap', 'dup 2',
+               'pop; pop; pop']:
+        check_lanes(op, stacks)
+
+
+def test_fallback_lanes():
+    # Division by zero and complex powers only affect their own lanes
+    result = check_lanes('div', [[1, 0], [1, 2]])
+    assert set(result.errors) == {0}
+    result = check_lanes('pow', [[-8, 1 / 3], [2, 10], [10, 400], [0, -1]])
+    assert isinstance(result.stack(0)[0], complex)
+    assert set(result.errors) == {2, 3}
+
+
+def test_divergent_jumps():
+    countdown = '''
+    nop
+    @loop
+    push -1
+    add
+    quiet not
+    push 1
+    add
+    jump
+    jump @loop
+    '''
+    stacks = [[n] for n in [1, 5, 3, 5, 1, 10]]
+    result = check_lanes(countdown, stacks)
+    assert result.depth.tolist() == [1] * len(stacks)
+    # Dynamic targets out of range or fractional raise per lane
+    check_lanes('jump; push 7', [[1], [2], [3], [-1], [float('nan')]])
+    check_lanes('to; push 1; push 2', [[1], [2], [2.5], [0], [9]])
+
+
+def test_bad_input():
+    with pytest.raises(ValueError):
+        eval_batch('add', [1, 2, 3])
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from stack import parse_program
+from stack.incremental import IncrementalParser
+
+SOURCE = '''push 3
+@loop
+push -1; add
+quiet not; push 1; add; jump
+jump @loop
+to @end
+@end'''
+
+
+def test_matches_parse_program():
+    parser = IncrementalParser(SOURCE)
+    assert parser.instructions() == list(parse_program(SOURCE))
+    assert parser.label_index('@loop') == 1
+    assert parser.line_count == 7
+
+    # Inserting lines moves the labels after them
+    parser.edit(1, 1, 'push 4\npush 5; pop')
+    lines = SOURCE.split('\n')
+    lines[1:1] = ['push 4', 'push 5; pop']
+    assert parser.instructions() == list(parse_program('\n'.join(lines)))
+    assert parser.label_index('@loop') == 4
+    assert parser.label_index('@end') == 12
+
+    # Deleting them moves the labels back
+    parser.edit(1, 3, [])
+    assert parser.instructions() == list(parse_program(SOURCE))
+
+
+def test_errors():
+    parser = IncrementalParser(SOURCE)
+    with pytest.raises(ValueError, match='Syntax Error'):
+        parser.edit(0, 1, 'psh 3')
+    # An edit elsewhere doesn't raise the error again
+    parser.edit(2, 3, 'push -2; add')
+    assert [number for number, _ in parser.errors()] == [0]
+    with pytest.raises(ValueError):
+        parser.instructions()
+    parser.edit(0, 1, 'push 3')
+    assert parser.errors() == []
+
+    # Removing a label breaks the jumps to it until it comes back
+    with pytest.raises(ValueError, match='was not defined'):
+        parser.edit(1, 2, [])
+    assert [number for number, _ in parser.errors()] == [3]
+    parser.edit(1, 1, '@loop')
+    assert parser.errors() == []
+
+    with pytest.raises(ValueError, match='Found the label @end'):
+        parser.edit(0, 0, '@end')
+    assert [number for number, _ in parser.errors()] == [7]
+    parser.edit(0, 1, [])
+    expected = list(parse_program(SOURCE.replace('-1', '-2')))
+    assert parser.instructions() == expected
+
+    with pytest.raises(IndexError):
+        parser.edit(3, 100, [])
+
+
+def test_large_program():
+    IncrementalParser.block_size, block_size = 4, IncrementalParser.block_size
+    try:
+        lines = ['@l{0}; push {0}; jump @l{1}'.format(n, n // 2)
+                 for n in range(200)]
+        parser = IncrementalParser('\n'.join(lines))
+        for n in range(0, 200, 3):
+            parser.edit(n, n + 1, ['nop', lines[n]])
+            lines[n:n + 1] = ['nop', lines[n]]
+        for n in range(len(lines) - 1, 0, -5):
+            if lines[n] == 'nop':
+                parser.edit(n, n + 1, [])
+                del lines[n]
+        assert parser.line_count == len(lines)
+        assert parser.instructions() == list(parse_program('\n'.join(lines)))
+    finally:
+        IncrementalParser.block_size = block_size
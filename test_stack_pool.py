@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+import stack
+import stack.bytecode
+from stack.pool import evaluate_many
+
+
+def test_evaluate_many():
+    programs = ['push {}; push 2; mul'.format(n) for n in range(50)]
+    results = list(evaluate_many(programs, processes=2, chunksize=7))
+    assert [result.index for result in results] == list(range(50))
+    assert [result.stack for result in results] == [[2 * n] for n in range(50)]
+
+    results = evaluate_many(programs, processes=2, chunksize=7, ordered=False)
+    assert sorted(result.index for result in results) == list(range(50))
+
+
+def test_precompiled_programs():
+    instructions = list(stack.parse_program('push 3; dup; mul'))
+    programs = [instructions, stack.bytecode.Bytecode.from_instructions(instructions)]
+    results = list(evaluate_many(programs, processes=1))
+    assert [result.stack for result in results] == [[9], [9]]
+
+
+def test_errors_and_budget():
+    programs = ['pop', 'nop; jump -1', 'push 1', 'horp']
+    results = list(evaluate_many(programs, processes=2, budget=1000))
+    assert isinstance(results[0].error, IndexError)
+    assert isinstance(results[1].error, stack.BudgetExceeded)
+    assert results[2] == (2, [1], None)
+    assert isinstance(results[3].error, ValueError)
+
+
+def test_budget():
+    programs = ['push 1; push 2', 'push 1; push 2; add', 'push 1; add']
+    results = list(evaluate_many(programs, processes=1, budget=2))
+    assert results[0] == (0, [1, 2], None)
+    # `push 2; add` is fused, but still counts as two instructions.
+    assert results[1].stack is None
+    assert isinstance(results[1].error, stack.BudgetExceeded)
+    assert isinstance(results[2].error, IndexError)
+    results = list(evaluate_many(programs[1:2], processes=1, budget=3))
+    assert results == [(0, [3], None)]
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import stack.cache
+from stack.server import Client, EvalServer, _percentile, main
+
+
+@pytest.fixture
+def server(tmp_path):
+    with EvalServer(str(tmp_path / 'fillmore.sock'), processes=2,
+                    budget=10000) as server:
+        yield server.start()
+
+
+def test_evaluate(server):
+    with Client(server.address) as client:
+        response = client.request(id=1, program='push 2; dup; mul',
+                                  stack=[1])
+        assert response == {'id': 1, 'stack': [1.0, 4.0],
+                            'hash': stack.cache.ProgramCache.key('push 2; dup; mul')}
+
+        # Any worker can find the program by its hash.
+        responses = client.pipeline([{'hash': response['hash'], 'stack': [n]}
+                                     for n in range(10)])
+        assert [r['stack'] for r in responses] == [[n, 4.0] for n in range(10)]
+        assert client.request(hash='0' * 64)['error']['type'] == 'KeyError'
+        assert client.request(hash='../x')['error']['type'] == 'KeyError'
+
+
+def test_pipelining(server):
+    programs = ['nop; push {}; @loop; push -1; add; quiet not; push 1; add; '
+                'jump; jump @loop'.format(n) for n in range(200, 0, -1)]
+    with Client(server.address) as client:
+        responses = client.pipeline(
+            [{'id': n, 'program': program} for n, program in enumerate(programs)])
+    assert [r['id'] for r in responses] == list(range(200))
+    assert all(r['stack'] == [0] for r in responses)
+
+
+def test_errors(server):
+    with Client(server.address) as client:
+        client.socket.sendall(b'{"program": \n["push 1"]\n')
+        responses = [client._file.readline() for _ in range(2)]
+        assert all(b'ValueError' in response for response in responses)
+
+        def error(**request):
+            return client.request(**request)['error']['type']
+        assert error(program='pop') == 'IndexError'
+        assert error(program='horp') == 'ValueError'
+        assert error(stack=[]) == 'ValueError'
+        assert error(program='nop; jump -1') == 'BudgetExceeded'
+        assert error(program='push 1; push 2', budget=1) == 'BudgetExceeded'
+        # Fused instructions still count one by one
+        assert error(program='push 1; push 2; add',
+                     budget=2) == 'BudgetExceeded'
+        assert error(program='push 1', budget=-1) == 'ValueError'
+        # The connection still works after all that.
+        assert client.request(program='push 1')['stack'] == [1]
+
+
+def test_stats(server):
+    with Client(server.address) as client:
+        client.pipeline([{'program': 'push 1'}, {'program': 'pop'}])
+        stats = client.request(stats=True, id='s')
+    assert stats['id'] == 's'
+    assert stats['requests'] == 2
+    assert stats['errors'] == 1
+    assert stats['connections'] == 1
+    assert stats['throughput'] > 0
+    latency = stats['latency']
+    assert 0 < latency['p50'] <= latency['p90'] <= latency['p99'] <= latency['max']
+
+
+def test_tcp():
+    with EvalServer(('127.0.0.1', 0), processes=1) as server:
+        server.start()
+        host, port = server.address
+        with Client((host, port)) as client:
+            assert client.request(program='push 3')['stack'] == [3]
+
+
+def test_bad_cache_directory(tmp_path, capsys):
+    missing = str(tmp_path / 'missing')
+    with pytest.raises(ValueError):
+        EvalServer(('127.0.0.1', 0), processes=1, cache_dir=missing)
+    with pytest.raises(SystemExit):
+        main(['--port', '0', '--cache', missing])
+    assert 'not a writable directory' in capsys.readouterr().err
+
+
+def test_percentile():
+    assert _percentile([], 50) is None
+    assert _percentile([1], 99) == 1
+    ordered = list(range(1, 101))
+    assert [_percentile(ordered, p) for p in (50, 90, 99)] == [50, 90, 99]